@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Benchmark suite of jsonrpclib
+
+Measures the time per operation of the serialization (dumps/loads, beans),
+of the dispatcher (single and batch calls), of the thread pool and of
+loopback calls between a ServerProxy and the servers.
+
+Results can be stored and compared to the ones of a previous run, to catch
+performance regressions before a release:
+
+    python benchmarks/suite.py --output /tmp/before.json
+    (apply changes)
+    python benchmarks/suite.py --compare /tmp/before.json
+
+The comparison exits with status 1 if a benchmark is slower than the
+threshold (10% by default).
+
+:license: Apache License 2.0
+"""
+
+# Standard library
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+# Tested module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import jsonrpclib
+import jsonrpclib.config
+import jsonrpclib.jsonclass
+import jsonrpclib.threadpool
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCDispatcher, \
+    SimpleJSONRPCServer, PooledJSONRPCServer
+
+# High-resolution clock
+clock = getattr(time, 'perf_counter', time.time)
+
+# ------------------------------------------------------------------------------
+
+
+class Bean(object):
+    """
+    Bean serialized by jsonclass
+    """
+    def __init__(self, name="bean", values=None):
+        self.name = name
+        self.values = values or [1, 2.5, "three"]
+        self.mapping = {"a": 1, "b": [True, None]}
+
+
+# Request parameters: a small structure of usual JSON types
+PARAMS = [{"id": 42, "name": "benchmark", "ratio": 0.5, "tags": ["a", "b"],
+           "enabled": True, "parent": None}, list(range(20))]
+
+# Size of the batch requests
+BATCH_SIZE = 10
+
+
+def _add(a, b):
+    """
+    Method called in the dispatcher and server benchmarks
+    """
+    return a + b
+
+
+def _noop():
+    """
+    Task doing nothing
+    """
+    pass
+
+# ------------------------------------------------------------------------------
+
+
+def bench_dumps():
+    """
+    Serialization of a request with jsonrpclib.dumps
+    """
+    return lambda: jsonrpclib.dumps(PARAMS, "method", rpcid=1)
+
+
+def bench_loads():
+    """
+    Parsing of a request with jsonrpclib.loads
+    """
+    data = jsonrpclib.dumps(PARAMS, "method", rpcid=1)
+    return lambda: jsonrpclib.loads(data)
+
+
+def bench_jsonclass_dump():
+    """
+    Conversion of beans into dictionaries
+    """
+    beans = [Bean(str(idx)) for idx in range(10)]
+    return lambda: jsonrpclib.jsonclass.dump(beans)
+
+
+def bench_jsonclass_load():
+    """
+    Conversion of dictionaries into beans
+    """
+    config = jsonrpclib.config.Config()
+    config.classes.add(Bean)
+    data = [jsonrpclib.jsonclass.dump(Bean(str(idx))) for idx in range(10)]
+    return lambda: [jsonrpclib.jsonclass.load(item, config.classes)
+                    for item in data]
+
+
+def _dispatcher():
+    """
+    Prepares a dispatcher with an "add" method
+    """
+    dispatcher = SimpleJSONRPCDispatcher()
+    dispatcher.register_function(_add, "add")
+    return dispatcher
+
+
+def bench_dispatch_single():
+    """
+    Dispatch of a single call by the dispatcher
+    """
+    dispatcher = _dispatcher()
+    data = jsonrpclib.dumps([1, 2], "add", rpcid=1)
+    return lambda: dispatcher._marshaled_dispatch(data)
+
+
+def bench_dispatch_batch():
+    """
+    Dispatch of a batch of calls by the dispatcher (time per batch)
+    """
+    dispatcher = _dispatcher()
+    data = "[{0}]".format(", ".join(
+        jsonrpclib.dumps([idx, 1], "add", rpcid=idx)
+        for idx in range(BATCH_SIZE)))
+    return lambda: dispatcher._marshaled_dispatch(data)
+
+
+def bench_threadpool():
+    """
+    Execution of a task by a thread pool (time per batch of 1000 tasks)
+    """
+    pool = jsonrpclib.threadpool.ThreadPool(4, 0, logname="benchmark")
+    pool.start()
+
+    def run():
+        for _ in range(1000):
+            pool.enqueue(_noop)
+        pool.join()
+
+    return run, pool.stop
+
+
+def _loopback(server_class):
+    """
+    Prepares a server and a client calling it
+    """
+    server = server_class(("localhost", 0), logRequests=False)
+    server.register_function(_add, "add")
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    client = jsonrpclib.ServerProxy("http://localhost:{0}".format(
+        server.socket.getsockname()[1]))
+
+    def stop():
+        client("close")()
+        server.shutdown()
+        server.server_close()
+
+    return lambda: client.add(1, 2), stop
+
+
+def bench_loopback_simple():
+    """
+    Call from a ServerProxy to a SimpleJSONRPCServer
+    """
+    return _loopback(SimpleJSONRPCServer)
+
+
+def bench_loopback_pooled():
+    """
+    Call from a ServerProxy to a PooledJSONRPCServer
+    """
+    return _loopback(PooledJSONRPCServer)
+
+
+# Benchmarks: (name, setup method, number of loops per run)
+BENCHMARKS = [
+    ("dumps", bench_dumps, 5000),
+    ("loads", bench_loads, 5000),
+    ("jsonclass_dump", bench_jsonclass_dump, 1000),
+    ("jsonclass_load", bench_jsonclass_load, 1000),
+    ("dispatch_single", bench_dispatch_single, 2000),
+    ("dispatch_batch", bench_dispatch_batch, 500),
+    ("threadpool", bench_threadpool, 10),
+    ("loopback_simple", bench_loopback_simple, 200),
+    ("loopback_pooled", bench_loopback_pooled, 200),
+]
+
+# ------------------------------------------------------------------------------
+
+
+def measure(setup, loops, repeat):
+    """
+    Measures the time per call of a benchmark
+
+    :param setup: Method preparing the benchmark, returning the method to
+                  call or a (method, cleanup method) tuple
+    :param loops: Number of calls per run
+    :param repeat: Number of runs
+    :return: The list of the times per call of each run, in seconds
+    """
+    prepared = setup()
+    if isinstance(prepared, tuple):
+        method, cleanup = prepared
+    else:
+        method, cleanup = prepared, None
+
+    try:
+        # Warm up
+        method()
+
+        runs = []
+        for _ in range(repeat):
+            start = clock()
+            for _ in range(loops):
+                method()
+            runs.append((clock() - start) / loops)
+        return runs
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+
+def run_suite(names=None, repeat=5, scale=1.0):
+    """
+    Runs the benchmarks
+
+    :param names: Names of the benchmarks to run (all if None)
+    :param repeat: Number of runs per benchmark
+    :param scale: Factor applied to the number of loops per run
+    :return: A dictionary: name -> {"best": ..., "runs": [...]}
+    """
+    results = {}
+    for name, setup, loops in BENCHMARKS:
+        if names and name not in names:
+            continue
+
+        runs = measure(setup, max(1, int(loops * scale)), repeat)
+        results[name] = {"best": min(runs), "runs": runs}
+    return results
+
+
+def compare(results, reference, threshold):
+    """
+    Compares results to the ones of a previous run
+
+    :param results: Current results
+    :param reference: Results of the previous run
+    :param threshold: Relative slow down considered as a regression
+    :return: The list of (name, current, previous, ratio) tuples of the
+             benchmarks present in both runs, and the list of the names of
+             the regressed benchmarks
+    """
+    rows = []
+    regressions = []
+    for name, result in sorted(results.items()):
+        previous = reference.get(name)
+        if previous is None:
+            continue
+
+        ratio = result["best"] / previous["best"]
+        rows.append((name, result["best"], previous["best"], ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def _format_time(value):
+    """
+    Formats a time per operation
+    """
+    if value < 1e-3:
+        return "{0:.2f} us".format(value * 1e6)
+    return "{0:.3f} ms".format(value * 1e3)
+
+
+def main(argv=None):
+    """
+    Entry point
+    """
+    parser = argparse.ArgumentParser(description="jsonrpclib benchmarks")
+    parser.add_argument("names", nargs="*", metavar="NAME",
+                        help="Benchmarks to run (default: all)")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="Number of runs (the best one is kept)")
+    parser.add_argument("-s", "--scale", type=float, default=1.0,
+                        help="Factor applied to the number of loops")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="Stores the results in a JSON file")
+    parser.add_argument("-c", "--compare", metavar="FILE",
+                        help="Compares with the results of a previous run")
+    parser.add_argument("-t", "--threshold", type=float, default=0.1,
+                        help="Slow down considered as a regression "
+                             "(default: 0.1, i.e. 10%%)")
+    parser.add_argument("-l", "--list", action="store_true",
+                        help="Lists the benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, setup, _ in BENCHMARKS:
+            print("{0:<16} {1}".format(name, setup.__doc__.strip()))
+        return 0
+
+    unknown = set(args.names) - set(name for name, _, _ in BENCHMARKS)
+    if unknown:
+        parser.error("Unknown benchmarks: {0}"
+                     .format(", ".join(sorted(unknown))))
+
+    results = run_suite(args.names, args.repeat, args.scale)
+    for name, setup, _ in BENCHMARKS:
+        if name in results:
+            print("{0:<16} {1:>12}".format(
+                name, _format_time(results[name]["best"])))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"python": platform.python_version(),
+                       "implementation": platform.python_implementation(),
+                       "benchmarks": results}, output, indent=2,
+                      sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as reference_file:
+            reference = json.load(reference_file)
+
+        rows, regressions = compare(results, reference["benchmarks"],
+                                    args.threshold)
+        print("\n{0:<16} {1:>12} {2:>12} {3:>8}".format(
+            "benchmark", "current", "previous", "ratio"))
+        for name, current, previous, ratio in rows:
+            print("{0:<16} {1:>12} {2:>12} {3:>7.2f}x{4}".format(
+                name, _format_time(current), _format_time(previous), ratio,
+                " (regression)" if name in regressions else ""))
+
+        if regressions:
+            print("\nRegressions: {0}".format(", ".join(regressions)))
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Throughput benchmark of the thread pool
+
+Measures the number of tasks per second a ThreadPool executes, with one or
+more producer threads. Another implementation of the thread pool module can
+be given to compare both, e.g. the one of a previous revision:
+
+    git show <revision>:jsonrpclib/threadpool.py > /tmp/threadpool_old.py
+    python benchmarks/threadpool.py --compare /tmp/threadpool_old.py
+
+:license: Apache License 2.0
+"""
+
+# Standard library
+import argparse
+import os
+import sys
+import threading
+import time
+
+# Tested module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import jsonrpclib.threadpool
+
+# ------------------------------------------------------------------------------
+
+
+def load_module(name, path):
+    """
+    Loads a module from a source file
+
+    :param name: Name of the module
+    :param path: Path to the source file
+    :return: The loaded module
+    """
+    try:
+        # Python 3
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except ImportError:
+        # Python 2
+        import imp
+        return imp.load_source(name, path)
+
+
+def _noop():
+    """
+    Task doing nothing
+    """
+    pass
+
+
+def run(module, nb_tasks, nb_producers, max_threads, min_threads):
+    """
+    Runs the benchmark on the ThreadPool class of the given module
+
+    :param module: Module providing the ThreadPool class
+    :param nb_tasks: Number of tasks enqueued by each producer
+    :param nb_producers: Number of producer threads
+    :param max_threads: Maximum size of the pool
+    :param min_threads: Minimum size of the pool
+    :return: The number of tasks executed per second
+    """
+    pool = module.ThreadPool(max_threads, min_threads)
+    pool.start()
+
+    def produce():
+        for _ in range(nb_tasks):
+            pool.enqueue(_noop)
+
+    producers = [threading.Thread(target=produce)
+                 for _ in range(nb_producers)]
+
+    start = time.time()
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    pool.join()
+    duration = time.time() - start
+
+    pool.stop()
+    return nb_tasks * nb_producers / duration
+
+
+def main(argv=None):
+    """
+    Entry point
+    """
+    parser = argparse.ArgumentParser(description="Thread pool throughput")
+    parser.add_argument("-n", "--tasks", type=int, default=20000,
+                        help="Number of tasks per producer")
+    parser.add_argument("-p", "--producers", type=int, default=(1, 4),
+                        nargs="+", help="Numbers of producer threads")
+    parser.add_argument("-t", "--threads", type=int, default=(1, 8),
+                        nargs="+", help="Maximum sizes of the pool")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of runs (the best one is kept)")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="Thread pool module to compare with")
+    args = parser.parse_args(argv)
+
+    modules = [("current", jsonrpclib.threadpool)]
+    if args.compare:
+        modules.append(
+            ("compared", load_module("threadpool_compared", args.compare)))
+
+    print("{0:>9} {1:>9} {2:>9} {3:>14}".format(
+        "pool", "producers", "threads", "tasks/s"))
+    for nb_producers in args.producers:
+        for max_threads in args.threads:
+            for name, module in modules:
+                best = max(run(module, args.tasks, nb_producers, max_threads,
+                               0) for _ in range(args.repeat))
+                print("{0:>9} {1:>9} {2:>9} {3:>14.0f}".format(
+                    name, nb_producers, max_threads, best))
+
+
+if __name__ == "__main__":
+    main()
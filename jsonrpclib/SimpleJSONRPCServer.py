@@ -27,9 +27,14 @@ CGI request handler.
 """
 
 # Standard library
+import functools
+import inspect
 import logging
+import random
+import re
 import socket
 import sys
+import threading
 import traceback
 
 try:
@@ -42,6 +47,7 @@ try:
     SimpleXMLRPCDispatcher = xmlrpcserver.SimpleXMLRPCDispatcher
     SimpleXMLRPCRequestHandler = xmlrpcserver.SimpleXMLRPCRequestHandler
     resolve_dotted_attribute = xmlrpcserver.resolve_dotted_attribute
+    import queue
     import socketserver
 except (ImportError, AttributeError):
     # Python 2 or IronPython
@@ -50,6 +56,7 @@ except (ImportError, AttributeError):
     SimpleXMLRPCDispatcher = xmlrpcserver.SimpleXMLRPCDispatcher
     SimpleXMLRPCRequestHandler = xmlrpcserver.SimpleXMLRPCRequestHandler
     resolve_dotted_attribute = xmlrpcserver.resolve_dotted_attribute
+    import Queue as queue
     import SocketServer as socketserver
 
 try:
@@ -62,7 +69,11 @@ except ImportError:
 
 # Local modules
 from jsonrpclib import Fault
+import jsonrpclib.cache
 import jsonrpclib.config
+import jsonrpclib.jsonrpc
+import jsonrpclib.metrics
+import jsonrpclib.profiling
 import jsonrpclib.utils as utils
 import jsonrpclib.threadpool
 
@@ -78,9 +89,131 @@ __docformat__ = "restructuredtext en"
 # Prepare the logger
 _logger = logging.getLogger(__name__)
 
+# Context of the request handled by the current thread
+_request_context = threading.local()
+
+# Patterns used to guess the priority of a request from its first bytes
+_PRIORITY_HEADER_PATTERN = re.compile(
+    br'^' + re.escape(utils.to_bytes(jsonrpclib.jsonrpc.PRIORITY_HEADER))
+    + br'[ \t]*:[ \t]*(-?\d+)', re.IGNORECASE | re.MULTILINE)
+_METHOD_PATTERN = re.compile(br'"method"\s*:\s*"([^"\\]+)"')
+
+# Maximum number of rejected connections waiting to be drained: above it,
+# connections are closed directly
+_REJECT_QUEUE_SIZE = 64
+
+# Maximum time spent draining a rejected connection, in seconds
+_DRAIN_TIMEOUT = 1.0
+
 # ------------------------------------------------------------------------------
 
 
+def get_deadline():
+    """
+    Returns the deadline of the request handled by the current thread, as
+    given by the client in the X-JSONRPC-Timeout header
+
+    :return: The deadline as a jsonrpclib.utils.monotonic() time, or None
+    """
+    return getattr(_request_context, 'deadline', None)
+
+
+def get_remaining_time():
+    """
+    Returns the time budget left to the request handled by the current
+    thread. It can be given to the calls made to other servers, using the
+    _call_timeout() method of ServerProxy.
+
+    :return: The remaining time in seconds (0 if the deadline has passed), or
+             None if the request has no deadline
+    """
+    deadline = get_deadline()
+    if deadline is None:
+        return None
+
+    return max(0, deadline - utils.monotonic())
+
+
+def get_client_address():
+    """
+    Returns the address of the client of the request handled by the current
+    thread
+
+    :return: The client address, or None
+    """
+    return getattr(_request_context, 'client_address', None)
+
+
+def get_request_header(name, default=None):
+    """
+    Returns a header of the HTTP request handled by the current thread
+
+    :param name: Name of the header (case-insensitive)
+    :param default: Value returned if the header is missing
+    :return: The value of the header, or the default one
+    """
+    headers = getattr(_request_context, 'headers', None)
+    if headers is None:
+        return default
+
+    return headers.get(name, default)
+
+
+def client_host_key(method, params):
+    """
+    Ordering key of notifications: the host of the client.
+    See SimpleJSONRPCDispatcher.set_notification_pool()
+
+    :param method: Name of the notified method
+    :param params: Notification parameters
+    :return: The client host, or None
+    """
+    address = get_client_address()
+    if not address:
+        return None
+
+    return address[0]
+
+
+def header_key(name):
+    """
+    Prepares an ordering key of notifications, based on a request header
+    (e.g. a session identifier).
+    See SimpleJSONRPCDispatcher.set_notification_pool()
+
+    :param name: Name of the HTTP header
+    :return: A key method, returning the value of the header or None
+    """
+    def key(method, params):
+        return get_request_header(name)
+    return key
+
+
+def param_key(name):
+    """
+    Prepares an ordering key of notifications, based on a parameter.
+    See SimpleJSONRPCDispatcher.set_notification_pool()
+
+    :param name: Name (for keyword parameters) or index (for positional
+                 parameters) of the parameter
+    :return: A key method, returning the value of the parameter or None
+    """
+    def key(method, params):
+        try:
+            value = params[name]
+        except (KeyError, IndexError, TypeError):
+            return None
+
+        try:
+            hash(value)
+        except TypeError:
+            # Not usable as a key
+            return None
+
+        return value
+    return key
+
+
 def get_version(request):
     """
     Computes the JSON-RPC version
@@ -142,6 +275,223 @@ def validate_request(request, json_config):
     # Valid request
     return True
 
+
+def server_error(config, exc_info=None):
+    """
+    Prepares a Fault describing a server-side exception, with the level of
+    detail defined by the fault_detail entry of the configuration.
+
+    Only the last frame of the traceback is visited in the default
+    FAULT_DETAIL_LAST_FRAME mode, the traceback is formatted in the
+    FAULT_DETAIL_FULL mode only.
+
+    :param config: A JSONRPClib Config instance
+    :param exc_info: Exception information tuple (current exception if None)
+    :return: A Fault object
+    """
+    exc_type, exc_value, exc_tb = exc_info or sys.exc_info()
+    detail = getattr(config, 'fault_detail',
+                     jsonrpclib.config.FAULT_DETAIL_LAST_FRAME)
+
+    if detail == jsonrpclib.config.FAULT_DETAIL_NONE:
+        message = 'Server error'
+    elif detail == jsonrpclib.config.FAULT_DETAIL_FULL:
+        message = 'Server error: {0}'.format(''.join(
+            traceback.format_exception(exc_type, exc_value, exc_tb)))
+    else:
+        # Only use the last frame
+        exc_line = traceback.format_exception_only(exc_type, exc_value)[-1]
+        if exc_tb is None:
+            message = 'Server error: {0}'.format(exc_line)
+        else:
+            while exc_tb.tb_next is not None:
+                exc_tb = exc_tb.tb_next
+
+            code = exc_tb.tb_frame.f_code
+            message = 'Server error: File "{0}", line {1}, in {2} | {3}' \
+                .format(code.co_filename, exc_tb.tb_lineno, code.co_name,
+                        exc_line)
+
+    return Fault(-32603, message, config=config)
+
+
+def log_server_error(message, fault, config):
+    """
+    Logs a server-side exception. Only a sample of the exceptions, defined by
+    the trace_log_rate entry of the configuration, is logged with its
+    traceback.
+
+    Must be called while handling the exception.
+
+    :param message: Log message, with a placeholder for the fault
+    :param fault: The Fault describing the exception
+    :param config: A JSONRPClib Config instance
+    """
+    rate = getattr(config, 'trace_log_rate', 1.0)
+    if rate >= 1 or (rate > 0 and random.random() < rate):
+        _logger.exception(message, fault)
+    else:
+        _logger.error(message, fault)
+
+
+def _is_overridden(instance, name, base):
+    """
+    Checks if the class of an instance overrides a method of a base class
+
+    :param instance: An instance of a subclass of base
+    :param name: Name of the method
+    :param base: The base class defining the method
+    :return: True if the method is overridden
+    """
+    for klass in type(instance).__mro__:
+        if name in vars(klass):
+            return klass is not base
+    return False
+
+# ------------------------------------------------------------------------------
+
+
+class ParametersChecker(object):
+    """
+    Checks the parameters of a call against the signature of a method.
+
+    The signature is introspected once, when the checker is created, so that
+    invalid calls can be rejected without entering the method.
+    """
+    def __init__(self, func):
+        """
+        Introspects the signature of the given method
+
+        :param func: The method to check parameters for
+        :raise ValueError: The signature of the method can't be introspected
+        """
+        self.func = func
+
+        # Positional parameters
+        self.positional = []
+        self.nb_required = 0
+        self.var_positional = False
+
+        # Keyword parameters
+        self.keywords = set()
+        self.required_keywords = set()
+        self.var_keyword = False
+
+        # Parameters which can't be given by name
+        self.positional_only = set()
+
+        try:
+            signature = inspect.signature(func)
+        except AttributeError:
+            # Python 2
+            self.__load_argspec(func)
+        except TypeError as ex:
+            # Not a callable
+            raise ValueError(ex)
+        else:
+            self.__load_signature(signature)
+
+        # Calls with any parameters are always valid
+        self.accepts_all = self.var_positional and self.var_keyword \
+            and not self.nb_required and not self.required_keywords
+
+    def __load_signature(self, signature):
+        """
+        Loads the description of the parameters from an inspect.Signature
+
+        :param signature: The signature of the method
+        """
+        # pylint: disable=E1101
+        param_kind = inspect.Parameter
+        for name, param in signature.parameters.items():
+            has_default = param.default is not param_kind.empty
+            if param.kind == param_kind.VAR_POSITIONAL:
+                self.var_positional = True
+            elif param.kind == param_kind.VAR_KEYWORD:
+                self.var_keyword = True
+            elif param.kind == param_kind.KEYWORD_ONLY:
+                self.keywords.add(name)
+                if not has_default:
+                    self.required_keywords.add(name)
+            else:
+                self.positional.append(name)
+                if not has_default:
+                    self.nb_required += 1
+
+                if param.kind == param_kind.POSITIONAL_ONLY:
+                    self.positional_only.add(name)
+                else:
+                    self.keywords.add(name)
+
+    def __load_argspec(self, func):
+        """
+        Loads the description of the parameters using inspect.getargspec()
+        (Python 2)
+
+        :param func: The method to check parameters for
+        """
+        if inspect.isclass(func):
+            func = func.__init__
+        elif not inspect.isroutine(func):
+            func = func.__call__
+
+        # pylint: disable=W1505
+        spec = inspect.getargspec(func)
+        args = list(spec.args)
+        if inspect.ismethod(func) and func.__self__ is not None:
+            # Ignore the "self" argument of bound methods
+            args = args[1:]
+
+        self.positional = args
+        self.nb_required = len(args) - len(spec.defaults or ())
+        self.var_positional = spec.varargs is not None
+        self.var_keyword = spec.keywords is not None
+        self.keywords.update(args)
+
+    def check(self, params):
+        """
+        Checks if the given parameters can be used to call the method
+
+        :param params: A list of positional parameters or a dictionary of
+                       keyword parameters
+        :return: None if the parameters are valid, else an error message
+        """
+        if self.accepts_all:
+            # Fast path
+            return None
+
+        if isinstance(params, utils.ListType):
+            nb_params = len(params)
+            if nb_params < self.nb_required:
+                return "missing {0} required positional argument(s): {1}" \
+                    .format(self.nb_required - nb_params,
+                            ', '.join(self.positional[nb_params:
+                                                      self.nb_required]))
+            elif nb_params > len(self.positional) \
+                    and not self.var_positional:
+                return "takes {0} positional argument(s) but {1} were given" \
+                    .format(len(self.positional), nb_params)
+            elif self.required_keywords:
+                return "missing required keyword-only argument(s): {0}" \
+                    .format(', '.join(sorted(self.required_keywords)))
+        else:
+            if not self.var_keyword:
+                unknown = [name for name in params
+                           if name not in self.keywords]
+                if unknown:
+                    return "unexpected keyword argument(s): {0}" \
+                        .format(', '.join(sorted(unknown)))
+
+            missing = [name for name in self.positional[:self.nb_required]
+                       if name not in params or name in self.positional_only]
+            missing.extend(name for name in self.required_keywords
+                           if name not in params)
+            if missing:
+                return "missing required argument(s): {0}" \
+                    .format(', '.join(missing))
+
+        return None
+
 # ------------------------------------------------------------------------------
 
 
@@ -171,12 +521,303 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
 
         # Notification thread pool
         self.__notification_pool = None
+        self.__notification_key = None
+
+        # Cache of the methods resolved in the registered instance:
+        # Method name -> bound method
+        self.__method_cache = {}
+        self.__cached_instance = None
+        self.__instance_dispatch = None
+
+        # Parameters checkers: Method name -> ParametersChecker
+        self.__checkers = {}
+
+        # Results caches: Method name -> LRUCache
+        self.__result_caches = {}
+
+        # Methods sharing the results of identical concurrent calls
+        self.__single_flight_methods = set()
+        self.__single_flight = jsonrpclib.cache.SingleFlight(_logger)
+
+        # Concurrency limits: Method name -> Bulkhead
+        self.__bulkheads = {}
+
+        # Scheduling priorities: Method name -> priority
+        self.__priorities = {}
+
+        # Metrics
+        self.__metrics = None
+        self.metrics_path = None
+
+        # Profiler of the request pipeline
+        self.__profiler = None
 
-    def set_notification_pool(self, thread_pool):
+        # Marshaled requests go through _unmarshaled_dispatch() if a subclass
+        # overrides one of the dispatch hooks
+        self.__dispatch_hooks = any(
+            _is_overridden(self, name, SimpleJSONRPCDispatcher)
+            for name in ('_unmarshaled_dispatch',
+                         '_marshaled_single_dispatch'))
+
+    def set_notification_pool(self, thread_pool, ordering_key=None):
         """
         Sets the thread pool to use to handle notifications
+
+        If the pool is a KeyedExecutor, the notifications with the same
+        ordering key are executed in the order they were received. The
+        ordering key is computed by a ``key(method, params)`` method, which
+        can use get_client_address() and get_request_header(), e.g.
+        client_host_key, header_key("X-Session") or param_key("user").
+        Notifications with a None key are not ordered.
+
+        :param thread_pool: A ThreadPool, PriorityThreadPool or
+                            KeyedExecutor (None to handle notifications
+                            synchronously)
+        :param ordering_key: Method computing the ordering key of a
+                             notification
         """
         self.__notification_pool = thread_pool
+        self.__notification_key = ordering_key
+
+    def set_metrics(self, registry, path="/metrics"):
+        """
+        Records the metrics of the server (calls, errors by code, latency
+        per method, calls answered from the results caches, calls in
+        progress, bytes received and sent) in the given registry. The
+        metrics of thread pools can be added with
+        jsonrpclib.metrics.register_thread_pool(), e.g. for the request_pool
+        of a PooledJSONRPCServer.
+
+        :param registry: A jsonrpclib.metrics.Registry, or None to stop
+                         recording metrics
+        :param path: HTTP path where the request handler serves the metrics
+                     in the Prometheus text format (None to deactivate)
+        """
+        if registry is None:
+            self.__metrics = None
+            self.metrics_path = None
+        else:
+            self.__metrics = jsonrpclib.metrics.ServerMetrics(registry)
+            self.metrics_path = path
+
+    def get_metrics(self):
+        """
+        Returns the metrics of the server
+
+        :return: A jsonrpclib.metrics.ServerMetrics object, or None
+        """
+        return self.__metrics
+
+    def set_profiler(self, profiler):
+        """
+        Traces the stages of the requests (read, loads, validate, call,
+        dump, write) with the given profiler
+
+        :param profiler: A jsonrpclib.profiling.Profiler, or None to stop
+                         profiling
+        """
+        self.__profiler = profiler
+
+    def get_profiler(self):
+        """
+        Returns the profiler of the request pipeline
+
+        :return: A jsonrpclib.profiling.Profiler, or None
+        """
+        return self.__profiler
+
+    def set_method_priority(self, method, priority):
+        """
+        Sets the scheduling priority of the given method, used when its
+        calls are queued in a PriorityThreadPool: the lowest value is
+        executed first.
+
+        The priority is read from the bytes received when the request is
+        accepted: see get_request_priority() for its limits.
+
+        :param method: Name of the method
+        :param priority: Priority of the method, or None to use the default
+                         priority of the pool
+        """
+        if priority is None:
+            self.__priorities.pop(method, None)
+        else:
+            self.__priorities[method] = priority
+
+    def get_method_priority(self, method):
+        """
+        Returns the scheduling priority of the given method
+
+        :param method: Name of the method
+        :return: The priority of the method, or None
+        """
+        return self.__priorities.get(method)
+
+    def register_function(self, function=None, name=None, cache=None,
+                          single_flight=False, bulkhead=None):
+        """
+        Registers a function to respond to JSON-RPC requests.
+        Clears the resolved methods cache.
+
+        Can be used as a decorator, by giving only keyword arguments.
+
+        :param function: The function to register
+        :param name: The name of the method (function name by default)
+        :param cache: An optional jsonrpclib.cache.LRUCache instance, to
+                      store the results of the function. Only use it for
+                      idempotent functions.
+        :param single_flight: If True, identical concurrent calls share the
+                              result of a single execution of the function
+                              (see set_single_flight())
+        :param bulkhead: An optional jsonrpclib.threadpool.Bulkhead instance,
+                         limiting the concurrent calls of the function
+                         (see set_bulkhead())
+        :return: The registered function
+        """
+        if function is None:
+            # Decorator factory
+            return functools.partial(
+                self.register_function, name=name, cache=cache,
+                single_flight=single_flight, bulkhead=bulkhead)
+
+        name = name or function.__name__
+        SimpleXMLRPCDispatcher.register_function(self, function, name)
+        self.clear_method_cache()
+
+        # Introspect the signature of the function once for all
+        self.__get_checker(name, function)
+
+        # Set up the results cache
+        self.set_result_cache(name, cache)
+        self.set_single_flight(name, single_flight)
+        self.set_bulkhead(name, bulkhead)
+        return function
+
+    def set_bulkhead(self, method, bulkhead):
+        """
+        Sets the bulkhead limiting the concurrent calls of the given method.
+
+        The same Bulkhead instance can be shared by a group of methods.
+        Calls above the limit of the bulkhead are rejected with a -32001
+        "Method busy" error. If the bulkhead allows waiting calls, they wait
+        for their turn, up to its limit of waiting calls and its timeout.
+        Waiting calls hold the worker threads of the server, which are shared
+        by all methods.
+
+        :param method: Name of the method
+        :param bulkhead: A jsonrpclib.threadpool.Bulkhead instance, or None
+                         to remove the limit
+        """
+        if bulkhead is None:
+            self.__bulkheads.pop(method, None)
+        else:
+            self.__bulkheads[method] = bulkhead
+
+    def set_single_flight(self, method, enabled=True):
+        """
+        Sets the single-flight mode of the given method.
+
+        In this mode, calls made while an identical call (same method, same
+        parameters) is running wait for its result instead of executing the
+        method again. This protects backends from bursts of identical calls
+        to expensive idempotent methods.
+
+        :param method: Name of the method
+        :param enabled: If True, activate the single-flight mode
+        """
+        if enabled:
+            self.__single_flight_methods.add(method)
+        else:
+            self.__single_flight_methods.discard(method)
+
+    def set_result_cache(self, method, cache):
+        """
+        Sets the cache storing the results of the given method.
+
+        The results are stored in their JSON form, hence cache hits skip
+        both the method call and the serialization of the result.
+        Only methods which results only depend on their parameters should be
+        cached.
+
+        :param method: Name of the method
+        :param cache: A jsonrpclib.cache.LRUCache instance, or None to
+                      remove the cache of the method
+        """
+        if cache is None:
+            self.__result_caches.pop(method, None)
+        else:
+            self.__result_caches[method] = cache
+
+    def get_result_cache(self, method):
+        """
+        Returns the cache storing the results of the given method
+
+        :param method: Name of the method
+        :return: A jsonrpclib.cache.LRUCache instance or None
+        """
+        return self.__result_caches.get(method)
+
+    def register_instance(self, instance, allow_dotted_names=False):
+        """
+        Registers an instance to respond to JSON-RPC requests.
+        Clears the resolved methods cache.
+
+        :param instance: The instance handling requests
+        :param allow_dotted_names: Kept for compatibility with xmlrpclib
+                                   (dotted names are always resolved)
+        """
+        SimpleXMLRPCDispatcher.register_instance(
+            self, instance, allow_dotted_names)
+        self.clear_method_cache()
+
+    def clear_method_cache(self):
+        """
+        Clears the cache of the methods resolved in the registered instance
+        """
+        self.__method_cache = {}
+        self.__cached_instance = self.instance
+        self.__instance_dispatch = getattr(self.instance, '_dispatch', None)
+        self.__checkers = dict(
+            (name, checker) for name, checker in self.__checkers.items()
+            if checker is not None and self.funcs.get(name) is checker.func)
+
+    def __get_checker(self, method, func):
+        """
+        Returns the parameters checker of the given method, introspecting its
+        signature if necessary
+
+        :param method: Name of the method
+        :param func: The method implementation
+        :return: A ParametersChecker or None if the signature is unknown
+        """
+        checker = self.__checkers.get(method)
+        if checker is None or checker.func is not func:
+            try:
+                checker = ParametersChecker(func)
+            except (TypeError, ValueError):
+                # Signature can't be introspected (built-in method, ...)
+                checker = None
+
+            self.__checkers[method] = checker
+
+        return checker
+
+    def __resolve_instance_method(self, method):
+        """
+        Looks for the given method in the registered instance, using the
+        resolved methods cache
+
+        :param method: Name of the method
+        :return: The method found in the instance
+        :raise AttributeError: Unknown method
+        """
+        cache = self.__method_cache
+        try:
+            return cache[method]
+        except KeyError:
+            func = resolve_dotted_attribute(self.instance, method, True)
+            cache[method] = func
+            return func
 
     def _unmarshaled_dispatch(self, request, dispatch_method=None):
         """
@@ -189,31 +830,56 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
                  was a notification
         :raise NoMulticallResult: No result in batch
         """
+        return self.__dispatch_request(request, dispatch_method, False)
+
+    def __dispatch_request(self, request, dispatch_method, marshal):
+        """
+        Calls the method(s) described in the given request dictionary
+
+        :param request: JSON-RPC request dictionary (or list of)
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :param marshal: If True, responses are returned as JSON strings
+        :return: A JSON-RPC dictionary or string (or an array of) or None if
+                 the request was a notification
+        :raise NoMulticallResult: No result in batch
+        """
         if not request:
             # Invalid request dictionary
             fault = Fault(-32600, 'Request invalid -- no request data.',
                           config=self.json_config)
             _logger.warning("Invalid request: %s", fault)
-            return fault.dump()
+            return fault.response() if marshal else fault.dump()
+
+        trace = None
+        if self.__profiler is not None:
+            trace = jsonrpclib.profiling.current_trace()
 
         if isinstance(request, utils.ListType):
             # This SHOULD be a batch, by spec
             responses = []
             for req_entry in request:
                 # Validate the request
-                result = validate_request(req_entry, self.json_config)
+                if trace is not None:
+                    start = trace.begin(jsonrpclib.profiling.STAGE_VALIDATE)
+                    result = validate_request(req_entry, self.json_config)
+                    trace.end(jsonrpclib.profiling.STAGE_VALIDATE, start)
+                else:
+                    result = validate_request(req_entry, self.json_config)
                 if isinstance(result, Fault):
-                    responses.append(result.dump())
+                    responses.append(
+                        result.response() if marshal else result.dump())
                     continue
 
                 # Call the method
-                resp_entry = self._marshaled_single_dispatch(
-                    req_entry, dispatch_method)
+                resp_entry = self.__call_single_dispatch(
+                    req_entry, dispatch_method, marshal)
 
                 # Store its result
                 if isinstance(resp_entry, Fault):
                     # pylint: disable=E1103
-                    responses.append(resp_entry.dump())
+                    responses.append(
+                        resp_entry.response() if marshal
+                        else resp_entry.dump())
                 elif resp_entry is not None:
                     responses.append(resp_entry)
 
@@ -226,16 +892,21 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
 
         else:
             # Single call
-            result = validate_request(request, self.json_config)
+            if trace is not None:
+                start = trace.begin(jsonrpclib.profiling.STAGE_VALIDATE)
+                result = validate_request(request, self.json_config)
+                trace.end(jsonrpclib.profiling.STAGE_VALIDATE, start)
+            else:
+                result = validate_request(request, self.json_config)
             if isinstance(result, Fault):
-                return result.dump()
+                return result.response() if marshal else result.dump()
 
             # Call the method
-            response = self._marshaled_single_dispatch(
-                request, dispatch_method)
+            response = self.__call_single_dispatch(
+                request, dispatch_method, marshal)
             if isinstance(response, Fault):
                 # pylint: disable=E1103
-                return response.dump()
+                return response.response() if marshal else response.dump()
 
             return response
 
@@ -249,7 +920,46 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
         :param path: Unused parameter, to keep compatibility with xmlrpclib
         :return: A JSON-RPC response string (marshaled)
         """
+        profiler = self.__profiler
+        if profiler is None:
+            return self.__marshaled_dispatch(data, dispatch_method)
+
+        trace = jsonrpclib.profiling.current_trace()
+        if trace is not None:
+            # Request traced by the request handler
+            start = trace.begin(jsonrpclib.profiling.STAGE_DISPATCH)
+            try:
+                return self.__marshaled_dispatch(data, dispatch_method, trace)
+            finally:
+                trace.end(jsonrpclib.profiling.STAGE_DISPATCH, start)
+
+        trace = profiler.start_request()
+        if trace is None:
+            # Not sampled
+            return self.__marshaled_dispatch(data, dispatch_method)
+
+        try:
+            start = trace.begin(jsonrpclib.profiling.STAGE_DISPATCH)
+            try:
+                return self.__marshaled_dispatch(data, dispatch_method, trace)
+            finally:
+                trace.end(jsonrpclib.profiling.STAGE_DISPATCH, start)
+        finally:
+            profiler.end_request(trace)
+
+    def __marshaled_dispatch(self, data, dispatch_method, trace=None):
+        """
+        Parses the request data (marshaled), calls method(s) and returns a
+        JSON string (marshaled)
+
+        :param data: A JSON request string
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :param trace: The RequestTrace of the request, if it is profiled
+        :return: A JSON-RPC response string (marshaled)
+        """
         # Parse the request
+        if trace is not None:
+            start = trace.begin(jsonrpclib.profiling.STAGE_LOADS)
         try:
             request = jsonrpclib.loads(data, self.json_config)
         except Exception as ex:
@@ -259,20 +969,52 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
                           config=self.json_config)
             _logger.warning("Error parsing request: %s", fault)
             return fault.response()
+        finally:
+            if trace is not None:
+                trace.end(jsonrpclib.profiling.STAGE_LOADS, start)
 
-        # Get the response dictionary
-        try:
-            response = self._unmarshaled_dispatch(request, dispatch_method)
-            if response is not None:
-                # Compute the string representation of the dictionary/list
+        if self.__dispatch_hooks:
+            # Keep the behaviour of the overridden dispatch methods
+            try:
+                response = self._unmarshaled_dispatch(request, dispatch_method)
+                if response is None:
+                    # No result (notification)
+                    return ''
                 return jsonrpclib.jdumps(response, self.encoding)
-            else:
+            except NoMulticallResult:
+                # Return an empty string (jsonrpclib internal behaviour)
+                return ''
+
+        # Get the response string(s)
+        try:
+            response = self.__dispatch_request(request, dispatch_method, True)
+            if response is None:
                 # No result (notification)
                 return ''
+            elif isinstance(response, utils.ListType):
+                # Batch: join the responses strings
+                return '[{0}]'.format(', '.join(response))
+            else:
+                return response
         except NoMulticallResult:
             # Return an empty string (jsonrpclib internal behaviour)
             return ''
 
+    def __call_single_dispatch(self, request, dispatch_method, marshal):
+        """
+        Dispatches a single method call, using the overridable
+        _marshaled_single_dispatch() method for unmarshaled responses
+
+        :param request: A validated request dictionary
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :param marshal: If True, return the response as a JSON string
+        :return: A JSON-RPC response dictionary (or string), or None if it was
+                 a notification request
+        """
+        if marshal:
+            return self.__single_dispatch(request, dispatch_method, True)
+        return self._marshaled_single_dispatch(request, dispatch_method)
+
     def _marshaled_single_dispatch(self, request, dispatch_method=None):
         """
         Dispatches a single method call
@@ -282,6 +1024,18 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
         :return: A JSON-RPC response dictionary, or None if it was a
                  notification request
         """
+        return self.__single_dispatch(request, dispatch_method, False)
+
+    def __single_dispatch(self, request, dispatch_method, marshal):
+        """
+        Dispatches a single method call
+
+        :param request: A validated request dictionary
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :param marshal: If True, return the response as a JSON string
+        :return: A JSON-RPC response dictionary (or string), or None if it was
+                 a notification request
+        """
         method = request.get('method')
         params = request.get('params')
 
@@ -300,19 +1054,65 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
         if is_notification and self.__notification_pool is not None:
             # Use the thread pool for notifications
             if dispatch_method is not None:
-                self.__notification_pool.enqueue(
-                    dispatch_method, method, params)
+                task = (dispatch_method, method, params)
             else:
-                self.__notification_pool.enqueue(
-                    self._dispatch, method, params, config)
+                task = (self._dispatch, method, params, config)
+
+            if self.__metrics is not None:
+                task = (self.__measured_call,) + task
+
+            pool = self.__notification_pool
+            key = None
+            if self.__notification_key is not None \
+                    and hasattr(pool, 'enqueue_keyed'):
+                key = self.__notification_key(method, params)
+
+            priority = self.__priorities.get(method)
+            if key is not None:
+                pool.enqueue_keyed(key, *task)
+            elif priority is not None and hasattr(pool, 'enqueue_priority'):
+                pool.enqueue_priority(priority, *task)
+            else:
+                pool.enqueue(*task)
 
             # Return immediately
             return None
         else:
+            # Look for a cached result
+            result_cache = None
+            if not is_notification and dispatch_method is None:
+                result_cache = self.__result_caches.get(method)
+                if result_cache is not None:
+                    cache_key = jsonrpclib.cache.cache_key(method, params)
+                    if cache_key is None:
+                        # Parameters can't be used as a key
+                        result_cache = None
+                    else:
+                        encoded_result = result_cache.get(cache_key)
+                        if encoded_result is not None:
+                            if self.__metrics is not None:
+                                self.__metrics.cache_hit(method)
+                            return self.__cached_response(
+                                encoded_result, request['id'], config,
+                                marshal)
+
             # Synchronous call
+            trace = None
+            if self.__profiler is not None:
+                trace = jsonrpclib.profiling.current_trace()
+                if trace is not None:
+                    start = trace.begin(jsonrpclib.profiling.STAGE_CALL)
+
             try:
                 # Call the method
-                if dispatch_method is not None:
+                if self.__metrics is not None:
+                    if dispatch_method is not None:
+                        response = self.__measured_call(
+                            dispatch_method, method, params)
+                    else:
+                        response = self.__measured_call(
+                            self._dispatch, method, params, config)
+                elif dispatch_method is not None:
                     response = dispatch_method(method, params)
                 else:
                     response = self._dispatch(method, params, config)
@@ -321,15 +1121,34 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
                 fault = Fault(-32603, '{0}:{1}'.format(type(ex).__name__, ex),
                               config=config)
                 _logger.error("Error calling method %s: %s", method, fault)
-                return fault.dump()
+                return fault.response() if marshal else fault.dump()
+            finally:
+                if trace is not None:
+                    trace.end(jsonrpclib.profiling.STAGE_CALL, start)
 
             if is_notification:
                 # It's a notification, no result needed
                 # Do not use 'not id' as it might be the integer 0
                 return None
 
-        # Prepare a JSON-RPC dictionary
+        # Prepare a JSON-RPC dictionary (or string)
+        if trace is not None:
+            start = trace.begin(jsonrpclib.profiling.STAGE_DUMP)
         try:
+            if result_cache is not None and not isinstance(response, Fault):
+                # Store the encoded result
+                encoded_result = jsonrpclib.jsonrpc.dumps_result(
+                    response, self.encoding, config)
+                result_cache.put(cache_key, encoded_result)
+                return self.__cached_response(
+                    encoded_result, request['id'], config, marshal)
+
+            if marshal:
+                # Splice the result in a pre-encoded envelope
+                return jsonrpclib.jsonrpc.dumps_response(
+                    response, request['id'], encoding=self.encoding,
+                    config=config)
+
             return jsonrpclib.dump(response, rpcid=request['id'],
                                    is_response=True, config=config)
         except Exception as ex:
@@ -337,7 +1156,111 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
             fault = Fault(-32603, '{0}:{1}'.format(type(ex).__name__, ex),
                           config=config)
             _logger.error("Error preparing JSON-RPC result: %s", fault)
-            return fault.dump()
+            return fault.response() if marshal else fault.dump()
+        finally:
+            if trace is not None:
+                trace.end(jsonrpclib.profiling.STAGE_DUMP, start)
+
+    def __measured_call(self, dispatch_method, method, *args):
+        """
+        Calls a dispatch method and records its metrics
+
+        :param dispatch_method: The dispatch method
+        :param method: Name of the called method
+        :param args: Arguments of the dispatch method, after the method name
+        :return: The result of the dispatch method
+        """
+        metrics = self.__metrics
+        metrics.in_flight.inc()
+        start = utils.monotonic()
+        try:
+            response = dispatch_method(method, *args)
+        except:
+            metrics.call_done(method, utils.monotonic() - start, -32603)
+            raise
+        else:
+            metrics.call_done(
+                method, utils.monotonic() - start,
+                response.faultCode if isinstance(response, Fault) else None)
+            return response
+        finally:
+            metrics.in_flight.dec()
+
+    def __cached_response(self, encoded_result, rpcid, config, marshal):
+        """
+        Prepares the response to a call from an encoded result
+
+        :param encoded_result: The result of the method, as a JSON string
+        :param rpcid: Request ID
+        :param config: Request-specific configuration
+        :param marshal: If True, return the response as a JSON string
+        :return: A JSON-RPC response dictionary (or string)
+        """
+        if marshal:
+            return jsonrpclib.jsonrpc.splice_response(
+                encoded_result, rpcid, encoding=self.encoding, config=config)
+
+        return jsonrpclib.jsonrpc.Payload(rpcid, config=config) \
+            .response(jsonrpclib.jloads(encoded_result))
+
+    def __call_limited(self, method, func, params, checker, config):
+        """
+        Calls a method, respecting the limits of its bulkhead
+
+        :param method: Name of the method
+        :param func: The method to call
+        :param params: List or dictionary of arguments
+        :param checker: The ParametersChecker used to check the parameters,
+                        or None
+        :param config: Request-specific configuration
+        :return: The result of the method or a Fault object
+        """
+        bulkhead = self.__bulkheads.get(method)
+        if bulkhead is None:
+            return self.__call_method(func, params, checker, config)
+
+        if not bulkhead.acquire():
+            fault = Fault(-32001, 'Method {0} busy.'.format(method),
+                          config=config)
+            _logger.debug("Call rejected by bulkhead: %s", fault)
+            return fault
+
+        try:
+            return self.__call_method(func, params, checker, config)
+        finally:
+            bulkhead.release()
+
+    @staticmethod
+    def __call_method(func, params, checker, config):
+        """
+        Calls a method, converting its exceptions to faults
+
+        :param func: The method to call
+        :param params: List or dictionary of arguments
+        :param checker: The ParametersChecker used to check the parameters,
+                        or None
+        :param config: Request-specific configuration
+        :return: The result of the method or a Fault object
+        """
+        try:
+            # Call the method
+            if isinstance(params, utils.ListType):
+                return func(*params)
+            else:
+                return func(**params)
+        except:
+            ex = sys.exc_info()[1]
+            if checker is None and isinstance(ex, TypeError):
+                # Unchecked call: maybe the parameters are wrong
+                fault = Fault(-32602, 'Invalid parameters: {0}'
+                              .format(ex), config=config)
+                _logger.warning("Invalid call parameters: %s", fault)
+                return fault
+
+            # Method exception
+            fault = server_error(config)
+            log_server_error("Server-side exception: %s", fault, config)
+            return fault
 
     def _dispatch(self, method, params, config=None):
         """
@@ -357,39 +1280,45 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
         except KeyError:
             if self.instance is not None:
                 # Try with the registered instance
+                if self.__cached_instance is not self.instance:
+                    # The instance has been replaced without
+                    # register_instance()
+                    self.clear_method_cache()
+
                 try:
                     # Instance has a custom dispatcher
-                    return getattr(self.instance, '_dispatch')(method, params)
+                    if self.__instance_dispatch is not None:
+                        return self.__instance_dispatch(method, params)
+                except AttributeError:
+                    pass
+
+                # Resolve the method name in the instance
+                try:
+                    func = self.__resolve_instance_method(method)
                 except AttributeError:
-                    # Resolve the method name in the instance
-                    try:
-                        func = resolve_dotted_attribute(
-                            self.instance, method, True)
-                    except AttributeError:
-                        # Unknown method
-                        pass
+                    # Unknown method
+                    pass
 
         if func is not None:
-            try:
-                # Call the method
-                if isinstance(params, utils.ListType):
-                    return func(*params)
-                else:
-                    return func(**params)
-            except TypeError as ex:
-                # Maybe the parameters are wrong
-                fault = Fault(-32602, 'Invalid parameters: {0}'.format(ex),
-                              config=config)
-                _logger.warning("Invalid call parameters: %s", fault)
-                return fault
-            except:
-                # Method exception
-                err_lines = traceback.format_exception(*sys.exc_info())
-                trace_string = '{0} | {1}'.format(err_lines[-2].splitlines()[0].strip(), err_lines[-1])
-                fault = Fault(-32603, 'Server error: {0}'.format(trace_string),
-                              config=config)
-                _logger.exception("Server-side exception: %s", fault)
-                return fault
+            # Check parameters before entering the method
+            checker = self.__get_checker(method, func)
+            if checker is not None:
+                error = checker.check(params)
+                if error is not None:
+                    fault = Fault(-32602, 'Invalid parameters: {0}'
+                                  .format(error), config=config)
+                    _logger.warning("Invalid call parameters: %s", fault)
+                    return fault
+
+            if method in self.__single_flight_methods:
+                key = jsonrpclib.cache.cache_key(method, params)
+                if key is not None:
+                    # Share the result of identical concurrent calls
+                    return self.__single_flight.call(
+                        key, self.__call_limited, method, func, params,
+                        checker, config)
+
+            return self.__call_limited(method, func, params, checker, config)
         else:
             # Unknown method
             fault = Fault(-32601, 'Method {0} not supported.'.format(method),
@@ -407,6 +1336,48 @@ class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
     The server that receives the requests must have a json_config member,
     containing a JSONRPClib Config instance
     """
+    def get_request_deadline(self):
+        """
+        Computes the deadline of the current request, from the time budget
+        given in the X-JSONRPC-Timeout header. The time spent by the request
+        in the queue of a PooledJSONRPCServer is taken into account.
+
+        :return: The deadline as a jsonrpclib.utils.monotonic() time, or None
+        """
+        timeout = self.headers.get(jsonrpclib.jsonrpc.TIMEOUT_HEADER)
+        if not timeout:
+            return None
+
+        try:
+            timeout = float(timeout)
+        except ValueError:
+            _logger.debug("Invalid request timeout: %s", timeout)
+            return None
+
+        start = getattr(_request_context, 'accept_time', None)
+        if start is None:
+            start = utils.monotonic()
+
+        return start + timeout
+
+    def do_GET(self):
+        """
+        Handles GET requests: serves the metrics of the server, if any
+        """
+        path = getattr(self.server, 'metrics_path', None)
+        metrics = getattr(self.server, 'get_metrics', lambda: None)()
+        if path is None or metrics is None or self.path != path:
+            self.report_404()
+            return
+
+        response = utils.to_bytes(metrics.registry.render_prometheus())
+        self.send_response(200)
+        self.send_header("Content-type",
+                         jsonrpclib.metrics.PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
     def do_POST(self):
         """
         Handles POST requests
@@ -415,11 +1386,35 @@ class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
             self.report_404()
             return
 
+        profiler = getattr(self.server, 'get_profiler', lambda: None)()
+        trace = profiler.start_request() if profiler is not None else None
+        if trace is None:
+            self.__handle_post()
+            return
+
+        try:
+            start = trace.begin(jsonrpclib.profiling.STAGE_REQUEST)
+            try:
+                self.__handle_post(trace)
+            finally:
+                trace.end(jsonrpclib.profiling.STAGE_REQUEST, start)
+        finally:
+            profiler.end_request(trace)
+
+    def __handle_post(self, trace=None):
+        """
+        Reads the request, dispatches it and writes the response
+
+        :param trace: The RequestTrace of the request, if it is profiled
+        """
         # Retrieve the configuration
         config = getattr(self.server, 'json_config', jsonrpclib.config.DEFAULT)
+        metrics = getattr(self.server, 'get_metrics', lambda: None)()
 
         try:
             # Read the request body
+            if trace is not None:
+                start = trace.begin(jsonrpclib.profiling.STAGE_READ)
             max_chunk_size = 10 * 1024 * 1024
             size_remaining = int(self.headers["content-length"])
             chunks = []
@@ -431,6 +1426,8 @@ class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
                 chunks.append(utils.from_bytes(raw_chunk))
                 size_remaining -= len(chunks[-1])
             data = ''.join(chunks)
+            if trace is not None:
+                trace.end(jsonrpclib.profiling.STAGE_READ, start)
 
             try:
                 # Decode content
@@ -442,20 +1439,34 @@ class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
                 # Available since Python 2.7
                 pass
 
-            # Execute the method
-            response = self.server._marshaled_dispatch(
-                data, getattr(self, '_dispatch', None), self.path)
-
-            # No exception: send a 200 OK
-            self.send_response(200)
+            deadline = self.get_request_deadline()
+            if deadline is not None and deadline <= utils.monotonic():
+                # The client already gave up: don't execute the method
+                fault = Fault(-32002, 'Request deadline exceeded',
+                              config=config)
+                _logger.debug("Dropping request: %s", fault)
+                response = fault.response()
+                self.send_response(503)
+            else:
+                # Execute the method
+                _request_context.deadline = deadline
+                _request_context.client_address = self.client_address
+                _request_context.headers = self.headers
+                try:
+                    response = self.server._marshaled_dispatch(
+                        data, getattr(self, '_dispatch', None), self.path)
+                finally:
+                    _request_context.deadline = None
+                    _request_context.client_address = None
+                    _request_context.headers = None
+
+                # No exception: send a 200 OK
+                self.send_response(200)
         except:
             # Exception: send 500 Server Error
             self.send_response(500)
-            err_lines = traceback.format_exception(*sys.exc_info())
-            trace_string = '{0} | {1}'.format(err_lines[-2].splitlines()[0].strip(), err_lines[-1])
-            fault = jsonrpclib.Fault(-32603, 'Server error: {0}'
-                                     .format(trace_string), config=config)
-            _logger.exception("Server-side error: %s", fault)
+            fault = server_error(config)
+            log_server_error("Server-side error: %s", fault, config)
             response = fault.response()
 
         if response is None:
@@ -465,12 +1476,21 @@ class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
         # Convert the response to the valid string format
         response = utils.to_bytes(response)
 
+        if metrics is not None:
+            metrics.received.inc(amount=int(
+                self.headers.get("content-length") or 0))
+            metrics.sent.inc(amount=len(response))
+
         # Send it
+        if trace is not None:
+            start = trace.begin(jsonrpclib.profiling.STAGE_WRITE)
         self.send_header("Content-type", config.content_type)
         self.send_header("Content-length", str(len(response)))
         self.end_headers()
         if response:
             self.wfile.write(response)
+        if trace is not None:
+            trace.end(jsonrpclib.profiling.STAGE_WRITE, start)
 
 # ------------------------------------------------------------------------------
 
@@ -539,7 +1559,8 @@ class PooledJSONRPCServer(SimpleJSONRPCServer, socketserver.ThreadingMixIn):
     def __init__(self, addr, requestHandler=SimpleJSONRPCRequestHandler,
                  logRequests=True, encoding=None, bind_and_activate=True,
                  address_family=socket.AF_INET,
-                 config=jsonrpclib.config.DEFAULT, thread_pool=None):
+                 config=jsonrpclib.config.DEFAULT, thread_pool=None,
+                 max_pending=None, queue_timeout=None):
         """
         Sets up the server and the dispatcher
 
@@ -551,6 +1572,18 @@ class PooledJSONRPCServer(SimpleJSONRPCServer, socketserver.ThreadingMixIn):
         :param address_family: The server listening address family
         :param config: A JSONRPClib Config instance
         :param thread_pool: A ThreadPool object. The pool must be started.
+                            If it is a PriorityThreadPool, requests are
+                            queued with the priority given by
+                            get_request_priority(). Requests are queued
+                            with try_enqueue() (or try_enqueue_priority())
+                            if the pool provides it, so that a full queue
+                            doesn't block the acceptation of connections.
+        :param max_pending: Maximum number of requests waiting for a thread
+                            (None for no limit). Requests above this limit
+                            are rejected immediately.
+        :param queue_timeout: Maximum time a request can wait for a thread,
+                              in seconds (None for no limit). Requests which
+                              waited longer are rejected.
         """
         # Normalize the thread pool
         if thread_pool is None:
@@ -562,17 +1595,201 @@ class PooledJSONRPCServer(SimpleJSONRPCServer, socketserver.ThreadingMixIn):
         # Store the thread pool
         self.__request_pool = thread_pool
 
+        # Admission control
+        self.__max_pending = max_pending
+        self.__queue_timeout = queue_timeout
+        self.__nb_pending = 0
+        self.__pending_lock = threading.Lock()
+
+        # Pool closing the connections of rejected requests
+        self.__reject_pool = jsonrpclib.threadpool.ThreadPool(
+            2, 0, _REJECT_QUEUE_SIZE, logname="PooledJSONRPCServer-reject")
+        self.__reject_pool.start()
+
         # Prepare the server
         SimpleJSONRPCServer.__init__(self, addr, requestHandler, logRequests,
                                      encoding, bind_and_activate,
                                      address_family, config)
 
+        # Pre-encoded "server busy" response
+        fault = Fault(-32000, 'Server busy', config=config)
+        body = utils.to_bytes(fault.response())
+        self.__busy_response = utils.to_bytes(
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            "Content-Type: {0}\r\n"
+            "Content-Length: {1}\r\n"
+            "Retry-After: 1\r\n"
+            "Connection: close\r\n\r\n"
+            .format(config.content_type, len(body))) + body
+
+    @property
+    def request_pool(self):
+        """
+        The thread pool handling the requests, e.g. to observe it with
+        jsonrpclib.metrics.register_thread_pool()
+        """
+        return self.__request_pool
+
     def process_request(self, request, client_address):
         """
-        Handle a client request: queue it in the thread pool
+        Handle a client request: queue it in the thread pool, or reject it
+        if too many requests are already waiting
+        """
+        with self.__pending_lock:
+            if self.__max_pending is not None \
+                    and self.__nb_pending >= self.__max_pending:
+                accepted = False
+            else:
+                self.__nb_pending += 1
+                accepted = True
+
+        if not accepted:
+            self.reject_request(request, client_address)
+            return
+
+        pool = self.__request_pool
+        task = (self.__process_queued_request, request, client_address,
+                utils.monotonic())
+        try:
+            # Don't block the thread accepting connections, if the pool
+            # allows it
+            if hasattr(pool, 'enqueue_priority'):
+                enqueue = getattr(pool, 'try_enqueue_priority',
+                                  pool.enqueue_priority)
+                enqueue(self.get_request_priority(request, client_address),
+                        *task)
+            else:
+                getattr(pool, 'try_enqueue', pool.enqueue)(*task)
+        except queue.Full:
+            # The queue of the thread pool itself is full
+            with self.__pending_lock:
+                self.__nb_pending -= 1
+            self.reject_request(request, client_address)
+
+    def get_request_priority(self, request, client_address):
+        """
+        Computes the scheduling priority of a request, before it is queued.
+
+        The request hasn't been read yet: the priority is guessed from the
+        bytes already received, without waiting for more. The
+        X-JSONRPC-Priority header is used if present, else the lowest
+        priority of the called methods (see set_method_priority()).
+        Can be overridden, e.g. to prioritize some clients.
+
+        As the accepting thread must not block, the priority is only found
+        if the headers (or the body) arrived before the connection was
+        accepted, which mostly happens when the server is loaded, i.e. when
+        requests are waiting in the backlog. Otherwise, the request gets the
+        default priority of the pool.
+
+        :param request: The client socket
+        :param client_address: The client address
+        :return: The priority of the request, or None for the default one
         """
-        self.__request_pool.enqueue(self.process_request_thread,
-                                    request, client_address)
+        flags = getattr(socket, 'MSG_DONTWAIT', None)
+        if flags is None:
+            # Can't peek without blocking
+            return None
+
+        try:
+            data = request.recv(4096, socket.MSG_PEEK | flags)
+        except (socket.error, ValueError):
+            # Nothing received yet
+            return None
+
+        match = _PRIORITY_HEADER_PATTERN.search(data)
+        if match is not None:
+            return int(match.group(1))
+
+        priorities = [self.get_method_priority(utils.from_bytes(method))
+                      for method in _METHOD_PATTERN.findall(data)]
+        priorities = [priority for priority in priorities
+                      if priority is not None]
+        if priorities:
+            return min(priorities)
+
+        return None
+
+    def __process_queued_request(self, request, client_address,
+                                 enqueue_time):
+        """
+        Handles a request dequeued by the thread pool, unless it waited
+        for too long
+
+        :param request: The client socket
+        :param client_address: The client address
+        :param enqueue_time: Time when the request was queued
+        """
+        with self.__pending_lock:
+            self.__nb_pending -= 1
+
+        if self.__queue_timeout is not None \
+                and utils.monotonic() - enqueue_time > self.__queue_timeout:
+            # The request waited for too long
+            self.reject_request(request, client_address)
+        else:
+            # Keep track of the time spent in the queue
+            _request_context.accept_time = enqueue_time
+            try:
+                self.process_request_thread(request, client_address)
+            finally:
+                _request_context.accept_time = None
+
+    def reject_request(self, request, client_address):
+        """
+        Rejects a request, replying with an HTTP 503 error containing a
+        "server busy" JSON-RPC error (-32000), without reading the request.
+
+        Called in the thread accepting connections: this method must not
+        block. The socket is then drained and closed in a separate pool,
+        so that the connection isn't reset before the client reads the
+        response. If too many rejected connections are already waiting for
+        this pool, the socket is closed directly.
+
+        :param request: The client socket
+        :param client_address: The client address
+        """
+        _logger.debug("Server busy: rejecting request from %s",
+                      client_address)
+
+        try:
+            request.setblocking(False)
+            request.send(self.__busy_response)
+            request.shutdown(socket.SHUT_WR)
+        except socket.error as ex:
+            _logger.debug("Error rejecting request from %s: %s",
+                          client_address, ex)
+
+        try:
+            self.__reject_pool.try_enqueue(self.__drain_request, request)
+        except queue.Full:
+            # Too many rejected connections
+            self.close_request(request)
+
+    def __drain_request(self, request):
+        """
+        Reads the request until the client closes the connection or for
+        _DRAIN_TIMEOUT seconds at most, then closes the socket
+
+        :param request: The client socket
+        """
+        deadline = utils.monotonic() + _DRAIN_TIMEOUT
+        try:
+            while True:
+                remaining = deadline - utils.monotonic()
+                if remaining <= 0:
+                    # Slow client
+                    break
+
+                request.settimeout(remaining)
+                if not request.recv(65536):
+                    # Connection closed by the client
+                    break
+        except socket.error:
+            # Time out or connection reset
+            pass
+        finally:
+            self.close_request(request)
 
     def server_close(self):
         """
@@ -581,6 +1798,7 @@ class PooledJSONRPCServer(SimpleJSONRPCServer, socketserver.ThreadingMixIn):
         SimpleJSONRPCServer.shutdown(self)
         SimpleJSONRPCServer.server_close(self)
         self.__request_pool.stop()
+        self.__reject_pool.stop()
 
 # ------------------------------------------------------------------------------
 
@@ -0,0 +1,665 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Client-side load balancing: a proxy spreading the calls over the replicas of
+a service, ejecting the ones which fail and probing them to re-admit them.
+
+Usage::
+
+    proxy = BalancedServerProxy(["http://host1:8080", "http://host2:8080"],
+                                policy=POWER_OF_TWO)
+    proxy.add(1, 2)
+
+:author: Thomas Calmant
+:copyright: Copyright 2017, Thomas Calmant
+:license: Apache License 2.0
+:version: 0.3.0
+
+..
+
+    Copyright 2017 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import collections
+import itertools
+import logging
+import random
+import threading
+
+try:
+    # Python 3
+    # pylint: disable=F0401
+    import queue
+except ImportError:
+    # Python 2
+    # pylint: disable=F0401
+    import Queue as queue
+
+# Local package
+import jsonrpclib.config
+import jsonrpclib.jsonrpc
+import jsonrpclib.retry
+import jsonrpclib.threadpool
+import jsonrpclib.utils as utils
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (0, 3, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# Prepare the logger
+_logger = logging.getLogger(__name__)
+
+# Names of the balancing policies
+ROUND_ROBIN = "round_robin"
+LEAST_OUTSTANDING = "least_outstanding"
+POWER_OF_TWO = "power_of_two"
+
+# ------------------------------------------------------------------------------
+
+
+def is_endpoint_failure(ex):
+    """
+    Checks if an exception raised by a call denotes a failure of the endpoint
+    (connection error, server error, overload) rather than an error returned
+    by the called method
+
+    :param ex: The exception raised by the call
+    :return: True if the endpoint failed
+    """
+    if isinstance(ex, jsonrpclib.jsonrpc.ProtocolError):
+        # HTTP errors have (url, status, reason, headers) arguments,
+        # JSON-RPC errors have a (code, message) tuple
+        return len(ex.args) > 1 and isinstance(ex.args[1], int) \
+            and ex.args[1] >= 500
+
+    return jsonrpclib.retry.is_connection_error(ex)
+
+
+class Endpoint(object):
+    """
+    A replica of the service, with its pool of idle connections (ServerProxy
+    objects) and its health state
+    """
+    def __init__(self, uri, factory, max_idle=10):
+        """
+        :param uri: URI of the endpoint
+        :param factory: Method creating a ServerProxy for a URI
+        :param max_idle: Maximum number of idle proxies kept in the pool
+        """
+        self.uri = uri
+        self.max_idle = max_idle
+        self.__factory = factory
+        self.__idle = []
+        self.__lock = threading.Lock()
+
+        # Calls in progress
+        self.outstanding = 0
+
+        # Health: consecutive failures and end of the ejection (monotonic)
+        self.failures = 0
+        self.ejected_until = None
+
+    def __repr__(self):
+        """
+        String representation
+        """
+        return "Endpoint({0!r}, outstanding={1}, failures={2})".format(
+            self.uri, self.outstanding, self.failures)
+
+    @property
+    def healthy(self):
+        """
+        True if the endpoint isn't ejected
+        """
+        return self.ejected_until is None
+
+    def acquire(self):
+        """
+        Gets a proxy from the pool, or creates one, and counts the call as
+        outstanding
+
+        :return: A ServerProxy to this endpoint
+        """
+        with self.__lock:
+            self.outstanding += 1
+            if self.__idle:
+                return self.__idle.pop()
+
+        try:
+            return self.__factory(self.uri)
+        except:
+            with self.__lock:
+                self.outstanding -= 1
+            raise
+
+    def release(self, proxy, failed=False):
+        """
+        Puts back a proxy in the pool, at the end of a call
+
+        :param proxy: The proxy returned by acquire()
+        :param failed: If True, the connection is closed
+        """
+        with self.__lock:
+            self.outstanding -= 1
+            if not failed and len(self.__idle) < self.max_idle:
+                self.__idle.append(proxy)
+                return
+
+        proxy("close")()
+
+    def close(self):
+        """
+        Closes the idle connections
+        """
+        with self.__lock:
+            idle = self.__idle[:]
+            del self.__idle[:]
+
+        for proxy in idle:
+            proxy("close")()
+
+# ------------------------------------------------------------------------------
+
+
+class RoundRobinPolicy(object):
+    """
+    Chooses the endpoints in turn
+    """
+    def __init__(self):
+        """
+        Sets up members
+        """
+        self.__counter = itertools.count()
+
+    def choose(self, endpoints):
+        """
+        Chooses an endpoint
+
+        :param endpoints: A non-empty list of endpoints
+        :return: The chosen endpoint
+        """
+        return endpoints[next(self.__counter) % len(endpoints)]
+
+
+class LeastOutstandingPolicy(object):
+    """
+    Chooses the endpoint with the fewest calls in progress, ties being
+    broken randomly
+    """
+    def choose(self, endpoints):
+        """
+        Chooses an endpoint
+
+        :param endpoints: A non-empty list of endpoints
+        :return: The chosen endpoint
+        """
+        least = min(endpoint.outstanding for endpoint in endpoints)
+        return random.choice([endpoint for endpoint in endpoints
+                              if endpoint.outstanding == least])
+
+
+class PowerOfTwoPolicy(object):
+    """
+    Picks two endpoints at random and chooses the one with the fewest calls
+    in progress
+    """
+    def choose(self, endpoints):
+        """
+        Chooses an endpoint
+
+        :param endpoints: A non-empty list of endpoints
+        :return: The chosen endpoint
+        """
+        if len(endpoints) == 1:
+            return endpoints[0]
+
+        first, second = random.sample(endpoints, 2)
+        return second if second.outstanding < first.outstanding else first
+
+
+# Policy name -> policy class
+POLICIES = {
+    ROUND_ROBIN: RoundRobinPolicy,
+    LEAST_OUTSTANDING: LeastOutstandingPolicy,
+    POWER_OF_TWO: PowerOfTwoPolicy,
+}
+
+# ------------------------------------------------------------------------------
+
+
+class HedgingPolicy(object):
+    """
+    Hedging of the calls to an idempotent method: when a call hasn't been
+    answered after the given percentile of the latencies of the method, a
+    duplicate call is sent to another endpoint, and the first answer is
+    kept.
+
+    The number of hedged calls is limited to a ratio of all the calls, to
+    cap the extra load on the servers.
+    """
+    def __init__(self, percentile=95, budget=0.05, min_delay=0.001,
+                 window=1000, min_samples=20):
+        """
+        :param percentile: Percentile of the latencies after which a call is
+                           hedged (0 to 100)
+        :param budget: Maximum ratio of hedged calls (0 to 1)
+        :param min_delay: Minimum delay before hedging a call, in seconds
+        :param window: Number of recent latencies used to compute the
+                       percentile
+        :param min_samples: Number of latencies to know before hedging
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.__latencies = collections.deque(maxlen=window)
+        self.__lock = threading.Lock()
+
+        # Number of calls and of hedged calls
+        self.calls = 0
+        self.hedged = 0
+
+    def record(self, latency):
+        """
+        Records the latency of a successful call
+
+        :param latency: Latency of the call, in seconds
+        """
+        with self.__lock:
+            self.__latencies.append(latency)
+
+    def start_call(self):
+        """
+        Counts a new call and computes the delay before hedging it
+
+        :return: The delay in seconds, or None if the call can't be hedged
+        """
+        with self.__lock:
+            self.calls += 1
+            if len(self.__latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.__latencies)
+
+        return max(self.min_delay,
+                   utils.percentile(latencies, self.percentile))
+
+    def acquire_hedge(self):
+        """
+        Checks if the budget allows to hedge a call, and counts it
+
+        :return: True if the call can be hedged
+        """
+        with self.__lock:
+            if self.hedged + 1 > self.budget * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+# ------------------------------------------------------------------------------
+
+
+class BalancedServerProxy(object):
+    """
+    A proxy spreading the calls over several endpoints of the same service.
+
+    Endpoints failing ``max_failures`` times in a row are ejected for
+    ``eject_time`` seconds. Then, the next call is sent to the ejected
+    endpoint (or the ``probe_method`` is called on it, if given): the
+    endpoint is re-admitted if it succeeds, else it is ejected again.
+    If all endpoints are ejected, calls are spread over all of them.
+
+    The calls to idempotent methods can be hedged: see _set_hedging().
+
+    Contrary to ServerProxy, this proxy can be used by multiple threads:
+    each endpoint has a pool of connections.
+    """
+    def __init__(self, uris, policy=ROUND_ROBIN, max_failures=3,
+                 eject_time=10.0, probe_method=None, max_idle=10,
+                 max_hedging_threads=10, **kwargs):
+        """
+        :param uris: URIs of the endpoints
+        :param policy: Name of the balancing policy (ROUND_ROBIN,
+                       LEAST_OUTSTANDING, POWER_OF_TWO), or an object with
+                       a ``choose(endpoints)`` method
+        :param max_failures: Number of consecutive failures before ejecting
+                             an endpoint
+        :param eject_time: Time before probing an ejected endpoint, in
+                           seconds
+        :param probe_method: Name of a method without argument called to
+                             probe ejected endpoints (if None, the next call
+                             is used as probe)
+        :param max_idle: Maximum number of idle connections per endpoint
+        :param max_hedging_threads: Maximum number of threads executing the
+                                    hedged calls
+        :param kwargs: Arguments given to the ServerProxy constructor
+        :raise ValueError: No URI given or unknown policy
+        """
+        if not uris:
+            raise ValueError("No endpoint given")
+
+        if isinstance(policy, utils.STRING_TYPES):
+            try:
+                policy = POLICIES[policy]()
+            except KeyError:
+                raise ValueError("Unknown balancing policy: {0}"
+                                 .format(policy))
+
+        self._config = kwargs.get('config', jsonrpclib.config.DEFAULT)
+        self.__policy = policy
+        self.__max_failures = max_failures
+        self.__eject_time = eject_time
+        self.__probe_method = probe_method
+        self.__lock = threading.Lock()
+
+        def factory(uri):
+            return jsonrpclib.jsonrpc.ServerProxy(uri, **kwargs)
+
+        self.__endpoints = [Endpoint(uri, factory, max_idle) for uri in uris]
+
+        # Hedging: Method name -> HedgingPolicy
+        self.__hedging = {}
+        self.__hedge_policy = LeastOutstandingPolicy()
+        self.__hedging_pool = jsonrpclib.threadpool.ThreadPool(
+            max_hedging_threads, 0, logname="jsonrpclib-hedging")
+
+    def _set_hedging(self, method, policy):
+        """
+        Sets the hedging policy of an idempotent method
+
+        :param method: Name of the method
+        :param policy: A HedgingPolicy, or None to stop hedging the calls
+        """
+        if policy is None:
+            self.__hedging.pop(method, None)
+        else:
+            self.__hedging[method] = policy
+
+    def __select(self):
+        """
+        Selects the endpoint of the next call
+
+        :return: An endpoint
+        """
+        while True:
+            now = utils.monotonic()
+            with self.__lock:
+                probed = None
+                healthy = []
+                for endpoint in self.__endpoints:
+                    if endpoint.ejected_until is None:
+                        healthy.append(endpoint)
+                    elif probed is None and endpoint.ejected_until <= now:
+                        # Probe this endpoint: keep it ejected until then
+                        endpoint.ejected_until = now + self.__eject_time
+                        probed = endpoint
+
+                if probed is None:
+                    return self.__policy.choose(
+                        healthy or self.__endpoints)
+
+            if self.__probe_method is None or self.__probe(probed):
+                return probed
+
+    def __probe(self, endpoint):
+        """
+        Calls the probe method on an ejected endpoint
+
+        :return: True if the endpoint has been re-admitted
+        """
+        try:
+            self.__call(endpoint, '_request', self.__probe_method, [])
+        except Exception as ex:
+            _logger.debug("Probe of %s failed: %s", endpoint.uri, ex)
+            return False
+        return endpoint.healthy
+
+    def __success(self, endpoint):
+        """
+        Records the success of a call on an endpoint
+        """
+        with self.__lock:
+            endpoint.failures = 0
+            if endpoint.ejected_until is not None:
+                _logger.info("Re-admitting endpoint %s", endpoint.uri)
+                endpoint.ejected_until = None
+
+    def __failure(self, endpoint):
+        """
+        Records the failure of a call on an endpoint
+        """
+        with self.__lock:
+            endpoint.failures += 1
+            if endpoint.failures >= self.__max_failures:
+                if endpoint.ejected_until is None:
+                    _logger.warning("Ejecting endpoint %s after %d failures",
+                                    endpoint.uri, endpoint.failures)
+                endpoint.ejected_until = \
+                    utils.monotonic() + self.__eject_time
+
+    def __call(self, endpoint, method, *args):
+        """
+        Calls a method of a proxy to the given endpoint and tracks the
+        health of the endpoint
+
+        :param endpoint: The endpoint to call
+        :param method: Name of the ServerProxy method to call
+        :param args: Arguments of the method
+        :return: The result of the method
+        """
+        proxy = endpoint.acquire()
+        try:
+            result = getattr(proxy, method)(*args)
+        except Exception as ex:
+            failed = is_endpoint_failure(ex)
+            endpoint.release(proxy, failed)
+            if failed:
+                self.__failure(endpoint)
+            else:
+                # The endpoint answered
+                self.__success(endpoint)
+            raise
+        else:
+            endpoint.release(proxy)
+            self.__success(endpoint)
+            return result
+
+    def __hedged_call(self, hedging, delay, methodname, params, rpcid):
+        """
+        Calls a method on an endpoint and, if it didn't answer after the
+        given delay, on another one. Returns the first successful answer.
+
+        The first call is made in the caller thread: only the hedged call
+        uses the hedging pool. If the hedged call answers first, the
+        connection of the first call is aborted.
+
+        :param hedging: The HedgingPolicy of the method
+        :param delay: Delay before hedging the call, in seconds
+        :param methodname: Name of the method to call
+        :param params: Method parameters
+        :param rpcid: ID of the remote call
+        :return: The parsed result of the call
+        """
+        primary = self.__select()
+        proxy = primary.acquire()
+        abort = getattr(proxy("transport"), 'abort', None)
+
+        # Answer of the hedged call
+        answers = queue.Queue()
+        # Set once the primary call is over
+        done = threading.Event()
+        # Protects the abortion of the primary call
+        lock = threading.Lock()
+        hedged = []
+
+        def hedge():
+            if done.wait(delay):
+                # The primary call answered in time
+                return
+
+            with self.__lock:
+                others = [endpoint for endpoint in self.__endpoints
+                          if endpoint.healthy and endpoint is not primary]
+            if not others or done.is_set() or not hedging.acquire_hedge():
+                return
+
+            _logger.debug("Hedging call to %s", methodname)
+            hedged.append(True)
+            start = utils.monotonic()
+            try:
+                # Don't disturb the balancing policy (e.g. round-robin turn)
+                result = self.__call(self.__hedge_policy.choose(others),
+                                     '_request', methodname, params, rpcid)
+            except Exception as ex:
+                answers.put((False, ex))
+            else:
+                hedging.record(utils.monotonic() - start)
+                answers.put((True, result))
+                with lock:
+                    if not done.is_set() and abort is not None:
+                        # Answered first: stop waiting for the primary call
+                        abort()
+
+        self.__hedging_pool.start()
+        self.__hedging_pool.enqueue(hedge)
+
+        start = utils.monotonic()
+        try:
+            result = proxy._request(methodname, params, rpcid)
+        except Exception as ex:
+            with lock:
+                done.set()
+                aborted = abort is not None and proxy("transport").aborted
+
+            if aborted:
+                # The hedged call answered first
+                proxy("transport").aborted = False
+                primary.release(proxy, True)
+                return answers.get()[1]
+
+            failed = is_endpoint_failure(ex)
+            primary.release(proxy, failed)
+            if not failed:
+                # The endpoint answered
+                self.__success(primary)
+                raise
+
+            self.__failure(primary)
+            if not hedged:
+                raise
+
+            # Wait for the answer of the hedged call
+            success, value = answers.get()
+            if not success:
+                raise value
+            return value
+        else:
+            with lock:
+                done.set()
+                aborted = abort is not None and proxy("transport").aborted
+
+            if aborted:
+                # Aborted after the answer: drop the connection
+                proxy("transport").aborted = False
+            primary.release(proxy, aborted)
+            self.__success(primary)
+            hedging.record(utils.monotonic() - start)
+            return result
+
+    def _request(self, methodname, params, rpcid=None):
+        """
+        Calls a method on one of the endpoints
+
+        :param methodname: Name of the method to call
+        :param params: Method parameters
+        :param rpcid: ID of the remote call
+        :return: The parsed result of the call
+        """
+        hedging = self.__hedging.get(methodname)
+        if hedging is not None:
+            delay = hedging.start_call()
+            if delay is not None:
+                return self.__hedged_call(hedging, delay, methodname, params,
+                                          rpcid)
+
+            # Not enough samples yet
+            start = utils.monotonic()
+            result = self.__call(self.__select(), '_request', methodname,
+                                 params, rpcid)
+            hedging.record(utils.monotonic() - start)
+            return result
+
+        return self.__call(self.__select(), '_request', methodname, params,
+                           rpcid)
+
+    def _request_notify(self, methodname, params, rpcid=None):
+        """
+        Calls a method as a notification on one of the endpoints
+
+        :param methodname: Name of the method to call
+        :param params: Method parameters
+        :param rpcid: ID of the remote call
+        """
+        self.__call(self.__select(), '_request_notify', methodname, params,
+                    rpcid)
+
+    def _run_request(self, request, notify=False):
+        """
+        Sends the given request to one of the endpoints (used by MultiCall)
+
+        :param request: The request to send
+        :param notify: Notification request flag
+        :return: The response as a parsed JSON object
+        """
+        return self.__call(self.__select(), '_run_request', request, notify)
+
+    def __getattr__(self, name):
+        """
+        Returns a callable object to call the remote service
+        """
+        return jsonrpclib.jsonrpc._Method(self._request, name)
+
+    @property
+    def _notify(self):
+        """
+        Like __getattr__, but sending a notification request instead of a call
+        """
+        return jsonrpclib.jsonrpc._Notify(self._request_notify)
+
+    def __close(self):
+        """
+        Closes the idle connections to all endpoints
+        """
+        self.__hedging_pool.stop()
+        for endpoint in self.__endpoints:
+            endpoint.close()
+
+    def __call__(self, attr):
+        """
+        Gives access to special attributes, like ServerProxy
+
+        :param attr: "close" or "endpoints"
+        """
+        if attr == "close":
+            return self.__close
+        elif attr == "endpoints":
+            return self.__endpoints[:]
+
+        raise AttributeError("Attribute {0} not found".format(attr))
@@ -0,0 +1,385 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Load-testing tool of JSON-RPC endpoints: drives a server with concurrent
+clients and reports the throughput, the latency distribution and the errors.
+
+Usage::
+
+    python -m jsonrpclib.bench http://localhost:8080 --concurrency 8 \\
+        --duration 10 --mix add:3 --mix echo:1 --batch 5 --payload 1024
+
+:author: Thomas Calmant
+:copyright: Copyright 2017, Thomas Calmant
+:license: Apache License 2.0
+:version: 0.3.0
+
+..
+
+    Copyright 2017 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import argparse
+import bisect
+import json
+import logging
+import random
+import threading
+
+# Local package
+import jsonrpclib.jsonrpc
+import jsonrpclib.metrics
+import jsonrpclib.replay
+import jsonrpclib.utils as utils
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (0, 3, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# Prepare the logger
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+
+
+def parse_mix(entries):
+    """
+    Parses the call mix given on the command line
+
+    :param entries: A list of "method" or "method:weight" strings
+    :return: A list of (method, weight) tuples
+    :raise ValueError: Invalid weight
+    """
+    mix = []
+    for entry in entries:
+        method, _, weight = entry.partition(':')
+        weight = float(weight) if weight else 1.0
+        if weight <= 0:
+            raise ValueError("Invalid weight for {0}: {1}"
+                             .format(method, weight))
+        mix.append((method, weight))
+    return mix
+
+
+class CallMix(object):
+    """
+    Picks the methods to call according to their weights
+    """
+    def __init__(self, mix):
+        """
+        :param mix: A list of (method, weight) tuples
+        """
+        if not mix:
+            raise ValueError("Empty call mix")
+
+        self.methods = []
+        self.__cumulated = []
+        total = 0
+        for method, weight in mix:
+            total += weight
+            self.methods.append(method)
+            self.__cumulated.append(total)
+
+    def pick(self, rand=random):
+        """
+        Picks a method
+
+        :param rand: The random number generator to use
+        :return: A method name
+        """
+        index = bisect.bisect_right(self.__cumulated,
+                                    rand.random() * self.__cumulated[-1])
+        return self.methods[min(index, len(self.methods) - 1)]
+
+
+def format_histogram(latencies, buckets=jsonrpclib.metrics.DEFAULT_BUCKETS,
+                     width=40):
+    """
+    Formats the distribution of the latencies as a text histogram
+
+    :param latencies: List of latencies, in seconds
+    :param buckets: Sorted upper bounds of the buckets, in seconds
+    :param width: Width of the largest bar
+    :return: The histogram text
+    """
+    counts = [0] * (len(buckets) + 1)
+    for latency in latencies:
+        counts[bisect.bisect_left(buckets, latency)] += 1
+
+    # Skip the empty buckets at both ends
+    used = [idx for idx, count in enumerate(counts) if count]
+    if not used:
+        return ""
+
+    largest = max(counts)
+    lines = []
+    for idx in range(used[0], used[-1] + 1):
+        if idx < len(buckets):
+            label = "<= {0:g} ms".format(buckets[idx] * 1000)
+        else:
+            label = "> {0:g} ms".format(buckets[-1] * 1000)
+        lines.append("{0:>14} {1:>8} {2}".format(
+            label, counts[idx], '#' * int(round(
+                float(counts[idx]) * width / largest))))
+    return '\n'.join(lines)
+
+# ------------------------------------------------------------------------------
+
+
+class LoadTest(object):
+    """
+    Drives a JSON-RPC server with concurrent clients, each one using its own
+    ServerProxy
+    """
+    def __init__(self, url, mix, params=None, concurrency=1, batch_size=1,
+                 payload_size=0, notify_ratio=0.0, **kwargs):
+        """
+        :param url: URL of the JSON-RPC server
+        :param mix: A list of (method, weight) tuples
+        :param params: Positional parameters given to each call
+        :param concurrency: Number of concurrent clients
+        :param batch_size: Number of calls per request (batches are sent
+                           using MultiCall when greater than 1)
+        :param payload_size: Size of a string appended to the parameters
+        :param notify_ratio: Ratio of the calls sent as notifications
+        :param kwargs: Arguments given to the ServerProxy constructor
+        """
+        self.url = url
+        self.mix = CallMix(mix)
+        self.params = list(params or [])
+        if payload_size > 0:
+            self.params.append('x' * payload_size)
+        self.concurrency = concurrency
+        self.batch_size = max(1, batch_size)
+        self.notify_ratio = notify_ratio
+        self.proxy_kwargs = kwargs
+
+        self.__lock = threading.Lock()
+        self.__latencies = []
+        self.__errors = {}
+        self.__calls = 0
+        self.__remaining = None
+        self.__deadline = None
+
+    def __next_request(self):
+        """
+        Checks if a new request can be sent
+
+        :return: True if the test continues
+        """
+        if self.__deadline is not None \
+                and utils.monotonic() >= self.__deadline:
+            return False
+
+        with self.__lock:
+            if self.__remaining is None:
+                return True
+            elif self.__remaining > 0:
+                self.__remaining -= 1
+                return True
+            return False
+
+    def __send(self, proxy, rand):
+        """
+        Sends a request (single call, notification or batch)
+
+        :return: The number of calls in the request
+        """
+        if self.batch_size == 1:
+            method = self.mix.pick(rand)
+            if rand.random() < self.notify_ratio:
+                getattr(proxy._notify, method)(*self.params)
+            else:
+                getattr(proxy, method)(*self.params)
+            return 1
+
+        multicall = jsonrpclib.jsonrpc.MultiCall(proxy)
+        for _ in range(self.batch_size):
+            method = self.mix.pick(rand)
+            if rand.random() < self.notify_ratio:
+                getattr(multicall._notify, method)(*self.params)
+            else:
+                getattr(multicall, method)(*self.params)
+
+        results = multicall()
+        if results is not None:
+            # Raise the first error
+            for idx in range(len(results)):
+                results[idx]
+        return self.batch_size
+
+    def __worker(self, seed):
+        """
+        Sends requests until the end of the test
+        """
+        proxy = jsonrpclib.jsonrpc.ServerProxy(self.url, **self.proxy_kwargs)
+        rand = random.Random(seed)
+        try:
+            while self.__next_request():
+                start = utils.monotonic()
+                try:
+                    calls = self.__send(proxy, rand)
+                except Exception as ex:
+                    error = type(ex).__name__
+                    _logger.debug("Error calling %s: %s", self.url, ex)
+                    with self.__lock:
+                        self.__errors[error] = self.__errors.get(error, 0) + 1
+                        self.__calls += self.batch_size
+                else:
+                    latency = utils.monotonic() - start
+                    with self.__lock:
+                        self.__latencies.append(latency)
+                        self.__calls += calls
+        finally:
+            proxy("close")()
+
+    def run(self, requests=None, duration=None, seed=None):
+        """
+        Runs the load test
+
+        :param requests: Total number of requests to send
+        :param duration: Duration of the test, in seconds
+        :param seed: Seed of the random number generators
+        :return: A report dictionary (see jsonrpclib.replay.latency_report),
+                 with the number of calls, the calls throughput, the
+                 errors per exception type, the error rate and the
+                 latencies of the requests
+        :raise ValueError: Neither a number of requests nor a duration is
+                           given
+        """
+        if requests is None and duration is None:
+            raise ValueError("A number of requests or a duration is required")
+
+        rand = random.Random(seed)
+        self.__latencies = []
+        self.__errors = {}
+        self.__calls = 0
+        self.__remaining = requests
+
+        start = utils.monotonic()
+        self.__deadline = start + duration if duration is not None else None
+        workers = [threading.Thread(target=self.__worker,
+                                    args=(rand.random(),),
+                                    name="jsonrpclib-bench-{0}".format(idx))
+                   for idx in range(self.concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = utils.monotonic() - start
+
+        nb_errors = sum(self.__errors.values())
+        report = jsonrpclib.replay.latency_report(self.__latencies, nb_errors,
+                                                  elapsed)
+        report['calls'] = self.__calls
+        report['calls_throughput'] = self.__calls / elapsed \
+            if elapsed > 0 else None
+        report['error_types'] = dict(self.__errors)
+        report['error_rate'] = float(nb_errors) / report['requests'] \
+            if report['requests'] else 0.0
+        report['latencies'] = self.__latencies
+        return report
+
+
+def format_load_report(report):
+    """
+    Formats the report of a load test as a human-readable text
+
+    :param report: A report dictionary, from LoadTest.run()
+    :return: The report text
+    """
+    lines = [jsonrpclib.replay.format_report(report)]
+    if report['calls_throughput'] is not None:
+        lines.append("Calls:      {0} ({1:.1f} calls/s)".format(
+            report['calls'], report['calls_throughput']))
+    lines.append("Error rate: {0:.2%}".format(report['error_rate']))
+    for error, count in sorted(report['error_types'].items()):
+        lines.append("  {0}: {1}".format(error, count))
+
+    histogram = format_histogram(report['latencies'])
+    if histogram:
+        lines.append("Latency distribution:")
+        lines.append(histogram)
+    return '\n'.join(lines)
+
+# ------------------------------------------------------------------------------
+
+
+def main(argv=None):
+    """
+    Entry point of the load-testing tool
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m jsonrpclib.bench",
+        description="Load-tests a JSON-RPC server")
+    parser.add_argument("url", help="URL of the JSON-RPC server")
+    parser.add_argument("-c", "--concurrency", type=int, default=1,
+                        help="Number of concurrent clients")
+    parser.add_argument("-n", "--requests", type=int,
+                        help="Total number of requests")
+    parser.add_argument("-d", "--duration", type=float,
+                        help="Duration of the test, in seconds "
+                             "(default: 10 if no number of requests is given)")
+    parser.add_argument("-m", "--mix", action="append", default=[],
+                        metavar="METHOD[:WEIGHT]",
+                        help="Method to call, with its weight in the call mix "
+                             "(can be repeated)")
+    parser.add_argument("-p", "--params", default="[]",
+                        help="JSON array of the parameters of the calls")
+    parser.add_argument("-b", "--batch", type=int, default=1,
+                        help="Number of calls per request")
+    parser.add_argument("-s", "--payload", type=int, default=0,
+                        help="Size of a string added to the parameters")
+    parser.add_argument("-N", "--notify", type=float, default=0.0,
+                        help="Ratio of notifications (0 to 1)")
+    parser.add_argument("--seed", type=int, help="Random seed")
+    parser.add_argument("--json", action="store_true",
+                        help="Prints the report as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix or ["ping"])
+        params = json.loads(args.params)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    if not isinstance(params, utils.ListType):
+        parser.error("Parameters must be a JSON array")
+
+    duration = args.duration
+    if duration is None and args.requests is None:
+        duration = 10
+
+    load_test = LoadTest(args.url, mix, params, args.concurrency, args.batch,
+                         args.payload, args.notify)
+    report = load_test.run(args.requests, duration, args.seed)
+    if args.json:
+        del report['latencies']
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(format_load_report(report))
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,425 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Size-bounded LRU cache with time-to-live, used to cache method results
+
+:author: Thomas Calmant
+:copyright: Copyright 2017, Thomas Calmant
+:license: Apache License 2.0
+:version: 0.3.0
+
+..
+
+    Copyright 2017 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import collections
+import json
+import threading
+
+# Local package
+import jsonrpclib.threadpool
+import jsonrpclib.utils as utils
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (0, 3, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# Marker of missing cache entries
+_MISSING = object()
+
+# ------------------------------------------------------------------------------
+
+
+def cache_key(method, params):
+    """
+    Computes the cache key of a method call: its name and the canonical JSON
+    encoding of its parameters (sorted keys, compact separators)
+
+    :param method: Name of the method
+    :param params: Method parameters (list or dictionary)
+    :return: A hashable key, or None if the parameters can't be encoded
+    """
+    try:
+        return method, json.dumps(params, sort_keys=True,
+                                  separators=(',', ':'))
+    except (TypeError, ValueError):
+        # Parameters can't be converted to JSON (beans, ...)
+        return None
+
+
+def max_age(headers):
+    """
+    Extracts the time to live given by a Cache-Control response header
+
+    :param headers: A dictionary of response headers, with lower-case keys
+    :return: The time to live in seconds, 0 if the response must not be
+             cached, None if the header gives no hint
+    """
+    if not headers:
+        return None
+
+    value = headers.get('cache-control')
+    if not value:
+        return None
+
+    for directive in value.lower().split(','):
+        directive = directive.strip()
+        if directive in ('no-cache', 'no-store'):
+            return 0
+        elif directive.startswith('max-age='):
+            try:
+                return max(0, int(directive[8:]))
+            except ValueError:
+                # Invalid value
+                return 0
+
+    return None
+
+
+class LRUCache(object):
+    """
+    A thread-safe Least-Recently-Used cache, with optional time-to-live of
+    entries and optional limit of the total size of the stored values
+    """
+    def __init__(self, max_entries=1024, ttl=None, max_bytes=None,
+                 sizeof=len):
+        """
+        Sets up the cache
+
+        :param max_entries: Maximum number of entries (None for no limit)
+        :param ttl: Time to live of an entry, in seconds (None for no limit)
+        :param max_bytes: Maximum total size of the stored values
+                          (None for no limit)
+        :param sizeof: Method computing the size of a value (len by default)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+
+        # Key -> (value, size, expiration time)
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__size = 0
+
+        # Statistics
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def __len__(self):
+        """
+        Returns the number of entries in the cache (including expired ones)
+        """
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        """
+        Checks if the given key has a valid entry (doesn't update statistics)
+        """
+        with self.__lock:
+            try:
+                expiration = self.__entries[key][2]
+            except KeyError:
+                return False
+
+            return expiration is None or expiration > utils.monotonic()
+
+    def __remove(self, key):
+        """
+        Removes an entry. Must be called while holding the lock.
+
+        :param key: Key of the entry
+        :return: True if the entry was in the cache
+        """
+        try:
+            size = self.__entries.pop(key)[1]
+        except KeyError:
+            return False
+        else:
+            self.__size -= size
+            return True
+
+    def get(self, key, default=None):
+        """
+        Returns the value associated to the key and marks it as recently used
+
+        :param key: Key of the entry
+        :param default: Value returned if the entry is missing or expired
+        :return: The cached value or the default one
+        """
+        with self.__lock:
+            try:
+                value, size, expiration = self.__entries.pop(key)
+            except KeyError:
+                self.__misses += 1
+                return default
+
+            if expiration is not None and expiration <= utils.monotonic():
+                # Expired entry
+                self.__size -= size
+                self.__misses += 1
+                return default
+
+            # Put the entry back at the end (most recently used)
+            self.__entries[key] = (value, size, expiration)
+            self.__hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        """
+        Stores a value in the cache, evicting the least recently used entries
+        if necessary.
+
+        :param key: Key of the entry
+        :param value: Value to store
+        :param ttl: Specific time to live of this entry, in seconds
+                    (default one if None)
+        :return: True if the value has been stored, False if it is bigger
+                 than the size limit of the cache
+        """
+        if ttl is None:
+            ttl = self.ttl
+
+        if ttl is not None and ttl <= 0:
+            # Nothing to store
+            return False
+
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Value too big for this cache
+            return False
+
+        expiration = utils.monotonic() + ttl if ttl is not None else None
+
+        with self.__lock:
+            self.__remove(key)
+            self.__entries[key] = (value, size, expiration)
+            self.__size += size
+
+            # Evict least recently used entries
+            entries = self.__entries
+            while (self.max_entries is not None
+                   and len(entries) > self.max_entries) \
+                    or (self.max_bytes is not None
+                        and self.__size > self.max_bytes):
+                old_key = next(iter(entries))
+                self.__remove(old_key)
+                self.__evictions += 1
+
+        return True
+
+    def invalidate(self, key):
+        """
+        Removes an entry from the cache
+
+        :param key: Key of the entry
+        :return: True if the entry was in the cache
+        """
+        with self.__lock:
+            return self.__remove(key)
+
+    def clear(self):
+        """
+        Removes all the entries of the cache (statistics are kept)
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
+
+    @property
+    def stats(self):
+        """
+        Returns the statistics of the cache
+
+        :return: A dictionary with the hits, misses, evictions, entries and
+                 size (in bytes, if computed) of the cache
+        """
+        with self.__lock:
+            return {'hits': self.__hits, 'misses': self.__misses,
+                    'evictions': self.__evictions,
+                    'entries': len(self.__entries), 'bytes': self.__size}
+
+# ------------------------------------------------------------------------------
+
+
+class SingleFlight(object):
+    """
+    Merges identical concurrent calls: while a call is running, the calls
+    made with the same key wait for its result (or its exception) instead of
+    executing the method again.
+    """
+    def __init__(self, logger=None):
+        """
+        Sets up members
+
+        :param logger: The Logger used by the futures (optional)
+        """
+        self._logger = logger
+
+        # Calls in progress: key -> FutureResult
+        self.__calls = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Returns the number of calls in progress
+        """
+        return len(self.__calls)
+
+    def call(self, key, method, *args, **kwargs):
+        """
+        Calls the given method, or waits for the result of the call in
+        progress with the same key
+
+        :param key: A hashable key identifying the call
+        :param method: The method to call
+        :return: The result of the method
+        :raise Exception: The exception raised by the method
+        """
+        with self.__lock:
+            future = self.__calls.get(key)
+            owner = future is None
+            if owner:
+                future = jsonrpclib.threadpool.FutureResult(self._logger)
+                self.__calls[key] = future
+
+        if not owner:
+            # Wait for the result of the identical call
+            return future.result()
+
+        try:
+            future.execute(method, args, kwargs)
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+
+        return future.result()
+
+
+class ResponseCache(object):
+    """
+    Client-side cache of the results of remote methods.
+
+    Only the methods given with a time to live, and those for which the
+    server sent a Cache-Control hint, are cached. Identical calls to those
+    methods made while the first one is still running wait for its result
+    instead of being sent to the server.
+
+    The same cache can be shared by multiple ServerProxy objects. Cached
+    results are returned as is: they must not be modified by the caller.
+    """
+    def __init__(self, methods=None, max_entries=1024, use_hints=True):
+        """
+        Sets up the cache
+
+        :param methods: A dictionary associating method names to the time to
+                        live of their results, in seconds
+        :param max_entries: Maximum number of results kept in the cache
+        :param use_hints: If True, honour the Cache-Control headers sent by
+                          the server
+        """
+        self.methods = dict(methods or {})
+        self.use_hints = use_hints
+        self._cache = LRUCache(max_entries)
+
+        # Methods declared as cacheable by the server
+        self.__hinted = set()
+
+        # Calls in progress
+        self.__in_flight = SingleFlight()
+
+    @property
+    def stats(self):
+        """
+        Returns the statistics of the underlying LRUCache
+        """
+        return self._cache.stats
+
+    def clear(self):
+        """
+        Removes all the cached results
+        """
+        self._cache.clear()
+
+    def call(self, method, params, loader, on_hit=None):
+        """
+        Returns the cached result of the given call, or calls the loader
+
+        :param method: Name of the method
+        :param params: Method parameters
+        :param loader: A method without argument sending the request, which
+                       returns a (result, max-age hint) tuple
+        :param on_hit: An optional method called with the name of the method
+                       when the result is found in the cache
+        :return: The result of the call
+        :raise Exception: Error raised by the loader
+        """
+        ttl = self.methods.get(method)
+        if ttl is None and not self.use_hints:
+            # Not a cached method
+            return loader()[0]
+
+        key = cache_key(method, params)
+        if key is None:
+            # Parameters can't be used as a key
+            return loader()[0]
+
+        result = self._cache.get(key, _MISSING)
+        if result is not _MISSING:
+            if on_hit is not None:
+                on_hit(method)
+            return result
+
+        if ttl is None and method not in self.__hinted:
+            # The method is not known to be cacheable: don't merge calls
+            return self.__load(key, method, ttl, loader)
+
+        return self.__in_flight.call(key, self.__load, key, method, ttl,
+                                     loader)
+
+    def __load(self, key, method, ttl, loader):
+        """
+        Calls the loader and stores its result
+
+        :param key: Cache key
+        :param method: Name of the method
+        :param ttl: Time to live configured for the method
+        :param loader: Method sending the request
+        :return: The result of the call
+        """
+        result, hint = loader()
+        if self.use_hints:
+            if hint:
+                self.__hinted.add(method)
+            else:
+                # The method is not (or no longer) cacheable
+                self.__hinted.discard(method)
+
+            if hint is not None:
+                # The server knows best
+                ttl = hint
+
+        if ttl:
+            self._cache.put(key, result, ttl)
+
+        return result
@@ -37,6 +37,18 @@ __docformat__ = "restructuredtext en"
 
 # ------------------------------------------------------------------------------
 
+# Fault detail policies: content of the message of server errors
+FAULT_DETAIL_NONE = "none"
+""" Only indicate a server error """
+
+FAULT_DETAIL_LAST_FRAME = "last_frame"
+""" Last frame of the traceback and the exception """
+
+FAULT_DETAIL_FULL = "full"
+""" Full formatted traceback """
+
+# ------------------------------------------------------------------------------
+
 
 class LocalClasses(dict):
     """
@@ -65,7 +77,9 @@ class Config(object):
                  user_agent=None, use_jsonclass=True,
                  serialize_method='_serialize',
                  ignore_attribute='_ignore',
-                 serialize_handlers=None):
+                 serialize_handlers=None,
+                 fault_detail=FAULT_DETAIL_LAST_FRAME,
+                 trace_log_rate=1.0):
         """
         Sets up a configuration of JSONRPClib
 
@@ -84,6 +98,10 @@ class Config(object):
         :param serialize_handlers: A dictionary of dump handler functions by
                                    type for additional type support and for
                                    overriding dump of built-in types in utils
+        :param fault_detail: Level of detail given in the faults describing
+                             server-side exceptions (FAULT_DETAIL_* constant)
+        :param trace_log_rate: Ratio (between 0 and 1) of server-side
+                               exceptions logged with their full traceback
         """
         # JSON-RPC specification
         self.version = version
@@ -122,6 +140,15 @@ class Config(object):
         # (possibility to call standard jsonclass dump function within).
         self.serialize_handlers = serialize_handlers or {}
 
+        # Level of detail of the faults describing server-side exceptions.
+        # Formatting tracebacks is costly: use a lower level of detail to
+        # keep error responses cheap when errors spike.
+        self.fault_detail = fault_detail
+
+        # Ratio of server-side exceptions logged with their traceback, the
+        # others are logged as a single line
+        self.trace_log_rate = trace_log_rate
+
     def copy(self):
         """
         Returns a shallow copy of this configuration bean
@@ -130,7 +157,8 @@ class Config(object):
         """
         new_config = Config(self.version, self.content_type, self.user_agent,
                             self.use_jsonclass, self.serialize_method,
-                            self.ignore_attribute, None)
+                            self.ignore_attribute, None, self.fault_detail,
+                            self.trace_log_rate)
         new_config.classes = self.classes.copy()
         new_config.serialize_handlers = self.serialize_handlers.copy()
         return new_config
@@ -25,6 +25,21 @@ The history module.
     limitations under the License.
 """
 
+# Standard library
+import collections
+import logging
+import mmap
+import random
+import struct
+import threading
+import time
+import zlib
+
+# Local package
+import jsonrpclib.utils as utils
+
+# ------------------------------------------------------------------------------
+
 # Module version
 __version_info__ = (0, 3, 0)
 __version__ = ".".join(str(x) for x in __version_info__)
@@ -32,6 +47,19 @@ __version__ = ".".join(str(x) for x in __version_info__)
 # Documentation strings format
 __docformat__ = "restructuredtext en"
 
+# Prepare the logger
+_logger = logging.getLogger(__name__)
+
+# Header of the DiskHistory log files: magic, format version, flags
+_LOG_MAGIC = b"JSONRPCLOG"
+_LOG_HEADER = struct.Struct("<10sBB")
+_LOG_VERSION = 1
+_LOG_FLAG_ZLIB = 1
+
+# Header of a log record: record size, time, duration, request size,
+# response size
+_LOG_RECORD = struct.Struct("<IddII")
+
 # ------------------------------------------------------------------------------
 
 
@@ -40,7 +68,7 @@ class History(object):
     This holds all the response and request objects for a
     session. A server using this should call "clear" after
     each request cycle in order to keep it from clogging
-    memory.
+    memory. See RingHistory for a bounded history.
     """
     def __init__(self):
         """
@@ -91,3 +119,366 @@ class History(object):
         """
         del self.requests[:]
         del self.responses[:]
+
+# ------------------------------------------------------------------------------
+
+
+class HistoryEntry(object):
+    """
+    A request/response exchange stored in a RingHistory
+    """
+    __slots__ = ('time', 'duration', 'request_size', 'response_size',
+                 'request', 'response', '_start')
+
+    def __init__(self, request, keep_body):
+        """
+        :param request: The request content
+        :param keep_body: If False, only the size of the request is kept
+        """
+        self.time = time.time()
+        self._start = utils.monotonic()
+        self.duration = None
+        self.request_size = len(request) if request is not None else 0
+        self.request = request if keep_body else None
+        self.response_size = None
+        self.response = None
+
+    def set_response(self, response, keep_body):
+        """
+        Completes the entry
+
+        :param response: The response content
+        :param keep_body: If False, only the size of the response is kept
+        """
+        self.duration = utils.monotonic() - self._start
+        self.response_size = len(response) if response is not None else 0
+        if keep_body:
+            self.response = response
+
+    def __repr__(self):
+        return "HistoryEntry(time={0}, duration={1}, request_size={2}, " \
+            "response_size={3})".format(self.time, self.duration,
+                                        self.request_size, self.response_size)
+
+
+class RingHistory(object):
+    """
+    A fixed-capacity history of the exchanges of a ServerProxy, which can be
+    left active in production: only the latest exchanges are kept, a sample
+    of the exchanges can be recorded, and the bodies can be dropped to keep
+    only their sizes and the duration of the calls.
+
+    The exchanges are paired per thread: the response added by a thread
+    completes the last request it added.
+    """
+    def __init__(self, capacity=1000, sample_rate=1.0, keep_bodies=True):
+        """
+        Sets up members
+
+        :param capacity: Maximum number of exchanges kept
+        :param sample_rate: Ratio of the exchanges to record (0 to 1)
+        :param keep_bodies: If False, only the sizes and timings of the
+                            exchanges are kept
+        :raise ValueError: Invalid capacity
+        """
+        if capacity < 1:
+            raise ValueError("Capacity must be greater than 0")
+
+        self.sample_rate = sample_rate
+        self.keep_bodies = keep_bodies
+        self.entries = collections.deque(maxlen=capacity)
+
+        # Entry waiting for its response, per thread
+        self.__current = threading.local()
+
+        # Statistics (approximate under concurrent use)
+        self.seen = 0
+        self.recorded = 0
+
+    @property
+    def capacity(self):
+        """
+        Returns the maximum number of exchanges kept
+        """
+        return self.entries.maxlen
+
+    def add_request(self, request_obj):
+        """
+        Adds a request to the history, if it is sampled
+
+        :param request_obj: Request content
+        """
+        self.seen += 1
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            # Not sampled: ignore the matching response
+            self.__current.entry = None
+            return
+
+        entry = HistoryEntry(request_obj, self.keep_bodies)
+        self.__current.entry = entry
+        self.entries.append(entry)
+        self.recorded += 1
+
+    def add_response(self, response_obj):
+        """
+        Adds a response to the history, if its request has been sampled
+
+        :param response_obj: Response content
+        """
+        entry = getattr(self.__current, 'entry', None)
+        if entry is not None:
+            self.__current.entry = None
+            entry.set_response(response_obj, self.keep_bodies)
+            self._entry_done(entry)
+
+    def _entry_done(self, entry):
+        """
+        Called when an entry has been completed by its response
+
+        :param entry: The completed HistoryEntry
+        """
+        pass
+
+    @property
+    def requests(self):
+        """
+        Returns the list of the stored requests (None if bodies are not kept)
+        """
+        return [entry.request for entry in list(self.entries)]
+
+    @property
+    def responses(self):
+        """
+        Returns the list of the stored responses (None if bodies are not kept)
+        """
+        return [entry.response for entry in list(self.entries)]
+
+    @property
+    def request(self):
+        """
+        Returns the latest stored request or None
+        """
+        try:
+            return self.entries[-1].request
+        except IndexError:
+            return None
+
+    @property
+    def response(self):
+        """
+        Returns the latest stored response or None
+        """
+        try:
+            return self.entries[-1].response
+        except IndexError:
+            return None
+
+    def clear(self):
+        """
+        Clears the history (statistics are kept)
+        """
+        self.entries.clear()
+
+# ------------------------------------------------------------------------------
+
+
+class DiskHistory(RingHistory):
+    """
+    A RingHistory which also appends the completed exchanges to a log file,
+    e.g. to replay production traffic with jsonrpclib.replay.
+
+    Each record holds the time, the duration and the bodies of an exchange,
+    prefixed by their lengths. Bodies can be compressed with zlib. The log
+    file can be read with read_log().
+    """
+    def __init__(self, path, compress=False, capacity=100, sample_rate=1.0):
+        """
+        Opens the log file, in append mode
+
+        :param path: Path to the log file
+        :param compress: If True, compress the bodies with zlib
+        :param capacity: Number of exchanges kept in memory
+        :param sample_rate: Ratio of the exchanges to record (0 to 1)
+        :raise ValueError: The existing log file has another format
+        :raise IOError: Error opening the log file
+        """
+        RingHistory.__init__(self, capacity, sample_rate, True)
+        self.compress = compress
+        self.__lock = threading.Lock()
+
+        flags = _LOG_FLAG_ZLIB if compress else 0
+        self.__file = open(path, "ab")
+        try:
+            if self.__file.tell() == 0:
+                self.__file.write(
+                    _LOG_HEADER.pack(_LOG_MAGIC, _LOG_VERSION, flags))
+            elif _read_log_flags(path) != flags:
+                raise ValueError("Log file {0} has another compression mode"
+                                 .format(path))
+        except:
+            self.__file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _entry_done(self, entry):
+        """
+        Writes the completed entry to the log file. Errors are logged: they
+        must not fail the call which completed the entry.
+
+        :param entry: The completed HistoryEntry
+        """
+        try:
+            request = _encode_body(entry.request)
+            response = _encode_body(entry.response)
+            if self.compress:
+                request = zlib.compress(request)
+                response = zlib.compress(response)
+
+            record = _LOG_RECORD.pack(
+                _LOG_RECORD.size - 4 + len(request) + len(response),
+                entry.time, entry.duration, len(request), len(response))
+
+            with self.__lock:
+                if not self.__file.closed:
+                    self.__file.write(record + request + response)
+        except Exception as ex:
+            _logger.error("Error writing an exchange to the log file: %s",
+                          ex)
+
+    def flush(self):
+        """
+        Flushes the log file
+        """
+        with self.__lock:
+            self.__file.flush()
+
+    def close(self):
+        """
+        Closes the log file. Exchanges completed afterwards are not logged.
+        """
+        with self.__lock:
+            self.__file.close()
+
+
+class LogRecord(object):
+    """
+    An exchange read from a DiskHistory log file
+    """
+    __slots__ = ('time', 'duration', 'request', 'response')
+
+    def __init__(self, time, duration, request, response):
+        self.time = time
+        self.duration = duration
+        self.request = request
+        self.response = response
+
+    def __repr__(self):
+        return "LogRecord(time={0}, duration={1}, request={2!r})" \
+            .format(self.time, self.duration, self.request)
+
+
+def _encode_body(body):
+    """
+    Encodes the body of a request or of a response in UTF-8
+
+    :param body: A string, bytes or None
+    :return: The encoded body
+    """
+    if body is None:
+        return b''
+    elif isinstance(body, bytes):
+        return body
+    return body.encode("UTF-8")
+
+
+def _read_log_flags(path):
+    """
+    Reads the flags of a log file
+
+    :param path: Path to the log file
+    :return: The flags of the log file
+    :raise ValueError: Not a log file
+    """
+    with open(path, "rb") as log_file:
+        data = log_file.read(_LOG_HEADER.size)
+
+    return _check_log_header(data, 0)
+
+
+def _check_log_header(data, offset):
+    """
+    Checks the header of a log file
+
+    :param data: Log file content
+    :param offset: Offset of the header
+    :return: The flags of the log file
+    :raise ValueError: Not a log file
+    """
+    if len(data) - offset < _LOG_HEADER.size:
+        raise ValueError("Not a JSON-RPC log file")
+
+    magic, version, flags = _LOG_HEADER.unpack_from(data, offset)
+    if magic != _LOG_MAGIC or version != _LOG_VERSION:
+        raise ValueError("Not a JSON-RPC log file")
+
+    return flags
+
+
+def read_log(path):
+    """
+    Reads the exchanges stored in a DiskHistory log file. The file is
+    memory-mapped. A truncated last record is ignored.
+
+    :param path: Path to the log file
+    :return: A generator of LogRecord objects, in order
+    :raise ValueError: Not a log file
+    """
+    with open(path, "rb") as log_file:
+        data = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        flags = _check_log_header(data, 0)
+    except:
+        data.close()
+        raise
+
+    return _read_records(data, flags & _LOG_FLAG_ZLIB)
+
+
+def _read_records(data, compressed):
+    """
+    Reads the records of a memory-mapped log file, then closes it
+
+    :param data: The memory-mapped log file, with a valid header
+    :param compressed: If True, the bodies are compressed with zlib
+    :return: A generator of LogRecord objects, in order
+    """
+    try:
+        offset = _LOG_HEADER.size
+        end = len(data)
+        while offset + _LOG_RECORD.size <= end:
+            size, timestamp, duration, request_size, response_size = \
+                _LOG_RECORD.unpack_from(data, offset)
+            body_start = offset + _LOG_RECORD.size
+            offset += 4 + size
+            if offset > end:
+                # Truncated record
+                break
+
+            request = data[body_start:body_start + request_size]
+            response = data[body_start + request_size:
+                            body_start + request_size + response_size]
+            if compressed:
+                request = zlib.decompress(request)
+                response = zlib.decompress(response)
+
+            yield LogRecord(timestamp, duration, request.decode("UTF-8"),
+                            response.decode("UTF-8"))
+    finally:
+        data.close()
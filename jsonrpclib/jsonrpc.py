@@ -59,8 +59,12 @@ See https://github.com/tcalmant/jsonrpclib for more info.
 
 # Standard library
 import contextlib
+import errno
+import functools
 import logging
+import socket
 import sys
+import time
 import uuid
 
 try:
@@ -89,8 +93,11 @@ except ImportError:
     gzip = None
 
 # Library includes
+import jsonrpclib.cache
 import jsonrpclib.config
 import jsonrpclib.jsonclass as jsonclass
+import jsonrpclib.metrics
+import jsonrpclib.retry
 import jsonrpclib.utils as utils
 
 # ------------------------------------------------------------------------------
@@ -105,6 +112,12 @@ __docformat__ = "restructuredtext en"
 # Create the logger
 _logger = logging.getLogger(__name__)
 
+# Header giving the time budget of a request, in seconds
+TIMEOUT_HEADER = "X-JSONRPC-Timeout"
+
+# Header giving the scheduling priority of a request (lowest value first)
+PRIORITY_HEADER = "X-JSONRPC-Priority"
+
 # ------------------------------------------------------------------------------
 # JSON library import
 
@@ -287,6 +300,19 @@ class TransportMixIn(object):
         # Additional headers: list of dictionaries
         self.additional_headers = []
 
+        # Headers of the latest response (lower-case keys)
+        self.response_headers = {}
+
+        # Retry policy and circuit breakers (set by the ServerProxy)
+        self.retry_policy = None
+        self.circuit_breakers = None
+
+        # Set while sending a request calling an idempotent method
+        self.idempotent = False
+
+        # Set by abort(): the request in progress fails without being retried
+        self.aborted = False
+
         # Avoid a pep-8 error
         self.accept_gzip_encoding = True
         self.verbose = False
@@ -352,9 +378,95 @@ class TransportMixIn(object):
 
         return additional_headers
 
+    def abort(self):
+        """
+        Aborts the request in progress, from another thread: its connection
+        is shut down, so that the request fails immediately, without being
+        retried. The caller must reset the ``aborted`` flag afterwards.
+        """
+        self.aborted = True
+        connection = self._connection
+        if connection and connection[1] is not None:
+            sock = getattr(connection[1], 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    # Already closed
+                    pass
+
     def single_request(self, host, handler, request_body, verbose=0):
         """
         Send a complete request, and parse the response.
+        Applies the retry policy and the circuit breaker of the host, if any.
+
+        :param host: Target host.
+        :param handler: Target RPC handler.
+        :param request_body: JSON-RPC request body.
+        :param verbose: Debugging flag.
+        :return: Parsed response.
+        :raise CircuitOpenError: The circuit breaker of the host is open
+        :raise socket.error: The request has been aborted
+        """
+        if self.aborted:
+            # Don't let the caller retry an aborted request
+            raise socket.error(errno.ECONNABORTED, "Request aborted")
+
+        policy = self.retry_policy
+        breaker = None
+        if self.circuit_breakers is not None:
+            breaker = self.circuit_breakers.get(host)
+        elif policy is None:
+            return self.__single_request(host, handler, request_body,
+                                         verbose)
+
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                raise jsonrpclib.retry.CircuitOpenError(
+                    "Circuit open for {0}".format(host))
+
+            try:
+                response = self.__single_request(host, handler, request_body,
+                                                 verbose)
+            except Exception as ex:
+                if self.aborted:
+                    # Aborted on purpose: not a failure of the host
+                    if breaker is not None:
+                        breaker.release()
+                    raise
+
+                status = None
+                if isinstance(ex, ProtocolError) and len(ex.args) > 1 \
+                        and isinstance(ex.args[1], int):
+                    status = ex.args[1]
+
+                if breaker is not None:
+                    if (status is not None and status >= 500) or \
+                            (status is None and
+                             jsonrpclib.retry.is_connection_error(ex)):
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+
+                if policy is None or attempt >= policy.max_retries \
+                        or not policy.should_retry(ex, status,
+                                                   self.idempotent):
+                    raise
+
+                delay = policy.delay(attempt)
+                _logger.debug("Retrying request to %s in %.3fs: %s",
+                              host, delay, ex)
+                time.sleep(delay)
+                attempt += 1
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return response
+
+    def __single_request(self, host, handler, request_body, verbose=0):
+        """
+        Send a complete request, and parse the response.
 
         From xmlrpclib in Python 2.7
 
@@ -365,6 +477,7 @@ class TransportMixIn(object):
         :return: Parsed response.
         """
         connection = self.make_connection(host)
+        self.response_headers = {}
         try:
             self.send_request(connection, handler, request_body, verbose)
             self.send_content(connection, request_body)
@@ -372,6 +485,9 @@ class TransportMixIn(object):
             response = connection.getresponse()
             if response.status == 200:
                 self.verbose = verbose
+                self.response_headers = dict(
+                    (key.lower(), value)
+                    for key, value in response.getheaders())
                 return self.parse_response(response)
         except:
             # All unexpected errors leave connection in
@@ -473,7 +589,9 @@ class ServerProxy(XMLServerProxy):
     """
     def __init__(self, uri, transport=None, encoding=None,
                  verbose=0, version=None, headers=None, history=None,
-                 config=jsonrpclib.config.DEFAULT, context=None):
+                 config=jsonrpclib.config.DEFAULT, context=None, cache=None,
+                 call_timeout=None, metrics=None, retry_policy=None,
+                 circuit_breakers=None):
         """
         Sets up the server proxy
 
@@ -486,6 +604,16 @@ class ServerProxy(XMLServerProxy):
         :param history: History object (for tests)
         :param config: A JSONRPClib Config instance
         :param context: The optional SSLContext to use
+        :param cache: An optional jsonrpclib.cache.ResponseCache instance
+        :param call_timeout: Time budget of each call, in seconds, given to
+                             the server which will drop the request once
+                             this delay has passed
+        :param metrics: An optional jsonrpclib.metrics.Registry, where the
+                        metrics of the calls are recorded
+        :param retry_policy: An optional jsonrpclib.retry.RetryPolicy
+        :param circuit_breakers: An optional
+                                 jsonrpclib.retry.CircuitBreakers, which
+                                 can be shared by multiple proxies
         """
         # Store the configuration
         self._config = config
@@ -512,9 +640,21 @@ class ServerProxy(XMLServerProxy):
         self.__encoding = encoding
         self.__verbose = verbose
         self.__history = history
+        self.__cache = cache
+        self.__metrics = jsonrpclib.metrics.ClientMetrics(metrics) \
+            if metrics is not None else None
+
+        self.__retry_policy = retry_policy
+        if retry_policy is not None:
+            self.__transport.retry_policy = retry_policy
+        if circuit_breakers is not None:
+            self.__transport.circuit_breakers = circuit_breakers
 
         # Global custom headers are injected into Transport
-        self.__transport.push_headers(headers or {})
+        headers = dict(headers or {})
+        if call_timeout is not None:
+            headers[TIMEOUT_HEADER] = call_timeout
+        self.__transport.push_headers(headers)
 
     def _request(self, methodname, params, rpcid=None):
         """
@@ -525,12 +665,84 @@ class ServerProxy(XMLServerProxy):
         :param rpcid: ID of the remote call
         :return: The parsed result of the call
         """
+        if self.__cache is None:
+            return self.__hinted_request(methodname, params, rpcid)[0]
+
+        # Look into the cache first
+        return self.__cache.call(
+            methodname, params,
+            functools.partial(self.__hinted_request, methodname, params,
+                              rpcid),
+            self.__metrics.cache_hit if self.__metrics is not None else None)
+
+    def __hinted_request(self, methodname, params, rpcid=None):
+        """
+        Calls a method on the remote server and extracts the cache hint
+        given by the server
+
+        :param methodname: Name of the method to call
+        :param params: Method parameters
+        :param rpcid: ID of the remote call
+        :return: A (result, max-age hint) tuple
+        """
         request = dumps(params, methodname, encoding=self.__encoding,
                         rpcid=rpcid, version=self.__version,
                         config=self._config)
-        response = self._run_request(request)
-        check_for_errors(response)
-        return response['result']
+        idempotent = self.__retry_policy is not None \
+            and self.__retry_policy.is_idempotent(methodname)
+        if idempotent:
+            self.__transport.idempotent = True
+
+        try:
+            if self.__metrics is None:
+                response = self._run_request(request)
+                check_for_errors(response)
+            else:
+                response = self.__measured_request(methodname, request)
+        finally:
+            if idempotent:
+                self.__transport.idempotent = False
+
+        headers = getattr(self.__transport, 'response_headers', None)
+        return response['result'], jsonrpclib.cache.max_age(headers)
+
+    def __measured_request(self, methodname, request, notify=False):
+        """
+        Sends a request, checks its response and records the metrics of the
+        call
+
+        :param methodname: Name of the called method
+        :param request: The request to send
+        :param notify: Notification request flag
+        :return: The response as a parsed JSON object
+        :raise ProtocolError: An error occurred on the server side
+        """
+        metrics = self.__metrics
+        metrics.in_flight.inc()
+        start = utils.monotonic()
+        try:
+            response = self._run_request(request, notify)
+            check_for_errors(response)
+        except Exception as ex:
+            if isinstance(ex, ProtocolError) and ex.args:
+                if isinstance(ex.args[0], tuple):
+                    # Fault code
+                    code = ex.args[0][0]
+                elif len(ex.args) > 1:
+                    # HTTP status
+                    code = ex.args[1]
+                else:
+                    code = type(ex).__name__
+            else:
+                code = type(ex).__name__
+
+            metrics.call_done(methodname, utils.monotonic() - start, code)
+            raise
+        else:
+            metrics.call_done(methodname, utils.monotonic() - start)
+            return response
+        finally:
+            metrics.in_flight.dec()
 
     def _request_notify(self, methodname, params, rpcid=None):
         """
@@ -543,8 +755,11 @@ class ServerProxy(XMLServerProxy):
         request = dumps(params, methodname, encoding=self.__encoding,
                         rpcid=rpcid, version=self.__version, notify=True,
                         config=self._config)
-        response = self._run_request(request, notify=True)
-        check_for_errors(response)
+        if self.__metrics is None:
+            response = self._run_request(request, notify=True)
+            check_for_errors(response)
+        else:
+            self.__measured_request(methodname, request, True)
 
     def _run_request(self, request, notify=False):
         """
@@ -573,6 +788,11 @@ class ServerProxy(XMLServerProxy):
         if self.__history is not None:
             self.__history.add_response(response)
 
+        if self.__metrics is not None:
+            self.__metrics.sent.inc(amount=len(request))
+            if response:
+                self.__metrics.received.inc(amount=len(response))
+
         if not response:
             return None
         else:
@@ -603,6 +823,8 @@ class ServerProxy(XMLServerProxy):
             return self.__close
         elif attr == "transport":
             return self.__transport
+        elif attr == "cache":
+            return self.__cache
 
         raise AttributeError("Attribute {0} not found".format(attr))
 
@@ -629,6 +851,21 @@ class ServerProxy(XMLServerProxy):
         yield self
         self.__transport.pop_headers(headers)
 
+    def _call_timeout(self, timeout):
+        """
+        Allows to specify the time budget of the calls made inside the with
+        block. The remaining time budget of a request handled by a
+        SimpleJSONRPCServer can be propagated this way.
+        Example of usage:
+
+        >>> with client._call_timeout(1.5) as new_client:
+        ...     new_client.method()
+        ...
+
+        :param timeout: Time budget of each call, in seconds
+        """
+        return self._additional_headers({TIMEOUT_HEADER: timeout})
+
 # ------------------------------------------------------------------------------
 
 
@@ -814,17 +1051,71 @@ class MultiCall(object):
     To execute the multicall, call the MultiCall object e.g.:
 
     add_result, address = multicall()
+
+    Large batches can be split in chunks of a given number of calls and/or
+    a given size. Given a thread pool, chunks are sent concurrently: the
+    server must then be usable by multiple threads, like a
+    BalancedServerProxy (which can have a single endpoint).
+    Results are returned in call order.
     """
-    def __init__(self, server, config=jsonrpclib.config.DEFAULT):
+    def __init__(self, server, config=jsonrpclib.config.DEFAULT,
+                 chunk_size=None, max_bytes=None, pool=None):
         """
         Sets up the multicall
 
         :param server: A ServerProxy object
         :param config: Request configuration
+        :param chunk_size: Maximum number of calls per request
+        :param max_bytes: Maximum size of the calls of a request (a single
+                          bigger call is sent alone)
+        :param pool: A started ThreadPool (or any executor with a
+                     ``submit()`` method) sending the chunks concurrently
         """
         self._server = server
         self._job_list = []
         self._config = config
+        self._chunk_size = chunk_size
+        self._max_bytes = max_bytes
+        self._pool = pool
+
+    def __split(self, requests):
+        """
+        Splits the encoded calls in chunks
+
+        :param requests: The list of encoded calls
+        :return: A list of lists of encoded calls
+        """
+        if self._chunk_size is None and self._max_bytes is None:
+            return [requests]
+
+        chunks = []
+        chunk = []
+        size = 0
+        for request in requests:
+            if chunk and (
+                    (self._chunk_size is not None and
+                     len(chunk) >= self._chunk_size) or
+                    (self._max_bytes is not None and
+                     size + len(request) > self._max_bytes)):
+                chunks.append(chunk)
+                chunk = []
+                size = 0
+
+            chunk.append(request)
+            size += len(request) + 1
+
+        chunks.append(chunk)
+        return chunks
+
+    def __send(self, requests):
+        """
+        Sends a batch request
+
+        :param requests: The list of encoded calls
+        :return: The list of responses
+        """
+        request_body = "[ {0} ]".format(','.join(requests))
+        return self._server._run_request(request_body) or []
 
     def _request(self):
         """
@@ -835,12 +1126,21 @@ class MultiCall(object):
         if len(self._job_list) < 1:
             # Should we alert? This /is/ pretty obvious.
             return
-        request_body = "[ {0} ]".format(
-            ','.join(job.request() for job in self._job_list))
-        responses = self._server._run_request(request_body)
-        del self._job_list[:]
-        if not responses:
+        chunks = self.__split([job.request() for job in self._job_list])
+        if len(chunks) == 1:
+            responses = self.__send(chunks[0])
+        elif self._pool is None:
             responses = []
+            for chunk in chunks:
+                responses.extend(self.__send(chunk))
+        else:
+            # Send the chunks concurrently, merge the results in order
+            futures = [self._pool.submit(self.__send, chunk)
+                       for chunk in chunks]
+            responses = []
+            for future in futures:
+                responses.extend(future.result())
+        del self._job_list[:]
         return MultiCallIterator(responses)
 
     @property
@@ -1129,6 +1429,124 @@ def dumps(params=None, methodname=None, methodresponse=None,
     return jdumps(request, encoding=encoding or "UTF-8")
 
 
+# Pre-encoded response envelopes:
+# JSON-RPC version -> (head, middle, tail, result first)
+_RESPONSE_ENVELOPES = {}
+
+
+def _response_envelope(version):
+    """
+    Returns the pre-encoded parts of the envelope of a JSON-RPC response for
+    the given version, as returned by jdumps() for a Payload.response()
+    dictionary.
+
+    The order of the keys of the encoded dictionary depends on the JSON
+    library and on the hash seed (Python 2): the result can come after the
+    request ID.
+
+    :param version: JSON-RPC version (float)
+    :return: A (head, middle, tail, result_first) tuple: the strings to join
+             with the encoded result and the encoded request ID, and a flag
+             telling if the result comes before the request ID
+    """
+    try:
+        return _RESPONSE_ENVELOPES[version]
+    except KeyError:
+        # Use markers to find the place of the result and of the ID in the
+        # envelope encoded by the JSON library
+        result_marker = jdumps("@@result-{0}@@".format(uuid.uuid4()))
+        id_marker = jdumps("@@id-{0}@@".format(uuid.uuid4()))
+        envelope = jdumps(Payload(id_marker[1:-1], version)
+                          .response(result_marker[1:-1]))
+
+        result_idx = envelope.index(result_marker)
+        id_idx = envelope.index(id_marker)
+        result_first = result_idx < id_idx
+        if result_first:
+            first, second = result_marker, id_marker
+        else:
+            first, second = id_marker, result_marker
+
+        head, rest = envelope.split(first, 1)
+        middle, tail = rest.split(second, 1)
+        _RESPONSE_ENVELOPES[version] = parts = \
+            (head, middle, tail, result_first)
+        return parts
+
+
+def dumps_result(result, encoding=None, config=jsonrpclib.config.DEFAULT):
+    """
+    Encodes the result of a method call, as it will be written in a JSON-RPC
+    response
+
+    :param result: The result of a method call
+    :param encoding: Result string encoding
+    :param config: A JSONRPClib Config instance
+    :return: The JSON string representation of the result
+    """
+    if config.use_jsonclass:
+        # Use jsonclass to convert the result
+        result = jsonclass.dump(result, config=config)
+
+    return jdumps(result, encoding=encoding or "UTF-8")
+
+
+def splice_response(encoded_result, rpcid, version=None, encoding=None,
+                    config=jsonrpclib.config.DEFAULT):
+    """
+    Prepares a JSON-RPC response string from an already encoded result.
+
+    :param encoded_result: The result of the method call, encoded with
+                           dumps_result()
+    :param rpcid: Request ID
+    :param version: JSON-RPC version
+    :param encoding: Result string encoding
+    :param config: A JSONRPClib Config instance
+    :return: A JSON-RPC response string
+    :raise ValueError: No request ID given
+    """
+    if rpcid is None:
+        # A response must have a request ID
+        raise ValueError('A method response must have an rpcid.')
+
+    head, middle, tail, result_first = \
+        _response_envelope(float(version or config.version))
+    encoded_id = jdumps(rpcid, encoding=encoding or "UTF-8")
+    if result_first:
+        return ''.join((head, encoded_result, middle, encoded_id, tail))
+    return ''.join((head, encoded_id, middle, encoded_result, tail))
+
+
+def dumps_response(result, rpcid, version=None, encoding=None,
+                   config=jsonrpclib.config.DEFAULT):
+    """
+    Prepares a JSON-RPC response string.
+
+    Only the result and the request ID are encoded: they are spliced in a
+    pre-encoded response envelope.
+
+    :param result: The result of the method call, or a Fault
+    :param rpcid: Request ID
+    :param version: JSON-RPC version
+    :param encoding: Result string encoding
+    :param config: A JSONRPClib Config instance
+    :return: A JSON-RPC response string
+    :raise ValueError: No request ID given
+    """
+    if isinstance(result, Fault):
+        # Error responses are less frequent: use the standard path
+        return dumps(result, methodresponse=True, rpcid=rpcid,
+                     version=version or config.version, encoding=encoding,
+                     config=config)
+
+    if rpcid is None:
+        # A response must have a request ID
+        raise ValueError('A method response must have an rpcid.')
+
+    return splice_response(dumps_result(result, encoding, config), rpcid,
+                           version, encoding, config)
+
+
 def load(data, config=jsonrpclib.config.DEFAULT):
     """
     Loads a JSON-RPC request/response dictionary. Calls jsonclass to load beans
@@ -0,0 +1,462 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Low-overhead metrics of JSON-RPC servers, clients and thread pools, which can
+be exported in the Prometheus text format or collected by other sinks.
+
+:author: Thomas Calmant
+:copyright: Copyright 2017, Thomas Calmant
+:license: Apache License 2.0
+:version: 0.3.0
+
+..
+
+    Copyright 2017 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import bisect
+import logging
+import threading
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (0, 3, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# Prepare the logger
+_logger = logging.getLogger(__name__)
+
+# Content type of the Prometheus text format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Default latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                   1, 2.5, 5, 10)
+
+# Label of the calls to unknown methods (avoids unbounded label values)
+UNKNOWN_METHOD = "<unknown>"
+
+# ------------------------------------------------------------------------------
+
+
+def _format_value(value):
+    """
+    Formats a sample value in the Prometheus text format
+    """
+    if value == float('inf'):
+        return "+Inf"
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    """
+    Escapes a label value in the Prometheus text format
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+class Metric(object):
+    """
+    Base class of the metric families: values are stored per tuple of label
+    values, in the order of the label names.
+    """
+    type_name = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        """
+        :param name: Name of the metric
+        :param documentation: Description of the metric
+        :param labels: Names of the labels of the metric
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _check_labels(self, labels):
+        """
+        Checks the number of label values
+        """
+        if len(labels) != len(self.labels):
+            raise ValueError("{0} expects labels {1}, got {2}"
+                             .format(self.name, self.labels, labels))
+
+    def samples(self):
+        """
+        Returns the samples of the metric
+
+        :return: A list of (sample name, labels dictionary, value) tuples
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return [(self.name, dict(zip(self.labels, labels)), value)
+                for labels, value in values]
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing value
+    """
+    type_name = "counter"
+
+    def inc(self, labels=(), amount=1):
+        """
+        Increments the counter
+
+        :param labels: Tuple of label values
+        :param amount: Increment value
+        """
+        with self._lock:
+            try:
+                self._values[labels] += amount
+            except KeyError:
+                self._check_labels(labels)
+                self._values[labels] = amount
+
+    def get(self, labels=()):
+        """
+        Returns the current value of the counter
+        """
+        return self._values.get(labels, 0)
+
+
+class Gauge(Counter):
+    """
+    A value which can go up and down
+    """
+    type_name = "gauge"
+
+    def dec(self, labels=(), amount=1):
+        """
+        Decrements the gauge
+        """
+        self.inc(labels, -amount)
+
+    def set(self, value, labels=()):
+        """
+        Sets the value of the gauge
+        """
+        self._check_labels(labels)
+        with self._lock:
+            self._values[labels] = value
+
+
+class FunctionGauge(Metric):
+    """
+    A gauge whose values are computed when the metrics are collected
+    """
+    type_name = "gauge"
+
+    def set_function(self, method, labels=()):
+        """
+        Sets the method computing the value for the given labels
+
+        :param method: A method without argument returning a number, or
+                       None to remove the value
+        :param labels: Tuple of label values
+        """
+        self._check_labels(labels)
+        with self._lock:
+            if method is None:
+                self._values.pop(labels, None)
+            else:
+                self._values[labels] = method
+
+    def samples(self):
+        """
+        Calls the methods to compute the samples of the metric
+        """
+        samples = []
+        for name, labels, method in Metric.samples(self):
+            try:
+                samples.append((name, labels, method()))
+            except Exception as ex:
+                _logger.warning("Error computing %s: %s", name, ex)
+        return samples
+
+
+class Histogram(Metric):
+    """
+    A distribution of values, counted in cumulative buckets
+    """
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        """
+        :param name: Name of the metric
+        :param documentation: Description of the metric
+        :param labels: Names of the labels of the metric
+        :param buckets: Sorted upper bounds of the buckets
+        """
+        Metric.__init__(self, name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        """
+        Adds a value to the histogram
+
+        :param value: The observed value
+        :param labels: Tuple of label values
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            try:
+                counts = self._values[labels]
+            except KeyError:
+                self._check_labels(labels)
+                # Bucket counts (the last is +Inf), count, sum
+                counts = self._values[labels] = \
+                    [[0] * (len(self.buckets) + 1), 0, 0]
+
+            counts[0][index] += 1
+            counts[1] += 1
+            counts[2] += value
+
+    def get(self, labels=()):
+        """
+        Returns the number and the sum of the observed values
+
+        :return: A (count, sum) tuple
+        """
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                return 0, 0
+            return counts[1], counts[2]
+
+    def samples(self):
+        """
+        Returns the bucket, count and sum samples of the histogram
+        """
+        with self._lock:
+            values = sorted((labels, [list(counts[0]), counts[1], counts[2]])
+                            for labels, counts in self._values.items())
+
+        samples = []
+        bounds = self.buckets + (float('inf'),)
+        for labels, (buckets, count, total) in values:
+            labels = dict(zip(self.labels, labels))
+            cumulated = 0
+            for bound, bucket_count in zip(bounds, buckets):
+                cumulated += bucket_count
+                bucket_labels = labels.copy()
+                bucket_labels['le'] = _format_value(float(bound))
+                samples.append((self.name + "_bucket", bucket_labels,
+                                cumulated))
+            samples.append((self.name + "_count", labels, count))
+            samples.append((self.name + "_sum", labels, total))
+        return samples
+
+# ------------------------------------------------------------------------------
+
+
+class Registry(object):
+    """
+    A set of metrics, which can be rendered in the Prometheus text format or
+    collected by another sink
+    """
+    def __init__(self):
+        """
+        Sets up members
+        """
+        self.__metrics = {}
+        self.__lock = threading.Lock()
+
+    def __get(self, factory, name, *args):
+        """
+        Returns the metric with the given name, creating it if necessary
+
+        :raise ValueError: A metric of another type has the same name
+        """
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            if metric is None:
+                metric = self.__metrics[name] = factory(name, *args)
+            elif type(metric) is not factory:
+                raise ValueError("{0} is already a {1}"
+                                 .format(name, type(metric).__name__))
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        """
+        Returns the Counter with the given name, creating it if necessary
+        """
+        return self.__get(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        """
+        Returns the Gauge with the given name, creating it if necessary
+        """
+        return self.__get(Gauge, name, documentation, labels)
+
+    def function_gauge(self, name, documentation, labels=()):
+        """
+        Returns the FunctionGauge with the given name, creating it if
+        necessary
+        """
+        return self.__get(FunctionGauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=DEFAULT_BUCKETS):
+        """
+        Returns the Histogram with the given name, creating it if necessary
+        """
+        return self.__get(Histogram, name, documentation, labels, buckets)
+
+    def collect(self):
+        """
+        Collects the current value of all the metrics
+
+        :return: A list of (metric, samples) tuples, sorted by metric name;
+                 see Metric.samples()
+        """
+        with self.__lock:
+            metrics = sorted(self.__metrics.items())
+
+        return [(metric, metric.samples()) for _, metric in metrics]
+
+    def render_prometheus(self):
+        """
+        Renders the metrics in the Prometheus text exposition format
+
+        :return: The metrics text
+        """
+        lines = []
+        for metric, samples in self.collect():
+            lines.append("# HELP {0} {1}".format(
+                metric.name, metric.documentation.replace('\\', '\\\\')
+                .replace('\n', '\\n')))
+            lines.append("# TYPE {0} {1}".format(metric.name,
+                                                 metric.type_name))
+            for name, labels, value in samples:
+                if labels:
+                    name = "{0}{{{1}}}".format(name, ','.join(
+                        '{0}="{1}"'.format(key, _escape(labels[key]))
+                        for key in sorted(labels)))
+                lines.append("{0} {1}".format(name, _format_value(value)))
+
+        lines.append('')
+        return '\n'.join(lines)
+
+# ------------------------------------------------------------------------------
+
+
+class ServerMetrics(object):
+    """
+    Metrics of a JSON-RPC server
+    """
+    def __init__(self, registry, prefix="jsonrpc_server"):
+        """
+        Registers the server metrics
+
+        :param registry: The Registry to use
+        :param prefix: Prefix of the metrics names
+        """
+        self.registry = registry
+        self.requests = registry.counter(
+            prefix + "_requests_total", "Method calls", ("method",))
+        self.errors = registry.counter(
+            prefix + "_errors_total", "Method calls which returned an error",
+            ("method", "code"))
+        self.duration = registry.histogram(
+            prefix + "_request_duration_seconds",
+            "Duration of the method calls", ("method",))
+        self.in_flight = registry.gauge(
+            prefix + "_in_flight", "Method calls in progress")
+        self.received = registry.counter(
+            prefix + "_received_bytes_total", "Size of the request bodies")
+        self.sent = registry.counter(
+            prefix + "_sent_bytes_total", "Size of the response bodies")
+        self.cache_hits = registry.counter(
+            prefix + "_cache_hits_total",
+            "Method calls answered from the results cache", ("method",))
+
+    def call_done(self, method, duration, code=None):
+        """
+        Records the end of a method call
+
+        :param method: Name of the method
+        :param duration: Duration of the call, in seconds
+        :param code: Error code of the fault, if any
+        """
+        if code == -32601:
+            # Method not found
+            method = UNKNOWN_METHOD
+
+        labels = (method,)
+        self.requests.inc(labels)
+        self.duration.observe(duration, labels)
+        if code is not None:
+            self.errors.inc((method, str(code)))
+
+    def cache_hit(self, method):
+        """
+        Records a method call answered from the results cache. It is counted
+        as a call, but not in the duration histogram, to keep the latencies
+        of the method meaningful.
+
+        :param method: Name of the method
+        """
+        labels = (method,)
+        self.requests.inc(labels)
+        self.cache_hits.inc(labels)
+
+
+class ClientMetrics(ServerMetrics):
+    """
+    Metrics of a JSON-RPC client (ServerProxy). The cache hits are the calls
+    answered from the response cache of the proxy.
+    """
+    def __init__(self, registry, prefix="jsonrpc_client"):
+        """
+        Registers the client metrics
+
+        :param registry: The Registry to use
+        :param prefix: Prefix of the metrics names
+        """
+        ServerMetrics.__init__(self, registry, prefix)
+
+
+def register_thread_pool(registry, pool, name, prefix="jsonrpc_pool"):
+    """
+    Registers the gauges of a ThreadPool: queue depth, threads and active
+    threads
+
+    :param registry: The Registry to use
+    :param pool: The ThreadPool to observe
+    :param name: Name of the pool, used as label value
+    :param prefix: Prefix of the metrics names
+    """
+    labels = (name,)
+    registry.function_gauge(
+        prefix + "_queue_depth", "Tasks waiting for a thread", ("pool",)) \
+        .set_function(lambda: pool.queue_depth, labels)
+    registry.function_gauge(
+        prefix + "_threads", "Threads of the pool", ("pool",)) \
+        .set_function(lambda: pool.nb_threads, labels)
+    registry.function_gauge(
+        prefix + "_active_threads", "Threads executing a task", ("pool",)) \
+        .set_function(lambda: pool.active_threads, labels)
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Profiling hooks of the server request pipeline: attributes the time spent
+handling requests to reading, parsing, validation, user code, serialization
+and writing, and profiles a sample of the requests with cProfile.
+
+:author: Thomas Calmant
+:copyright: Copyright 2017, Thomas Calmant
+:license: Apache License 2.0
+:version: 0.3.0
+
+..
+
+    Copyright 2017 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import logging
+import random
+import threading
+import time
+
+try:
+    import cProfile
+    import pstats
+except ImportError:
+    # Not available on all interpreters
+    cProfile = pstats = None
+
+# Local package
+import jsonrpclib.utils as utils
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (0, 3, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# Prepare the logger
+_logger = logging.getLogger(__name__)
+
+# High-resolution clock
+clock = getattr(time, 'perf_counter', utils.monotonic)
+
+# Stages of the request pipeline
+STAGE_REQUEST = "request"
+""" Whole handling of the HTTP request (SimpleJSONRPCRequestHandler) """
+STAGE_READ = "read"
+""" Reading of the request body """
+STAGE_DISPATCH = "dispatch"
+""" Handling of the JSON-RPC request (_marshaled_dispatch) """
+STAGE_LOADS = "loads"
+""" Parsing of the request (jloads and beans loading) """
+STAGE_VALIDATE = "validate"
+""" Validation of a request entry (validate_request) """
+STAGE_CALL = "call"
+""" Execution of a method (_dispatch, user code) """
+STAGE_DUMP = "dump"
+""" Serialization of a response entry (dump and jdumps) """
+STAGE_WRITE = "write"
+""" Writing of the HTTP response """
+
+# Trace of the request handled by the current thread
+_local = threading.local()
+
+# ------------------------------------------------------------------------------
+
+
+def current_trace():
+    """
+    Returns the trace of the request handled by the current thread
+
+    :return: A RequestTrace, or None if the request isn't traced
+    """
+    return getattr(_local, 'trace', None)
+
+
+class RequestTrace(object):
+    """
+    The timestamps of the stages of a request
+    """
+    __slots__ = ('profiler', 'stages', 'profile')
+
+    def __init__(self, profiler, profile=None):
+        """
+        :param profiler: The parent Profiler
+        :param profile: The cProfile.Profile of this request, if any
+        """
+        self.profiler = profiler
+        self.profile = profile
+
+        # List of (stage, start, end) tuples, in order of end
+        self.stages = []
+
+    def begin(self, stage):
+        """
+        Notifies the start of a stage
+
+        :param stage: Name of the stage
+        :return: The start timestamp, to give to end()
+        """
+        timestamp = clock()
+        for hook in self.profiler.pre_hooks:
+            hook(self, stage, timestamp)
+        return timestamp
+
+    def end(self, stage, start):
+        """
+        Notifies the end of a stage
+
+        :param stage: Name of the stage
+        :param start: Start timestamp, as returned by begin()
+        """
+        timestamp = clock()
+        self.stages.append((stage, start, timestamp))
+        for hook in self.profiler.post_hooks:
+            hook(self, stage, start, timestamp)
+
+    def durations(self):
+        """
+        Returns the time spent in each stage
+
+        :return: A dictionary: stage -> total duration in seconds
+        """
+        durations = {}
+        for stage, start, end in self.stages:
+            durations[stage] = durations.get(stage, 0) + end - start
+        return durations
+
+
+class Profiler(object):
+    """
+    Traces a sample of the requests handled by a server, calling the
+    registered hooks at the beginning and at the end of each stage, and
+    aggregating the time spent per stage.
+
+    A part of the traced requests can also be executed under cProfile.
+    """
+    def __init__(self, sample_rate=1.0, cprofile_rate=0.0):
+        """
+        :param sample_rate: Ratio of the requests to trace (0 to 1)
+        :param cprofile_rate: Ratio of the traced requests to run under
+                              cProfile (0 to 1)
+        """
+        self.sample_rate = sample_rate
+        self.cprofile_rate = cprofile_rate if cProfile is not None else 0
+
+        # Hooks: pre(trace, stage, timestamp)
+        # and post(trace, stage, start, end)
+        self.pre_hooks = []
+        self.post_hooks = []
+
+        # Stage -> [count, total duration]
+        self.__totals = {}
+        self.__stats = None
+        self.__lock = threading.Lock()
+
+    def add_hook(self, pre=None, post=None):
+        """
+        Registers hooks called at the beginning and at the end of each stage
+        of the traced requests
+
+        :param pre: Method called as ``pre(trace, stage, timestamp)``
+        :param post: Method called as ``post(trace, stage, start, end)``
+        """
+        if pre is not None:
+            self.pre_hooks.append(pre)
+        if post is not None:
+            self.post_hooks.append(post)
+
+    def start_request(self):
+        """
+        Starts tracing the request handled by the current thread, if it is
+        sampled
+
+        :return: A RequestTrace, or None
+        """
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+
+        profile = None
+        if self.cprofile_rate and random.random() < self.cprofile_rate:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active
+                profile = None
+
+        trace = _local.trace = RequestTrace(self, profile)
+        return trace
+
+    def end_request(self, trace):
+        """
+        Ends the trace of a request and aggregates its stages
+
+        :param trace: The RequestTrace returned by start_request()
+        """
+        _local.trace = None
+        if trace.profile is not None:
+            trace.profile.disable()
+
+        with self.__lock:
+            for stage, start, end in trace.stages:
+                try:
+                    totals = self.__totals[stage]
+                except KeyError:
+                    totals = self.__totals[stage] = [0, 0]
+                totals[0] += 1
+                totals[1] += end - start
+
+            if trace.profile is not None:
+                if self.__stats is None:
+                    self.__stats = pstats.Stats(trace.profile)
+                else:
+                    self.__stats.add(trace.profile)
+
+    def stats(self):
+        """
+        Returns the time spent per stage in the traced requests
+
+        :return: A dictionary: stage -> (count, total duration, mean duration)
+        """
+        with self.__lock:
+            return dict((stage, (count, total, total / count))
+                        for stage, (count, total) in self.__totals.items())
+
+    def profile_stats(self):
+        """
+        Returns the cProfile statistics of the profiled requests
+
+        :return: A pstats.Stats object, or None
+        """
+        return self.__stats
+
+    def reset(self):
+        """
+        Clears the aggregated statistics
+        """
+        with self.__lock:
+            self.__totals.clear()
+            self.__stats = None
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Replays the traffic recorded by a DiskHistory against a server, at the
+recorded pace or faster, and reports the latency percentiles.
+
+Usage::
+
+    python -m jsonrpclib.replay traffic.log http://localhost:8080 --speed 2
+
+:author: Thomas Calmant
+:copyright: Copyright 2017, Thomas Calmant
+:license: Apache License 2.0
+:version: 0.3.0
+
+..
+
+    Copyright 2017 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import argparse
+import logging
+import threading
+import time
+
+# Local package
+import jsonrpclib.history
+import jsonrpclib.jsonrpc
+import jsonrpclib.threadpool
+import jsonrpclib.utils as utils
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (0, 3, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# Prepare the logger
+_logger = logging.getLogger(__name__)
+
+# Percentiles given in reports
+PERCENTILES = (50, 90, 99, 99.9)
+
+# ------------------------------------------------------------------------------
+
+
+def latency_report(latencies, errors, duration):
+    """
+    Prepares the report of a load test
+
+    :param latencies: List of the latencies of the successful calls, in
+                      seconds
+    :param errors: Number of failed calls
+    :param duration: Duration of the test, in seconds
+    :return: A dictionary with the number of requests and errors, the
+             duration, the throughput (requests per second) and the latency
+             statistics of successful calls (min, mean, max and
+             percentiles, in seconds)
+    """
+    latencies = sorted(latencies)
+    nb_requests = len(latencies) + errors
+    latency = {
+        'min': latencies[0] if latencies else None,
+        'mean': sum(latencies) / len(latencies) if latencies else None,
+        'max': latencies[-1] if latencies else None,
+    }
+    for percent in PERCENTILES:
+        latency['p{0:g}'.format(percent)] = utils.percentile(latencies,
+                                                             percent)
+
+    return {
+        'requests': nb_requests,
+        'errors': errors,
+        'duration': duration,
+        'throughput': nb_requests / duration if duration > 0 else None,
+        'latency': latency,
+    }
+
+
+def format_report(report):
+    """
+    Formats a report as a human-readable text
+
+    :param report: A report dictionary, from latency_report()
+    :return: The report text
+    """
+    lines = ["Requests:   {0} ({1} errors)".format(report['requests'],
+                                                   report['errors']),
+             "Duration:   {0:.3f} s".format(report['duration'])]
+    if report['throughput'] is not None:
+        lines.append("Throughput: {0:.1f} req/s".format(report['throughput']))
+
+    latency = report['latency']
+    for name in ['min', 'mean'] \
+            + ['p{0:g}'.format(percent) for percent in PERCENTILES] + ['max']:
+        value = latency.get(name)
+        if value is not None:
+            lines.append("{0:<11} {1:.3f} ms".format(name + ':', value * 1000))
+
+    return '\n'.join(lines)
+
+# ------------------------------------------------------------------------------
+
+
+def proxy_sender(uri, **kwargs):
+    """
+    Prepares a method sending raw requests to a server, with a ServerProxy
+    per thread
+
+    :param uri: URI of the server
+    :param kwargs: Arguments given to the ServerProxy constructor
+    :return: A method sending a request string, which returns the parsed
+             response or raises an exception
+    """
+    local = threading.local()
+
+    def send(request):
+        proxy = getattr(local, 'proxy', None)
+        if proxy is None:
+            proxy = local.proxy = jsonrpclib.jsonrpc.ServerProxy(uri,
+                                                                 **kwargs)
+        response = proxy._run_request(request)
+        if isinstance(response, utils.ListType):
+            # Batch response
+            for result in response:
+                jsonrpclib.jsonrpc.check_for_errors(result)
+        else:
+            jsonrpclib.jsonrpc.check_for_errors(response)
+        return response
+
+    return send
+
+
+def dispatcher_sender(dispatcher):
+    """
+    Prepares a method sending raw requests to an in-process dispatcher
+
+    :param dispatcher: A SimpleJSONRPCDispatcher
+    :return: A method sending a request string, which returns the response
+             string (errors are not checked)
+    """
+    def send(request):
+        return dispatcher._marshaled_dispatch(request)
+
+    return send
+
+
+def replay(records, send, speed=1.0, max_threads=10):
+    """
+    Replays the given requests.
+
+    When replaying at a given pace, latencies are measured from the time at
+    which each request should have been sent: the time spent waiting for a
+    free thread is included.
+
+    :param records: An iterable of LogRecord (or HistoryEntry) objects, in
+                    order
+    :param send: A method sending a request string, e.g. from proxy_sender()
+                 or dispatcher_sender()
+    :param speed: Replay speed factor: 1 for the recorded pace, 2 for twice
+                  as fast, ... 0 to send the requests as fast as possible
+    :param max_threads: Maximum number of requests sent concurrently
+    :return: A report dictionary, see latency_report()
+    """
+    pool = jsonrpclib.threadpool.ThreadPool(max_threads, 0,
+                                            logname="jsonrpclib-replay")
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def call(request, start):
+        if start is None:
+            start = utils.monotonic()
+        try:
+            send(request)
+        except Exception as ex:
+            _logger.debug("Error replaying request: %s", ex)
+            with lock:
+                errors[0] += 1
+        else:
+            with lock:
+                latencies.append(utils.monotonic() - start)
+
+    pool.start()
+    start = utils.monotonic()
+    first_time = None
+    try:
+        for record in records:
+            if not record.request:
+                continue
+
+            scheduled = None
+            if speed > 0:
+                if first_time is None:
+                    first_time = record.time
+
+                scheduled = start + (record.time - first_time) / speed
+                delay = scheduled - utils.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            pool.enqueue(call, record.request, scheduled)
+
+        pool.shutdown()
+    finally:
+        pool.stop()
+
+    return latency_report(latencies, errors[0], utils.monotonic() - start)
+
+# ------------------------------------------------------------------------------
+
+
+def main(argv=None):
+    """
+    Entry point of the replay tool
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m jsonrpclib.replay",
+        description="Replays a JSON-RPC traffic log against a server")
+    parser.add_argument("log", help="Log file written by a DiskHistory")
+    parser.add_argument("url", help="URL of the JSON-RPC server")
+    parser.add_argument("-s", "--speed", type=float, default=1.0,
+                        help="Replay speed factor (0: as fast as possible)")
+    parser.add_argument("-t", "--threads", type=int, default=10,
+                        help="Maximum number of concurrent requests")
+    args = parser.parse_args(argv)
+
+    try:
+        records = jsonrpclib.history.read_log(args.log)
+    except (IOError, ValueError) as ex:
+        parser.error(str(ex))
+
+    report = replay(records, proxy_sender(args.url), args.speed, args.threads)
+    print(format_report(report))
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
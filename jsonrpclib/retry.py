@@ -0,0 +1,321 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Retry policy with jittered exponential backoff and per-endpoint circuit
+breakers, used by the JSON-RPC transports.
+
+:author: Thomas Calmant
+:copyright: Copyright 2017, Thomas Calmant
+:license: Apache License 2.0
+:version: 0.3.0
+
+..
+
+    Copyright 2017 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import errno
+import logging
+import random
+import socket
+import threading
+
+try:
+    # Python 3
+    # pylint: disable=F0401
+    from http.client import HTTPException
+except ImportError:
+    # Python 2
+    # pylint: disable=F0401
+    from httplib import HTTPException
+
+# Local package
+import jsonrpclib.utils as utils
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (0, 3, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# Prepare the logger
+_logger = logging.getLogger(__name__)
+
+# States of a circuit breaker
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# Error numbers of connection errors (refused, reset, timeout, unreachable...)
+_CONNECTION_ERRNOS = frozenset(
+    getattr(errno, name) for name in (
+        'ECONNREFUSED', 'ECONNRESET', 'ECONNABORTED', 'EPIPE', 'ETIMEDOUT',
+        'EHOSTUNREACH', 'EHOSTDOWN', 'ENETUNREACH', 'ENETDOWN', 'ENETRESET',
+        'ENOTCONN', 'ESHUTDOWN')
+    if hasattr(errno, name))
+
+# ------------------------------------------------------------------------------
+
+
+class CircuitOpenError(IOError):
+    """
+    The circuit breaker of the endpoint is open: the request hasn't been sent
+    """
+    pass
+
+
+def is_connection_error(ex):
+    """
+    Checks if an exception is a connection error (refused, reset, timeout,
+    name resolution, invalid HTTP response...). Other I/O errors, e.g. file
+    or SSL certificate errors, are not connection errors.
+
+    :param ex: An exception
+    :return: True for connection errors
+    """
+    if isinstance(ex, (HTTPException, CircuitOpenError, socket.timeout,
+                       socket.gaierror, socket.herror)):
+        return True
+
+    return isinstance(ex, (IOError, OSError, socket.error)) \
+        and getattr(ex, 'errno', None) in _CONNECTION_ERRNOS
+
+
+def is_connection_refused(ex):
+    """
+    Checks if an exception tells that the connection has been refused, i.e.
+    that the request hasn't been sent
+
+    :param ex: An exception
+    :return: True if the connection has been refused
+    """
+    return isinstance(ex, (IOError, OSError, socket.error)) \
+        and getattr(ex, 'errno', None) == errno.ECONNREFUSED
+
+
+class RetryPolicy(object):
+    """
+    Retries the requests failing because of the endpoint, with a jittered
+    exponential backoff:
+
+    * requests whose connection has been refused are always retried, as they
+      haven't been sent,
+    * requests which failed after being sent (timeout, reset connection,
+      HTTP status in ``retry_statuses``) are retried only if they call an
+      idempotent method.
+    """
+    def __init__(self, max_retries=2, backoff=0.1, max_backoff=5.0,
+                 idempotent_methods=(), retry_statuses=(502, 503, 504)):
+        """
+        :param max_retries: Maximum number of retries of a request
+        :param backoff: Base delay before the first retry, in seconds,
+                        doubled at each retry
+        :param max_backoff: Maximum delay before a retry, in seconds
+        :param idempotent_methods: Names of the idempotent methods
+        :param retry_statuses: HTTP statuses of the retried responses
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idempotent_methods = frozenset(idempotent_methods)
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def is_idempotent(self, method):
+        """
+        Checks if a method is idempotent
+
+        :param method: Name of the method
+        :return: True if the method can be called twice safely
+        """
+        return method in self.idempotent_methods
+
+    def delay(self, attempt):
+        """
+        Computes the delay before a retry ("full jitter" backoff)
+
+        :param attempt: Number of the retry, starting at 0
+        :return: The delay in seconds
+        """
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def should_retry(self, ex, status, idempotent):
+        """
+        Checks if a failed request must be retried
+
+        :param ex: The exception raised by the request
+        :param status: HTTP status of the response, if any
+        :param idempotent: True if the request calls an idempotent method
+        :return: True if the request must be retried
+        """
+        if isinstance(ex, CircuitOpenError):
+            # Fail fast
+            return False
+        elif status is not None:
+            return idempotent and status in self.retry_statuses
+        elif is_connection_refused(ex):
+            return True
+        return idempotent and is_connection_error(ex)
+
+# ------------------------------------------------------------------------------
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of an endpoint: after ``failure_threshold`` consecutive
+    failures, the circuit opens and requests fail immediately. After
+    ``reset_timeout`` seconds, the circuit is half-open: a limited number of
+    trial requests are sent, which close the circuit if they succeed, or
+    open it again if they fail. Trial requests ending without result must
+    give back their slot with release(); slots still taken after
+    ``reset_timeout`` seconds are given back anyway.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 half_open_calls=1):
+        """
+        :param failure_threshold: Number of consecutive failures opening the
+                                  circuit
+        :param reset_timeout: Time the circuit stays open, in seconds
+        :param half_open_calls: Number of concurrent trial requests when
+                                the circuit is half-open
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+
+        self.__state = CLOSED
+        self.__failures = 0
+        self.__opened_at = None
+        self.__half_opened_at = None
+        self.__trials = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        Current state of the circuit: CLOSED, OPEN or HALF_OPEN
+        """
+        with self.__lock:
+            if self.__state == OPEN and utils.monotonic() \
+                    >= self.__opened_at + self.reset_timeout:
+                return HALF_OPEN
+            return self.__state
+
+    def allow(self):
+        """
+        Checks if a request can be sent, and counts the trial requests of a
+        half-open circuit
+
+        :return: True if the request can be sent
+        """
+        with self.__lock:
+            if self.__state == CLOSED:
+                return True
+
+            now = utils.monotonic()
+            if self.__state == OPEN:
+                if now < self.__opened_at + self.reset_timeout:
+                    return False
+
+                self.__state = HALF_OPEN
+                self.__half_opened_at = now
+                self.__trials = 0
+            elif now >= self.__half_opened_at + self.reset_timeout:
+                # The trials never ended: allow new ones
+                self.__half_opened_at = now
+                self.__trials = 0
+
+            if self.__trials >= self.half_open_calls:
+                return False
+
+            self.__trials += 1
+            return True
+
+    def release(self):
+        """
+        Gives back the slot of a trial request which ended without result
+        (e.g. aborted), neither closing nor opening the circuit
+        """
+        with self.__lock:
+            if self.__state == HALF_OPEN and self.__trials > 0:
+                self.__trials -= 1
+
+    def record_success(self):
+        """
+        Records the success of a request: closes the circuit
+        """
+        with self.__lock:
+            if self.__state != CLOSED:
+                _logger.info("Closing circuit")
+            self.__state = CLOSED
+            self.__failures = 0
+
+    def record_failure(self):
+        """
+        Records the failure of a request: opens the circuit if the threshold
+        is reached or if it was a trial request
+        """
+        with self.__lock:
+            self.__failures += 1
+            if self.__state == HALF_OPEN \
+                    or self.__failures >= self.failure_threshold:
+                if self.__state != OPEN:
+                    _logger.warning("Opening circuit after %d failures",
+                                    self.__failures)
+                self.__state = OPEN
+                self.__opened_at = utils.monotonic()
+
+
+class CircuitBreakers(object):
+    """
+    The circuit breakers of the endpoints, created on demand with the same
+    parameters. It can be shared by multiple ServerProxy objects.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 half_open_calls=1):
+        """
+        :param failure_threshold: Number of consecutive failures opening a
+                                  circuit
+        :param reset_timeout: Time a circuit stays open, in seconds
+        :param half_open_calls: Number of concurrent trial requests when a
+                                circuit is half-open
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.__breakers = {}
+        self.__lock = threading.Lock()
+
+    def get(self, endpoint):
+        """
+        Returns the circuit breaker of an endpoint
+
+        :param endpoint: The endpoint (host) name
+        :return: A CircuitBreaker
+        """
+        try:
+            return self.__breakers[endpoint]
+        except KeyError:
+            with self.__lock:
+                breaker = self.__breakers.get(endpoint)
+                if breaker is None:
+                    breaker = self.__breakers[endpoint] = CircuitBreaker(
+                        self.failure_threshold, self.reset_timeout,
+                        self.half_open_calls)
+                return breaker
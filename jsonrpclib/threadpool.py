@@ -26,6 +26,8 @@ Cached thread pool, inspired from Pelix/iPOPO Thread Pool
 """
 
 # Standard library
+import collections
+import functools
 import logging
 import threading
 
@@ -38,6 +40,17 @@ except ImportError:
     # pylint: disable=F0401
     import Queue as queue
 
+try:
+    # Python 3, or Python 2 with the "futures" back-port
+    # pylint: disable=F0401
+    import concurrent.futures as futures
+except ImportError:
+    # Python 2 without the back-port
+    futures = None
+
+# Local package
+import jsonrpclib.utils as utils
+
 # ------------------------------------------------------------------------------
 
 # Module version
@@ -49,6 +62,27 @@ __docformat__ = "restructuredtext en"
 
 # ------------------------------------------------------------------------------
 
+if futures is None:
+    # Bespoke futures and thread pools only
+    _Future = _Executor = object
+    FutureTimeoutError = OSError
+else:
+    _Future = futures.Future
+    _Executor = futures.Executor
+
+    if issubclass(futures.TimeoutError, OSError):
+        # Python 3.11+
+        FutureTimeoutError = futures.TimeoutError
+    else:
+        class FutureTimeoutError(futures.TimeoutError, OSError):
+            """
+            Timeout of FutureResult.result(): compatible with the
+            concurrent.futures API and with the historical OSError
+            """
+            pass
+
+# ------------------------------------------------------------------------------
+
 
 class EventData(object):
     """
@@ -125,9 +159,14 @@ class EventData(object):
             raise self.__exception
 
 
-class FutureResult(object):
+class FutureResult(_Future):
     """
-    An object to wait for the result of a threaded execution
+    An object to wait for the result of a threaded execution.
+
+    When the concurrent.futures module is available, this is a
+    concurrent.futures.Future: it can be cancelled before its execution,
+    accepts multiple done callbacks, and can be given to
+    concurrent.futures.wait(), as_completed() or asyncio.wrap_future().
     """
     def __init__(self, logger=None):
         """
@@ -135,6 +174,9 @@ class FutureResult(object):
 
         :param logger: The Logger to use in case of error (optional)
         """
+        if futures is not None:
+            futures.Future.__init__(self)
+
         self._logger = logger or logging.getLogger(__name__)
         self._done_event = EventData()
         self.__callback = None
@@ -172,13 +214,18 @@ class FutureResult(object):
     def execute(self, method, args, kwargs):
         """
         Execute the given method and stores its result.
-        The result is considered "done" even if the method raises an exception
+        The result is considered "done" even if the method raises an exception.
+        Does nothing if the future has been cancelled.
 
         :param method: The method to execute
         :param args: Method positional arguments
         :param kwargs: Method keyword arguments
         :raise Exception: The exception raised by the method
         """
+        if futures is not None and not self.set_running_or_notify_cancel():
+            # Cancelled before its execution
+            return
+
         # Normalize arguments
         if args is None:
             args = []
@@ -192,18 +239,25 @@ class FutureResult(object):
         except Exception as ex:
             # Something went wrong: propagate to the event and to the caller
             self._done_event.raise_exception(ex)
+            if futures is not None:
+                self.set_exception(ex)
             raise
         else:
             # Store the result
             self._done_event.set(result)
+            if futures is not None:
+                self.set_result(result)
         finally:
             # In any case: notify the call back (if any)
             self.__notify()
 
     def done(self):
         """
-        Returns True if the job has finished, else False
+        Returns True if the job has finished or has been cancelled, else False
         """
+        if futures is not None:
+            return futures.Future.done(self)
+
         return self._done_event.is_set()
 
     def result(self, timeout=None):
@@ -212,20 +266,32 @@ class FutureResult(object):
         Returns immediately the result if the job has already been done.
 
         :param timeout: The maximum time to wait for a result (in seconds)
-        :raise OSError: The timeout raised before the job finished
+        :raise FutureTimeoutError: The timeout raised before the job finished
+                                   (an OSError)
+        :raise CancelledError: The job has been cancelled
         :raise Exception: The exception encountered during the call, if any
         """
+        if futures is not None:
+            try:
+                return futures.Future.result(self, timeout)
+            except futures.TimeoutError:
+                raise FutureTimeoutError("Timeout raised")
+
         if self._done_event.wait(timeout):
             return self._done_event.data
         else:
-            raise OSError("Timeout raised")
+            raise FutureTimeoutError("Timeout raised")
 
 # ------------------------------------------------------------------------------
 
 
-class ThreadPool(object):
+class ThreadPool(_Executor):
     """
-    Executes the tasks stored in a FIFO in a thread pool
+    Executes the tasks stored in a FIFO in a thread pool.
+
+    When the concurrent.futures module is available, this is a
+    concurrent.futures.Executor: submit(), map() and shutdown() can be used,
+    and the pool can be used as a context manager.
     """
     def __init__(self, max_threads, min_threads=1, queue_size=0, timeout=60,
                  logname=None):
@@ -274,7 +340,10 @@ class ThreadPool(object):
 
         self._queue = queue.Queue(queue_size)
         self._timeout = timeout
-        self.__lock = threading.RLock()
+        self.__lock = threading.Lock()
+
+        # Set by shutdown(): new tasks are refused until the next start()
+        self.__shutdown = False
 
         # The thread pool
         self._min_threads = min_threads
@@ -284,10 +353,10 @@ class ThreadPool(object):
         # Thread count
         self._thread_id = 0
 
-        # Current number of threads, active and alive,
-        # and number of task waiting
+        # Current number of threads, and number of tasks queued or being
+        # executed. Both are protected by the lock, which is taken once per
+        # task by the producer and once by the worker.
         self.__nb_threads = 0
-        self.__nb_active_threads = 0
         self.__nb_pending_task = 0
 
     def start(self):
@@ -300,51 +369,45 @@ class ThreadPool(object):
 
         # Clear the stop event
         self._done_event.clear()
+        self.__shutdown = False
 
         # Compute the number of threads to start to handle pending tasks
-        nb_pending_tasks = self._queue.qsize()
-        if nb_pending_tasks > self._max_threads:
-            nb_threads = self._max_threads
-            nb_pending_tasks = self._max_threads
-        elif nb_pending_tasks < self._min_threads:
-            nb_threads = self._min_threads
-        else:
-            nb_threads = nb_pending_tasks
+        # (tasks queued before the start are already counted as pending)
+        with self.__lock:
+            nb_threads = max(self._min_threads,
+                             min(self._max_threads, self._queue.qsize()))
 
-        # Create the threads
-        for _ in range(nb_pending_tasks):
-            self.__nb_pending_task += 1
-            self.__start_thread()
-        for _ in range(nb_threads-nb_pending_tasks):
-            self.__start_thread()
+            # Create the threads
+            for _ in range(nb_threads):
+                self.__start_thread()
 
     def __start_thread(self):
         """
-        Starts a new thread, if possible
+        Starts a new thread, if possible.
+        Must be called while holding the lock.
         """
-        with self.__lock:
-            if self.__nb_threads >= self._max_threads:
-                # Can't create more threads
-                return False
+        if self.__nb_threads >= self._max_threads:
+            # Can't create more threads
+            return False
 
-            if self._done_event.is_set():
-                # We're stopped: do nothing
-                return False
+        if self._done_event.is_set():
+            # We're stopped: do nothing
+            return False
 
-            # Prepare thread and start it
-            name = "{0}-{1}".format(self._logger.name, self._thread_id)
-            self._thread_id += 1
+        # Prepare thread and start it
+        name = "{0}-{1}".format(self._logger.name, self._thread_id)
+        self._thread_id += 1
 
-            thread = threading.Thread(target=self.__run, name=name)
-            thread.daemon = True
-            try:
-                self.__nb_threads += 1
-                thread.start()
-                self._threads.append(thread)
-                return True
-            except (RuntimeError, OSError):
-                self.__nb_threads -= 1
-                return False
+        thread = threading.Thread(target=self.__run, name=name)
+        thread.daemon = True
+        try:
+            self.__nb_threads += 1
+            thread.start()
+            self._threads.append(thread)
+            return True
+        except (RuntimeError, OSError):
+            self.__nb_threads -= 1
+            return False
 
     def stop(self):
         """
@@ -383,6 +446,84 @@ class ThreadPool(object):
         del self._threads[:]
         self.clear()
 
+    @property
+    def queue_depth(self):
+        """
+        Returns the number of tasks waiting for a thread
+        """
+        return self._queue.qsize()
+
+    @property
+    def nb_threads(self):
+        """
+        Returns the current number of threads
+        """
+        return self.__nb_threads
+
+    @property
+    def active_threads(self):
+        """
+        Returns the number of threads executing a task (approximation)
+        """
+        return max(0, min(self.__nb_threads,
+                          self.__nb_pending_task - self._queue.qsize()))
+
+    def __enter__(self):
+        """
+        Starts the pool when entering a context
+        """
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Shuts down the pool when leaving a context, waiting for its tasks
+        """
+        self.shutdown(wait=True)
+        return False
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """
+        Stops the thread pool once its queued tasks have been executed
+        (concurrent.futures.Executor API). New tasks are refused until the
+        pool is restarted with start().
+
+        The tasks queued in a pool which hasn't been started are cancelled.
+
+        :param wait: If True, returns once the pool has stopped
+        :param cancel_futures: If True, cancels the tasks not yet started
+        """
+        self.__shutdown = True
+        if cancel_futures or self._done_event.is_set():
+            # No worker to execute the queued tasks if the pool is stopped
+            self.clear()
+
+        def stop():
+            self.join()
+            self.stop()
+
+        if wait:
+            stop()
+        else:
+            thread = threading.Thread(
+                target=stop, name="{0}-shutdown".format(self._logger.name))
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues a task in the pool (concurrent.futures.Executor API).
+        Tasks submitted before the pool is started are executed when it
+        starts.
+
+        :param fn: Method to call
+        :return: A FutureResult object, to get the result of the task
+        :raise ValueError: Invalid method
+        :raise Full: The task queue is full
+        :raise RuntimeError: The pool has been shut down
+        """
+        return self._enqueue(fn, args, kwargs)
+
     def enqueue(self, method, *args, **kwargs):
         """
         Queues a task in the pool
@@ -391,6 +532,38 @@ class ThreadPool(object):
         :return: A FutureResult object, to get the result of the task
         :raise ValueError: Invalid method
         :raise Full: The task queue is full
+        :raise RuntimeError: The pool has been shut down
+        """
+        return self._enqueue(method, args, kwargs)
+
+    def try_enqueue(self, method, *args, **kwargs):
+        """
+        Queues a task in the pool, failing immediately if the task queue is
+        full instead of waiting for a place, e.g. to reject requests in a
+        thread which must not block
+
+        :param method: Method to call
+        :return: A FutureResult object, to get the result of the task
+        :raise ValueError: Invalid method
+        :raise Full: The task queue is full
+        :raise RuntimeError: The pool has been shut down
+        """
+        return self._enqueue(method, args, kwargs, block=False)
+
+    def _enqueue(self, method, args, kwargs, priority=None, block=True):
+        """
+        Queues a task in the pool
+
+        :param method: Method to call
+        :param args: Method positional arguments
+        :param kwargs: Method keyword arguments
+        :param priority: Priority of the task (ignored by the FIFO pool)
+        :param block: If False, fails immediately if the task queue is full,
+                      instead of waiting for the queue timeout
+        :return: A FutureResult object, to get the result of the task
+        :raise ValueError: Invalid method
+        :raise Full: The task queue is full
+        :raise RuntimeError: The pool has been shut down
         """
         if not hasattr(method, '__call__'):
             raise ValueError("{0} has no __call__ member."
@@ -398,37 +571,227 @@ class ThreadPool(object):
 
         # Prepare the future result object
         future = FutureResult(self._logger)
+        self.__put_tasks([(method, args, kwargs, future)], priority, block)
+        return future
 
-        # Use a lock, as we might be "resetting" the queue
-        with self.__lock:
-            # Add the task to the queue
-            self._queue.put((method, args, kwargs, future), True,
-                            self._timeout)
-            self.__nb_pending_task += 1
+    def __put_tasks(self, tasks, priority=None, block=True):
+        """
+        Adds tasks to the queue, then updates the counters and starts the
+        required threads with a single lock round
+
+        :param tasks: A list of (method, args, kwargs, future) tuples
+        :param priority: Priority of the tasks
+        :param block: If False, doesn't wait for a place in a full queue
+        :raise Full: The task queue is full (the tasks before the failing one
+                     have been queued: the ``futures`` member of the
+                     exception holds their FutureResult objects)
+        :raise RuntimeError: The pool has been shut down
+        """
+        if self.__shutdown:
+            raise RuntimeError("Cannot schedule new tasks after shutdown")
 
-            if self.__nb_pending_task > self.__nb_threads:
-                # All threads are taken: start a new one
-                self.__start_thread()
+        nb_queued = 0
+        try:
+            # Add the tasks to the queue, outside the lock: the queue might
+            # be full and has its own lock
+            for task in tasks:
+                self._queue.put(self._queue_item(task, priority), block,
+                                self._timeout)
+                nb_queued += 1
+        except queue.Full as ex:
+            ex.futures = [task[3] for task in tasks[:nb_queued]]
+            raise
+        finally:
+            if nb_queued:
+                with self.__lock:
+                    self.__nb_pending_task += nb_queued
+                    while self.__nb_pending_task > self.__nb_threads:
+                        # All threads are taken: start a new one
+                        if not self.__start_thread():
+                            break
 
-        return future
+    def enqueue_many(self, method, args_list, chunksize=1):
+        """
+        Queues a task per set of arguments, with a single lock round.
+        Each queue item holds up to ``chunksize`` tasks, executed in order by
+        the same worker.
+
+        :param method: Method to call
+        :param args_list: An iterable of tuples of positional arguments
+        :param chunksize: Maximum number of tasks per queue item
+        :return: The list of the FutureResult objects of the tasks
+        :raise ValueError: Invalid method or chunk size
+        :raise Full: The task queue is full. The tasks before the failing
+                     queue item have been queued: the ``futures`` member of
+                     the exception holds their FutureResult objects
+        :raise RuntimeError: The pool has been shut down
+        """
+        if not hasattr(method, '__call__'):
+            raise ValueError("{0!r} has no __call__ member.".format(method))
+        elif chunksize < 1:
+            raise ValueError("Chunk size must be greater than 0")
+
+        all_futures = [(FutureResult(self._logger), args)
+                       for args in args_list]
+        if chunksize == 1:
+            tasks = [(method, args, None, future)
+                     for future, args in all_futures]
+        else:
+            tasks = []
+            for idx in range(0, len(all_futures), chunksize):
+                chunk = all_futures[idx:idx + chunksize]
+                chunk_future = FutureResult(self._logger)
+                if futures is not None:
+                    # Cancel the tasks if the chunk is dropped by clear()
+                    chunk_future.add_done_callback(
+                        functools.partial(self.__cancel_chunk, chunk))
+                tasks.append((self.__execute_chunk, (method, chunk), None,
+                              chunk_future))
+
+        try:
+            self.__put_tasks(tasks)
+        except queue.Full as ex:
+            # Give the futures of the tasks in the queued items
+            nb_queued = len(ex.futures) * chunksize
+            ex.futures = [future for future, _ in all_futures[:nb_queued]]
+            raise
+        return [future for future, _ in all_futures]
+
+    def __execute_chunk(self, method, chunk):
+        """
+        Executes the tasks of a chunk
+
+        :param method: Method to call
+        :param chunk: A list of (FutureResult, args) tuples
+        """
+        for future, args in chunk:
+            try:
+                future.execute(method, args, None)
+            except Exception as ex:
+                self._logger.exception("Error executing %s: %s",
+                                       method.__name__, ex)
+
+    @staticmethod
+    def __cancel_chunk(chunk, chunk_future):
+        """
+        Cancels the tasks of a chunk which has been cancelled
+
+        :param chunk: A list of (FutureResult, args) tuples
+        :param chunk_future: The FutureResult of the chunk
+        """
+        if chunk_future.cancelled():
+            for future, _ in chunk:
+                future.cancel()
+
+    def map(self, fn, *iterables, **kwargs):
+        """
+        Returns an iterator equivalent to map(fn, *iterables), the calls
+        being executed in the pool (concurrent.futures.Executor API).
+        All the calls are queued with a single lock round.
+
+        :param fn: Method to call
+        :param iterables: Iterables giving the arguments of the calls
+        :param timeout: Maximum time to wait for all the results, in seconds
+                        (keyword argument)
+        :param chunksize: Number of calls per queue item (keyword argument)
+        :return: An iterator over the results, in order
+        :raise TypeError: Unknown keyword argument
+        :raise Full: The task queue is full (the queued calls are cancelled)
+        :raise FutureTimeoutError: A result isn't available before the timeout
+        :raise Exception: The exception raised by a call
+        """
+        timeout = kwargs.pop('timeout', None)
+        chunksize = kwargs.pop('chunksize', 1)
+        if kwargs:
+            raise TypeError("Unexpected keyword argument(s): {0}"
+                            .format(', '.join(kwargs)))
+        elif chunksize < 1:
+            raise ValueError("Chunk size must be greater than 0")
+
+        if timeout is not None:
+            end_time = utils.monotonic() + timeout
+
+        args_list = list(zip(*iterables))
+        chunks = [args_list[idx:idx + chunksize]
+                  for idx in range(0, len(args_list), chunksize)]
+        try:
+            all_futures = self.enqueue_many(self._call_chunk,
+                                            [(fn, chunk) for chunk in chunks])
+        except queue.Full as ex:
+            # Don't run a partial map
+            if futures is not None:
+                for future in ex.futures:
+                    future.cancel()
+            raise
+
+        def results():
+            """
+            Yields the results in order
+            """
+            try:
+                # Reverse to pop futures as they are consumed
+                all_futures.reverse()
+                while all_futures:
+                    if timeout is None:
+                        chunk_results = all_futures.pop().result()
+                    else:
+                        chunk_results = all_futures.pop().result(
+                            end_time - utils.monotonic())
+
+                    for result in chunk_results:
+                        yield result
+            finally:
+                if futures is not None:
+                    for future in all_futures:
+                        future.cancel()
+
+        return results()
+
+    @staticmethod
+    def _call_chunk(method, chunk):
+        """
+        Calls the method for each set of arguments of the chunk
+
+        :param method: Method to call
+        :param chunk: A list of tuples of positional arguments
+        :return: The list of results
+        """
+        return [method(*args) for args in chunk]
+
+    @staticmethod
+    def _queue_item(task, priority):
+        """
+        Prepares the item to store in the task queue
+
+        :param task: A (method, args, kwargs, future) tuple
+        :param priority: Priority of the task
+        :return: The item to put in the queue
+        """
+        return task
 
     def clear(self):
         """
-        Empties the current queue content.
+        Empties the current queue content, cancelling the removed tasks.
         Returns once the queue have been emptied.
         """
-        with self.__lock:
-            # Empty the current queue
-            try:
-                while True:
-                    self._queue.get_nowait()
-                    self._queue.task_done()
-            except queue.Empty:
-                # Queue is now empty
-                pass
+        # Empty the current queue
+        try:
+            while True:
+                task = self._queue.get_nowait()
+                self._queue.task_done()
+                if task is not self._done_event:
+                    with self.__lock:
+                        self.__nb_pending_task -= 1
 
-            # Wait for the tasks currently executed
-            self.join()
+                    if futures is not None:
+                        # Release the callers waiting for the result
+                        task[3].cancel()
+        except queue.Empty:
+            # Queue is now empty
+            pass
+
+        # Wait for the tasks currently executed
+        self.join()
 
     def join(self, timeout=None):
         """
@@ -466,10 +829,8 @@ class ThreadPool(object):
                         return
             except queue.Empty:
                 # Nothing to do yet
-                pass
+                done = 0
             else:
-                with self.__lock:
-                    self.__nb_active_threads += 1
                 # Extract elements
                 method, args, kwargs, future = task
                 try:
@@ -481,24 +842,432 @@ class ThreadPool(object):
                 finally:
                     # Mark the action as executed
                     self._queue.task_done()
+                done = 1
 
-                    # Thread is not active anymore
-                    with self.__lock:
-                        self.__nb_pending_task -= 1
-                        self.__nb_active_threads -= 1
-
-            # Clean up thread if necessary
+            # Update the counters and clean up the thread if necessary,
+            # with a single lock
             with self.__lock:
-                extra_threads = self.__nb_threads - self.__nb_active_threads
+                self.__nb_pending_task -= done
                 if self.__nb_threads > self._min_threads \
-                        and extra_threads > self._queue.qsize():
-                    # No more work for this thread
-                    # if there are more non active_thread than task
-                    # and we're above the  minimum number of threads:
-                    # stop this one
+                        and self.__nb_threads > self.__nb_pending_task:
+                    # There are more threads than tasks queued or being
+                    # executed, and we're above the minimum number of
+                    # threads: stop this one
                     self.__nb_threads -= 1
                     return
 
         with self.__lock:
             # Thread stops
             self.__nb_threads -= 1
+
+# ------------------------------------------------------------------------------
+
+
+class _PriorityItem(object):
+    """
+    A task associated to its priority
+    """
+    __slots__ = ('priority', 'task')
+
+    def __init__(self, priority, task):
+        """
+        :param priority: Priority of the task
+        :param task: The queued task
+        """
+        self.priority = priority
+        self.task = task
+
+
+class PriorityTaskQueue(queue.Queue):
+    """
+    A task queue, FIFO within a priority level, with the lowest priority
+    value served first.
+
+    Tasks which have been waiting for more than the starvation timeout are
+    served first, oldest first, whatever their priority.
+    Items put without priority (control items) are served before any task.
+    """
+    def __init__(self, maxsize=0, starvation_timeout=None):
+        """
+        :param maxsize: Maximum size of the queue (0 for infinite)
+        :param starvation_timeout: Maximum time a task can wait before being
+                                   served whatever its priority, in seconds
+                                   (None to deactivate)
+        """
+        self.starvation_timeout = starvation_timeout
+        queue.Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize):
+        # Priority -> deque of (queue time, item)
+        self._levels = {}
+        # Sorted list of the non-empty levels
+        self._sorted_levels = []
+        self._size = 0
+
+    def _qsize(self, *_):
+        return self._size
+
+    def _put(self, item):
+        if isinstance(item, _PriorityItem):
+            priority = item.priority
+            item = item.task
+        else:
+            # Control items are served first
+            priority = None
+
+        try:
+            level = self._levels[priority]
+        except KeyError:
+            level = self._levels[priority] = collections.deque()
+            self._sorted_levels.append(priority)
+            self._sorted_levels.sort(key=lambda prio: (prio is not None,
+                                                       prio))
+
+        level.append((utils.monotonic(), item))
+        self._size += 1
+
+    def _get(self):
+        levels = self._sorted_levels
+        selected = levels[0]
+
+        if self.starvation_timeout is not None and len(levels) > 1:
+            # Look for the oldest task waiting for too long
+            oldest = utils.monotonic() - self.starvation_timeout
+            for priority in levels:
+                queue_time = self._levels[priority][0][0]
+                if queue_time <= oldest:
+                    selected = priority
+                    oldest = queue_time
+
+        level = self._levels[selected]
+        item = level.popleft()[1]
+        if not level:
+            del self._levels[selected]
+            levels.remove(selected)
+
+        self._size -= 1
+        return item
+
+
+class PriorityThreadPool(ThreadPool):
+    """
+    Executes the tasks stored in a priority queue in a thread pool.
+
+    Tasks are executed by priority (lowest value first), in FIFO order within
+    a priority level. Tasks waiting for more than the starvation timeout are
+    executed first, whatever their priority.
+    """
+    def __init__(self, max_threads, min_threads=1, queue_size=0, timeout=60,
+                 logname=None, default_priority=0, starvation_timeout=1.0):
+        """
+        Sets up the thread pool.
+
+        :param max_threads: Maximum size of the thread pool
+        :param min_threads: Minimum size of the thread pool
+        :param queue_size: Size of the task queue (0 for infinite)
+        :param timeout: Queue timeout (in seconds, 60s by default)
+        :param logname: Name of the logger
+        :param default_priority: Priority of the tasks queued with enqueue()
+        :param starvation_timeout: Maximum time a task can wait before being
+                                   executed whatever its priority, in seconds
+                                   (None to deactivate)
+        :raise ValueError: Invalid number of threads
+        """
+        ThreadPool.__init__(self, max_threads, min_threads, queue_size,
+                            timeout, logname)
+        self.default_priority = default_priority
+
+        # Replace the FIFO queue
+        self._queue = PriorityTaskQueue(self._queue.maxsize,
+                                        starvation_timeout)
+
+    def enqueue_priority(self, priority, method, *args, **kwargs):
+        """
+        Queues a task in the pool, with the given priority
+
+        :param priority: Priority of the task (lowest value first)
+        :param method: Method to call
+        :return: A FutureResult object, to get the result of the task
+        :raise ValueError: Invalid method
+        :raise Full: The task queue is full
+        :raise RuntimeError: The pool has been shut down
+        """
+        return self._enqueue(method, args, kwargs, priority)
+
+    def try_enqueue_priority(self, priority, method, *args, **kwargs):
+        """
+        Queues a task in the pool, with the given priority, failing
+        immediately if the task queue is full (see try_enqueue())
+
+        :param priority: Priority of the task (lowest value first)
+        :param method: Method to call
+        :return: A FutureResult object, to get the result of the task
+        :raise ValueError: Invalid method
+        :raise Full: The task queue is full
+        :raise RuntimeError: The pool has been shut down
+        """
+        return self._enqueue(method, args, kwargs, priority, block=False)
+
+    def _queue_item(self, task, priority):
+        """
+        Associates the task to its priority
+
+        :param task: A (method, args, kwargs, future) tuple
+        :param priority: Priority of the task (default one if None)
+        :return: The item to put in the queue
+        """
+        if priority is None:
+            priority = self.default_priority
+
+        return _PriorityItem(priority, task)
+
+# ------------------------------------------------------------------------------
+
+
+def _raise(ex):
+    """
+    Raises the given exception (used to fail a future)
+
+    :param ex: An exception
+    """
+    raise ex
+
+
+class KeyedExecutor(object):
+    """
+    Executes tasks in a thread pool, sequentially and in order for a given
+    key, while tasks with different keys run in parallel.
+
+    At most one thread of the pool runs the tasks of a key at a time. After
+    ``max_batch`` tasks, it yields the thread to the other keys. If the pool
+    has been shut down meanwhile, the remaining tasks of the key fail with a
+    RuntimeError.
+    """
+    def __init__(self, pool, max_batch=16):
+        """
+        Sets up the executor
+
+        :param pool: The ThreadPool executing the tasks (must be started)
+        :param max_batch: Number of tasks of a key executed before giving
+                          the thread back to the pool
+        """
+        self._pool = pool
+        self.max_batch = max_batch
+        self._logger = pool._logger
+
+        # Key -> deque of (method, args, kwargs, future)
+        self.__queues = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Returns the number of keys with tasks queued or running
+        """
+        return len(self.__queues)
+
+    def enqueue(self, method, *args, **kwargs):
+        """
+        Queues a task without ordering constraint
+
+        :param method: Method to call
+        :return: A FutureResult object, to get the result of the task
+        :raise ValueError: Invalid method
+        :raise Full: The task queue is full
+        """
+        return self._pool.enqueue(method, *args, **kwargs)
+
+    def enqueue_keyed(self, key, method, *args, **kwargs):
+        """
+        Queues a task, executed after the tasks previously queued with the
+        same key
+
+        :param key: A hashable key
+        :param method: Method to call
+        :return: A FutureResult object, to get the result of the task
+        :raise ValueError: Invalid method
+        :raise Full: The task queue of the pool is full
+        :raise RuntimeError: The pool has been shut down
+        """
+        if not hasattr(method, '__call__'):
+            raise ValueError("{0!r} has no __call__ member.".format(method))
+
+        future = FutureResult(self._logger)
+        with self.__lock:
+            tasks = self.__queues.get(key)
+            if tasks is not None:
+                # A worker is handling this key
+                tasks.append((method, args, kwargs, future))
+                return future
+
+            self.__queues[key] = collections.deque(
+                ((method, args, kwargs, future),))
+
+        try:
+            self._pool.enqueue(self.__run, key)
+        except:
+            # Forget about the tasks of this key
+            with self.__lock:
+                tasks = self.__queues.pop(key)
+
+            if futures is not None:
+                for task in tasks:
+                    task[3].cancel()
+            raise
+
+        return future
+
+    def __run(self, key):
+        """
+        Executes the tasks queued for the given key
+
+        :param key: A task key
+        """
+        while True:
+            for _ in range(self.max_batch):
+                with self.__lock:
+                    tasks = self.__queues[key]
+                    if not tasks:
+                        # No more tasks
+                        del self.__queues[key]
+                        return
+
+                    method, args, kwargs, future = tasks.popleft()
+
+                try:
+                    future.execute(method, args, kwargs)
+                except Exception as ex:
+                    self._logger.exception("Error executing %s: %s",
+                                           method.__name__, ex)
+
+            try:
+                # Let the other keys run
+                self._pool.enqueue(self.__run, key)
+                return
+            except queue.Full:
+                # Keep the thread
+                pass
+            except RuntimeError as ex:
+                # The pool has been shut down: fail the remaining tasks
+                with self.__lock:
+                    tasks = self.__queues.pop(key)
+
+                for _, _, _, future in tasks:
+                    try:
+                        future.execute(_raise, (ex,), None)
+                    except RuntimeError:
+                        pass
+                return
+
+# ------------------------------------------------------------------------------
+
+
+class Bulkhead(object):
+    """
+    Limits the number of concurrent executions of a group of tasks.
+
+    By default, tasks above the limit are rejected immediately. If waiting is
+    allowed (``max_waiting``), tasks above the limit wait for a slot, up to a
+    given number of waiting tasks and a given time, then are rejected.
+
+    Waiting tasks block the thread executing them: in a server, they hold
+    worker threads shared with the other methods. A slow group of tasks with
+    waiting allowed can still starve the others: keep ``max_waiting`` and
+    ``timeout`` small.
+    """
+    def __init__(self, max_concurrent, max_waiting=0, timeout=None):
+        """
+        Sets up the bulkhead
+
+        :param max_concurrent: Maximum number of concurrent executions
+        :param max_waiting: Maximum number of tasks waiting for a slot
+                            (0 to reject tasks immediately, None for no
+                            limit)
+        :param timeout: Maximum time to wait for a slot, in seconds
+                        (None for no limit)
+        :raise ValueError: Invalid number of concurrent executions
+        """
+        try:
+            max_concurrent = int(max_concurrent)
+            if max_concurrent < 1:
+                raise ValueError("Limit must be greater than 0")
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid concurrency limit: {0}".format(ex))
+
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+
+        self.__condition = threading.Condition()
+        self.__active = 0
+        self.__waiting = 0
+        self.__rejected = 0
+
+    @property
+    def active(self):
+        """
+        Number of tasks currently executed
+        """
+        return self.__active
+
+    @property
+    def waiting(self):
+        """
+        Number of tasks waiting for a slot
+        """
+        return self.__waiting
+
+    @property
+    def rejected(self):
+        """
+        Number of tasks rejected since the creation of the bulkhead
+        """
+        return self.__rejected
+
+    def acquire(self):
+        """
+        Waits for an execution slot
+
+        :return: True if a slot has been acquired, False if the task is
+                 rejected
+        """
+        with self.__condition:
+            if self.__active < self.max_concurrent:
+                # Fast path
+                self.__active += 1
+                return True
+
+            if self.max_waiting is not None \
+                    and self.__waiting >= self.max_waiting:
+                # Too many waiting tasks
+                self.__rejected += 1
+                return False
+
+            if self.timeout is not None:
+                deadline = utils.monotonic() + self.timeout
+
+            self.__waiting += 1
+            try:
+                while self.__active >= self.max_concurrent:
+                    if self.timeout is None:
+                        self.__condition.wait()
+                    else:
+                        remaining = deadline - utils.monotonic()
+                        if remaining <= 0:
+                            # Waited for too long
+                            self.__rejected += 1
+                            return False
+
+                        self.__condition.wait(remaining)
+
+                self.__active += 1
+                return True
+            finally:
+                self.__waiting -= 1
+
+    def release(self):
+        """
+        Releases an execution slot
+        """
+        with self.__condition:
+            self.__active -= 1
+            self.__condition.notify()
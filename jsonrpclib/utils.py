@@ -25,7 +25,9 @@ Utility methods, for compatibility between Python version
     limitations under the License.
 """
 
+import math
 import sys
+import time
 
 # ------------------------------------------------------------------------------
 
@@ -127,6 +129,34 @@ except ImportError:
         """
         return False
 
+# ------------------------------------------------------------------------------
+# Clock
+
+try:
+    # Python 3.3+
+    monotonic = time.monotonic
+except AttributeError:
+    # Fall back to the wall clock
+    monotonic = time.time
+
+# ------------------------------------------------------------------------------
+# Statistics
+
+
+def percentile(sorted_values, percent):
+    """
+    Computes a percentile with the nearest-rank method
+
+    :param sorted_values: A sorted list of values
+    :param percent: The percentile to compute (0 to 100)
+    :return: The percentile value, or None if the list is empty
+    """
+    if not sorted_values:
+        return None
+
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
 # ------------------------------------------------------------------------------
 # Common
 
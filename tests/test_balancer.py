@@ -0,0 +1,271 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the client-side load balancing
+
+:license: Apache License 2.0
+"""
+
+# Tests utilities
+from tests.utilities import free_port, start_server
+
+# JSON-RPC library
+from jsonrpclib import MultiCall, ProtocolError
+from jsonrpclib.SimpleJSONRPCServer import PooledJSONRPCServer
+import jsonrpclib.balancer as balancer
+
+# Standard library
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+def start_indexed_server(index, port=0):
+    """
+    Starts a pooled server whose "whoami" method returns the given index
+    """
+    return start_server({"whoami": lambda: index, "add": lambda a, b: a + b},
+                        port, PooledJSONRPCServer)
+
+
+class FakeEndpoint(object):
+    """
+    Endpoint with a number of outstanding calls
+    """
+    def __init__(self, outstanding):
+        self.outstanding = outstanding
+
+
+class PolicyTests(unittest.TestCase):
+    """
+    Tests the balancing policies
+    """
+    def test_round_robin(self):
+        """
+        Tests the round-robin policy
+        """
+        endpoints = [FakeEndpoint(0) for _ in range(3)]
+        policy = balancer.RoundRobinPolicy()
+        self.assertEqual([policy.choose(endpoints) for _ in range(6)],
+                         endpoints * 2)
+
+    def test_least_outstanding(self):
+        """
+        Tests the least-outstanding-requests policy
+        """
+        endpoints = [FakeEndpoint(2), FakeEndpoint(0), FakeEndpoint(1)]
+        policy = balancer.LeastOutstandingPolicy()
+        for _ in range(10):
+            self.assertIs(policy.choose(endpoints), endpoints[1])
+
+    def test_power_of_two(self):
+        """
+        Tests the power-of-two-choices policy
+        """
+        endpoints = [FakeEndpoint(5), FakeEndpoint(0), FakeEndpoint(1)]
+        policy = balancer.PowerOfTwoPolicy()
+        chosen = set(policy.choose(endpoints) for _ in range(100))
+        # The most loaded endpoint is never chosen
+        self.assertNotIn(endpoints[0], chosen)
+        self.assertIs(policy.choose(endpoints[:1]), endpoints[0])
+
+
+class BalancedServerProxyTests(unittest.TestCase):
+    """
+    Tests the balanced proxy against servers
+    """
+    def setUp(self):
+        """
+        Starts the servers
+        """
+        self.servers = [start_indexed_server(idx) for idx in range(2)]
+        self.uris = ["http://localhost:{0}".format(
+            server.socket.getsockname()[1]) for server in self.servers]
+
+    def tearDown(self):
+        """
+        Stops the servers
+        """
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def test_round_robin(self):
+        """
+        Tests calls spread over the endpoints, from multiple threads
+        """
+        self.assertRaises(ValueError, balancer.BalancedServerProxy, [])
+        self.assertRaises(ValueError, balancer.BalancedServerProxy,
+                          self.uris, policy="unknown")
+
+        proxy = balancer.BalancedServerProxy(self.uris)
+        self.assertEqual([proxy.whoami() for _ in range(4)], [0, 1, 0, 1])
+        proxy._notify.whoami()
+
+        # Batches
+        batch = MultiCall(proxy)
+        batch.add(1, 2)
+        batch.add(3, 4)
+        self.assertEqual(batch()[1], 7)
+
+        # Application errors don't eject endpoints
+        for _ in range(5):
+            self.assertRaises(ProtocolError, proxy.add, 1)
+        self.assertTrue(all(endpoint.healthy
+                            for endpoint in proxy("endpoints")))
+
+        results = []
+
+        def call():
+            for _ in range(10):
+                results.append(proxy.add(1, 2))
+
+        threads = [threading.Thread(target=call) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [3] * 40)
+        for endpoint in proxy("endpoints"):
+            self.assertEqual(endpoint.outstanding, 0)
+
+        proxy("close")()
+        self.assertRaises(AttributeError, proxy, "unknown")
+
+    def test_ejection(self):
+        """
+        Tests the ejection and the re-admission of a failing endpoint
+        """
+        port = free_port()
+        proxy = balancer.BalancedServerProxy(
+            self.uris + ["http://localhost:{0}".format(port)],
+            max_failures=2, eject_time=.2)
+        dead = proxy("endpoints")[2]
+
+        # Call until the dead endpoint is ejected
+        errors = 0
+        for _ in range(20):
+            try:
+                self.assertIn(proxy.whoami(), (0, 1))
+            except IOError:
+                errors += 1
+        self.assertEqual(errors, 2)
+        self.assertFalse(dead.healthy)
+
+        # Revive the endpoint, then wait for the probe
+        self.servers.append(start_indexed_server(2, port))
+        time.sleep(.3)
+        self.assertEqual(proxy.whoami(), 2)
+        self.assertTrue(dead.healthy)
+        self.assertEqual(dead.failures, 0)
+
+    def test_probe_method(self):
+        """
+        Tests the probe method
+        """
+        port = free_port()
+        proxy = balancer.BalancedServerProxy(
+            ["http://localhost:{0}".format(port), self.uris[0]],
+            max_failures=1, eject_time=.1, probe_method="whoami")
+        dead = proxy("endpoints")[0]
+        self.assertRaises(IOError, proxy.whoami)
+        self.assertFalse(dead.healthy)
+
+        # Failed probes don't fail the calls
+        time.sleep(.2)
+        self.assertEqual([proxy.whoami() for _ in range(3)], [0, 0, 0])
+        self.assertFalse(dead.healthy)
+
+        self.servers.append(start_indexed_server(2, port))
+        time.sleep(.2)
+        self.assertEqual(proxy.whoami(), 2)
+        self.assertTrue(dead.healthy)
+
+
+class HedgingTests(unittest.TestCase):
+    """
+    Tests the hedged calls
+    """
+    def test_policy(self):
+        """
+        Tests the hedging delay and budget
+        """
+        policy = balancer.HedgingPolicy(percentile=90, budget=.5,
+                                        min_delay=.002, min_samples=10)
+        for idx in range(9):
+            self.assertIsNone(policy.start_call())
+            policy.record(idx / 1000.0)
+
+        self.assertIsNone(policy.start_call())
+        policy.record(.009)
+        self.assertEqual(policy.start_call(), .008)
+        self.assertEqual(policy.calls, 11)
+
+        # Budget: half of the calls
+        self.assertEqual(sum(policy.acquire_hedge() for _ in range(10)), 5)
+        self.assertEqual(policy.hedged, 5)
+
+        policy = balancer.HedgingPolicy(min_delay=.5, min_samples=1)
+        policy.record(.001)
+        self.assertEqual(policy.start_call(), .5)
+
+    def test_hedged_calls(self):
+        """
+        Tests hedged calls to a slow endpoint
+        """
+        delays = [0, 0]
+
+        def slow(index):
+            time.sleep(delays[index])
+            return index
+
+        servers = []
+        for idx in range(2):
+            server = start_indexed_server(idx)
+            server.register_function(
+                lambda idx=idx: slow(idx), "slow")
+            servers.append(server)
+
+        try:
+            proxy = balancer.BalancedServerProxy(
+                ["http://localhost:{0}".format(server.socket.getsockname()[1])
+                 for server in servers])
+            policy = balancer.HedgingPolicy(budget=1, min_delay=.05,
+                                            min_samples=4)
+            proxy._set_hedging("slow", policy)
+
+            # Learn the latencies
+            self.assertEqual([proxy.slow() for _ in range(4)], [0, 1, 0, 1])
+            self.assertEqual(policy.hedged, 0)
+
+            # Slow down the first endpoint: its calls are hedged
+            delays[0] = 1
+            start = time.time()
+            self.assertEqual([proxy.slow() for _ in range(4)], [1, 1, 1, 1])
+            self.assertLess(time.time() - start, 1)
+            self.assertEqual(policy.hedged, 2)
+
+            # Aborted calls are not failures of the endpoint
+            for endpoint in proxy("endpoints"):
+                self.assertEqual(endpoint.failures, 0)
+                self.assertEqual(endpoint.outstanding, 0)
+
+            # No budget left: wait for the slow endpoint
+            policy.budget = 0
+            self.assertEqual([proxy.slow() for _ in range(2)], [0, 1])
+            self.assertEqual(policy.hedged, 2)
+
+            # Methods without hedging
+            proxy._set_hedging("slow", None)
+            self.assertEqual(proxy.whoami(), 0)
+            proxy("close")()
+        finally:
+            for server in servers:
+                server.shutdown()
+                server.server_close()
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the load-testing tool
+
+:license: Apache License 2.0
+"""
+
+# JSON-RPC library
+from jsonrpclib.SimpleJSONRPCServer import PooledJSONRPCServer
+import jsonrpclib.bench as bench
+
+# Standard library
+import random
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class UtilsTests(unittest.TestCase):
+    """
+    Tests the call mix and the histogram
+    """
+    def test_mix(self):
+        """
+        Tests the parsing and the weights of the call mix
+        """
+        mix = bench.parse_mix(["add:3", "echo"])
+        self.assertEqual(mix, [("add", 3.0), ("echo", 1.0)])
+        self.assertRaises(ValueError, bench.parse_mix, ["add:0"])
+        self.assertRaises(ValueError, bench.parse_mix, ["add:x"])
+        self.assertRaises(ValueError, bench.CallMix, [])
+
+        call_mix = bench.CallMix(mix)
+        rand = random.Random(42)
+        picks = [call_mix.pick(rand) for _ in range(4000)]
+        self.assertAlmostEqual(picks.count("add") / 4000.0, .75, delta=.05)
+
+    def test_histogram(self):
+        """
+        Tests the latency histogram
+        """
+        self.assertEqual(bench.format_histogram([]), "")
+        lines = bench.format_histogram([.0015, .002, .02, 20], width=10) \
+            .splitlines()
+        self.assertEqual(lines[0].split(), ["<=", "2.5", "ms", "2",
+                                            "#" * 10])
+        self.assertEqual(lines[-1].split(), [">", "10000", "ms", "1",
+                                             "#" * 5])
+
+
+class LoadTestTests(unittest.TestCase):
+    """
+    Tests load tests against a server
+    """
+    def setUp(self):
+        """
+        Starts a server
+        """
+        self.server = PooledJSONRPCServer(("localhost", 0), logRequests=False)
+        self.server.register_function(lambda value: value, "echo")
+        self.server.register_function(lambda value: len(value), "length")
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://localhost:{0}".format(
+            self.server.socket.getsockname()[1])
+
+    def tearDown(self):
+        """
+        Stops the server
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_requests(self):
+        """
+        Tests a load test with a number of requests, batches and
+        notifications
+        """
+        load_test = bench.LoadTest(self.url, [("echo", 1), ("length", 1)],
+                                   concurrency=3, batch_size=4,
+                                   payload_size=100, notify_ratio=.5)
+        report = load_test.run(requests=30, seed=1)
+        self.assertEqual(report['requests'], 30)
+        self.assertEqual(report['calls'], 120)
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['error_rate'], 0)
+        self.assertEqual(len(report['latencies']), 30)
+        self.assertGreater(report['calls_throughput'],
+                           report['throughput'])
+        self.assertIn("Calls:      120", bench.format_load_report(report))
+
+    def test_errors(self):
+        """
+        Tests the report of errors, with a duration
+        """
+        load_test = bench.LoadTest(self.url, [("unknown", 1)],
+                                   concurrency=2)
+        report = load_test.run(duration=.2)
+        self.assertGreater(report['errors'], 0)
+        self.assertEqual(report['errors'], report['requests'])
+        self.assertEqual(report['error_rate'], 1)
+        self.assertEqual(list(report['error_types']), ["ProtocolError"])
+        self.assertRaises(ValueError, load_test.run)
+
+    def test_main(self):
+        """
+        Tests the command line entry point
+        """
+        self.assertEqual(bench.main([self.url, "-n", "5", "-m", "echo",
+                                     "-p", "[1]", "--json"]), 0)
+        self.assertEqual(bench.main([self.url, "-n", "5", "-m", "unknown"]),
+                         1)
@@ -0,0 +1,270 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the LRU cache
+
+:license: Apache License 2.0
+"""
+
+# JSON-RPC library
+from jsonrpclib import ServerProxy
+from jsonrpclib.cache import LRUCache, ResponseCache, cache_key, max_age
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer, \
+    SimpleJSONRPCRequestHandler
+
+# Standard library
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class LRUCacheTests(unittest.TestCase):
+    """
+    Tests the LRUCache class
+    """
+    def test_lru(self):
+        """
+        Least recently used entries are evicted first
+        """
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertIsNone(cache.get("b"))
+
+        stats = cache.stats
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["entries"], 2)
+
+    def test_ttl(self):
+        """
+        Expired entries are not returned
+        """
+        cache = LRUCache(ttl=.2)
+        cache.put("a", 1)
+        cache.put("b", 2, ttl=10)
+        self.assertFalse(cache.put("c", 3, ttl=0))
+        self.assertEqual(cache.get("a"), 1)
+
+        time.sleep(.3)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+        self.assertIsNone(cache.get("c"))
+
+    def test_max_bytes(self):
+        """
+        Total size of the values is limited
+        """
+        cache = LRUCache(max_bytes=10)
+        self.assertFalse(cache.put("big", "x" * 11))
+        cache.put("a", "x" * 4)
+        cache.put("b", "x" * 4)
+        self.assertEqual(cache.stats["bytes"], 8)
+
+        cache.put("c", "x" * 4)
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.stats["bytes"], 8)
+
+        self.assertTrue(cache.invalidate("b"))
+        self.assertFalse(cache.invalidate("b"))
+        self.assertEqual(cache.stats["bytes"], 4)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats["bytes"], 0)
+
+    def test_key(self):
+        """
+        Tests the canonical cache key
+        """
+        self.assertEqual(cache_key("m", {"a": 1, "b": [1, 2]}),
+                         cache_key("m", {"b": [1, 2], "a": 1}))
+        self.assertNotEqual(cache_key("m", [1]), cache_key("n", [1]))
+        self.assertIsNone(cache_key("m", [object()]))
+
+# ------------------------------------------------------------------------------
+
+
+class HintRequestHandler(SimpleJSONRPCRequestHandler):
+    """
+    Request handler sending a Cache-Control header
+    """
+    cache_control = "max-age=60"
+
+    def end_headers(self):
+        self.send_header("Cache-Control", self.cache_control)
+        SimpleJSONRPCRequestHandler.end_headers(self)
+
+
+class ResponseCacheTests(unittest.TestCase):
+    """
+    Tests the client-side cache
+    """
+    def test_max_age(self):
+        """
+        Tests the parsing of Cache-Control headers
+        """
+        self.assertIsNone(max_age(None))
+        self.assertIsNone(max_age({}))
+        self.assertIsNone(max_age({"cache-control": "private"}))
+        self.assertEqual(max_age({"cache-control": "public, max-age=10"}), 10)
+        self.assertEqual(max_age({"cache-control": "no-cache"}), 0)
+        self.assertEqual(max_age({"cache-control": "no-store"}), 0)
+        self.assertEqual(max_age({"cache-control": "max-age=abc"}), 0)
+
+    def test_configured_methods(self):
+        """
+        Only configured methods are cached without hints
+        """
+        calls = []
+
+        def loader(value):
+            calls.append(value)
+            return value, None
+
+        cache = ResponseCache({"cached": 60})
+        for _ in range(3):
+            self.assertEqual(cache.call("cached", [1], lambda: loader(1)), 1)
+            self.assertEqual(cache.call("other", [1], lambda: loader(2)), 2)
+
+        self.assertEqual(calls, [1, 2, 2, 2])
+
+        # Server hints have the priority
+        cache = ResponseCache({"cached": 60})
+        del calls[:]
+        for _ in range(2):
+            cache.call("cached", [1], lambda: (loader(1)[0], 0))
+            cache.call("other", [1], lambda: (loader(2)[0], 60))
+        self.assertEqual(calls, [1, 2, 1])
+
+        # ... unless disabled
+        cache = ResponseCache(use_hints=False)
+        del calls[:]
+        for _ in range(2):
+            cache.call("other", [1], lambda: (loader(2)[0], 60))
+        self.assertEqual(calls, [2, 2])
+
+    def test_in_flight(self):
+        """
+        Identical concurrent calls are merged
+        """
+        calls = []
+        event = threading.Event()
+
+        def loader():
+            calls.append(None)
+            event.wait(5)
+            return 42, None
+
+        cache = ResponseCache({"slow": 60})
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(cache.call("slow", [], loader)))
+            for _ in range(5)]
+        for thread in threads:
+            thread.start()
+
+        time.sleep(.2)
+        event.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_hint_withdrawn(self):
+        """
+        Calls are no longer merged once the server stops hinting a method
+        """
+        calls = []
+        event = threading.Event()
+
+        def loader():
+            calls.append(None)
+            event.wait(5)
+            return 42, 0
+
+        cache = ResponseCache()
+        cache.call("method", [1], lambda: (1, 60))
+        cache.call("method", [2], lambda: (2, 0))
+
+        threads = [threading.Thread(target=cache.call,
+                                    args=("method", [3], loader))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+
+        time.sleep(.2)
+        event.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 3)
+
+    def test_errors(self):
+        """
+        Errors are not cached and are propagated to all waiting callers
+        """
+        calls = []
+
+        def loader():
+            calls.append(None)
+            raise ValueError("Error")
+
+        cache = ResponseCache({"failing": 60})
+        for _ in range(2):
+            self.assertRaises(ValueError, cache.call, "failing", [], loader)
+        self.assertEqual(len(calls), 2)
+
+    def test_proxy(self):
+        """
+        Tests the cache in a ServerProxy, with server hints
+        """
+        calls = []
+
+        def lookup(key):
+            calls.append(key)
+            return key
+
+        server = SimpleJSONRPCServer(("localhost", 0), HintRequestHandler,
+                                     logRequests=False)
+        server.register_function(lookup)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            port = server.socket.getsockname()[1]
+            cache = ResponseCache()
+            client = ServerProxy("http://localhost:{0}".format(port),
+                                 cache=cache)
+            self.assertIs(client("cache"), cache)
+
+            for _ in range(3):
+                self.assertEqual(client.lookup("a"), "a")
+                self.assertEqual(client.lookup(key="b"), "b")
+
+            self.assertEqual(calls, ["a", "b"])
+            self.assertEqual(cache.stats["hits"], 4)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
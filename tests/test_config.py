@@ -28,7 +28,8 @@ class ConfigTests(unittest.TestCase):
         """
         self.assertIsNot(config1, config2)
         for member in ('version', 'use_jsonclass', 'content_type',
-                       'user_agent', 'ignore_attribute'):
+                       'user_agent', 'ignore_attribute', 'fault_detail',
+                       'trace_log_rate'):
             self.assertEqual(getattr(config1, member),
                              getattr(config2, member))
 
@@ -56,6 +57,8 @@ class ConfigTests(unittest.TestCase):
         config1.user_agent = "test_agent"
         config1.serialize_method = "_new_method"
         config1.ignore_attribute = "_new_method"
+        config1.fault_detail = "full"
+        config1.trace_log_rate = .5
         self.compare_config(config1, config1.copy())
 
         # Handlers
@@ -0,0 +1,580 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the JSON-RPC dispatcher
+
+:license: Apache License 2.0
+"""
+
+# JSON-RPC library
+from jsonrpclib import Fault
+from jsonrpclib.config import Config, FAULT_DETAIL_NONE, \
+    FAULT_DETAIL_LAST_FRAME, FAULT_DETAIL_FULL
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCDispatcher, \
+    ParametersChecker, param_key
+from jsonrpclib.cache import LRUCache
+from jsonrpclib.threadpool import Bulkhead, KeyedExecutor, ThreadPool
+import jsonrpclib.jsonrpc
+
+# Standard library
+import json
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class SubService(object):
+    """
+    Nested service
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def method(self, value):
+        self.calls += 1
+        return value * 2
+
+
+class Service(object):
+    """
+    Service registered as an instance
+    """
+    def __init__(self):
+        self.sub = SubService()
+
+    def echo(self, value):
+        return value
+
+
+class CustomDispatchService(object):
+    """
+    Service with a custom _dispatch method
+    """
+    def _dispatch(self, method, params):
+        return method, params
+
+# ------------------------------------------------------------------------------
+
+
+class MethodCacheTests(unittest.TestCase):
+    """
+    Tests the cache of the methods resolved in the registered instance
+    """
+    def test_dotted_name(self):
+        """
+        Dotted names are resolved once and kept in the cache
+        """
+        dispatcher = SimpleJSONRPCDispatcher()
+        service = Service()
+        dispatcher.register_instance(service)
+
+        self.assertEqual(dispatcher._dispatch("sub.method", [21]), 42)
+        self.assertEqual(dispatcher._dispatch("sub.method", [1]), 2)
+        self.assertEqual(service.sub.calls, 2)
+
+        # The resolved method is cached
+        cache = dispatcher._SimpleJSONRPCDispatcher__method_cache
+        self.assertIn("sub.method", cache)
+
+        # Unknown methods are not cached
+        fault = dispatcher._dispatch("sub.unknown", [])
+        self.assertIsInstance(fault, Fault)
+        self.assertEqual(fault.faultCode, -32601)
+        self.assertNotIn("sub.unknown", cache)
+
+    def test_invalidation(self):
+        """
+        The cache is cleared when registering an instance or a function
+        """
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_instance(Service())
+        self.assertEqual(dispatcher._dispatch("echo", [1]), 1)
+
+        # Registering a function clears the cache
+        dispatcher.register_function(lambda value: -value, "other")
+        cache = dispatcher._SimpleJSONRPCDispatcher__method_cache
+        self.assertNotIn("echo", cache)
+
+        # Registered functions have priority on the instance
+        dispatcher.register_function(lambda value: value + 1, "echo")
+        self.assertEqual(dispatcher._dispatch("echo", [1]), 2)
+
+        # New instance
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_instance(Service())
+        dispatcher._dispatch("echo", [1])
+        dispatcher.register_instance(CustomDispatchService())
+        self.assertEqual(dispatcher._dispatch("echo", [1]), ("echo", [1]))
+
+    def test_direct_instance_change(self):
+        """
+        The cache follows an instance set without register_instance()
+        """
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_instance(Service())
+        self.assertEqual(dispatcher._dispatch("echo", [1]), 1)
+
+        dispatcher.instance = CustomDispatchService()
+        self.assertEqual(dispatcher._dispatch("echo", [1]), ("echo", [1]))
+
+# ------------------------------------------------------------------------------
+
+
+def add(x, y=0):
+    return x + y
+
+
+def varargs(*args, **kwargs):
+    return args, kwargs
+
+
+class ParametersTests(unittest.TestCase):
+    """
+    Tests the validation of parameters before calling methods
+    """
+    def test_checker(self):
+        """
+        Tests the ParametersChecker class
+        """
+        checker = ParametersChecker(add)
+        for params in ([1], [1, 2], {"x": 1}, {"x": 1, "y": 2}):
+            self.assertIsNone(checker.check(params))
+
+        for params in ([], [1, 2, 3], {}, {"y": 1}, {"x": 1, "z": 2}):
+            self.assertIsNotNone(checker.check(params))
+
+        # Anything goes
+        checker = ParametersChecker(varargs)
+        self.assertTrue(checker.accepts_all)
+        self.assertIsNone(checker.check([1, 2, 3]))
+        self.assertIsNone(checker.check({"a": 1}))
+
+        # Bound method
+        checker = ParametersChecker(Service().echo)
+        self.assertIsNone(checker.check([1]))
+        self.assertIsNotNone(checker.check([1, 2]))
+
+    def test_invalid_parameters(self):
+        """
+        Invalid calls are rejected without entering the method
+        """
+        calls = []
+
+        def method(a, b):
+            calls.append((a, b))
+
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(method)
+        dispatcher.register_instance(Service())
+
+        for name, params in (("method", [1]), ("method", {"a": 1, "c": 2}),
+                             ("echo", [])):
+            fault = dispatcher._dispatch(name, params)
+            self.assertIsInstance(fault, Fault)
+            self.assertEqual(fault.faultCode, -32602)
+
+        self.assertEqual(calls, [])
+
+    def test_inner_type_error(self):
+        """
+        A TypeError raised by a method is a server error
+        """
+        def method(value):
+            return value + "suffix"
+
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(method)
+
+        fault = dispatcher._dispatch("method", [42])
+        self.assertIsInstance(fault, Fault)
+        self.assertEqual(fault.faultCode, -32603)
+        self.assertEqual(dispatcher._dispatch("method", ["a"]), "asuffix")
+
+    def test_unknown_signature(self):
+        """
+        Methods without signature are called as is
+        """
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(max)
+        self.assertEqual(dispatcher._dispatch("max", [1, 3, 2]), 3)
+
+# ------------------------------------------------------------------------------
+
+
+def raising():
+    raise ValueError("Some error")
+
+
+class FaultDetailTests(unittest.TestCase):
+    """
+    Tests the level of detail of server errors
+    """
+    def _call(self, fault_detail):
+        """
+        Calls the raising method with the given fault detail policy
+        """
+        config = Config(fault_detail=fault_detail, trace_log_rate=0)
+        dispatcher = SimpleJSONRPCDispatcher(config=config)
+        dispatcher.register_function(raising)
+        fault = dispatcher._dispatch("raising", [])
+        self.assertIsInstance(fault, Fault)
+        self.assertEqual(fault.faultCode, -32603)
+        return fault.faultString
+
+    def test_none(self):
+        """
+        No detail at all
+        """
+        self.assertEqual(self._call(FAULT_DETAIL_NONE), "Server error")
+
+    def test_last_frame(self):
+        """
+        Last frame of the traceback (default)
+        """
+        message = self._call(FAULT_DETAIL_LAST_FRAME)
+        self.assertTrue(message.startswith("Server error: File "))
+        self.assertIn("in raising | ValueError: Some error", message)
+        self.assertNotIn("Traceback", message)
+
+    def test_full(self):
+        """
+        Full traceback
+        """
+        message = self._call(FAULT_DETAIL_FULL)
+        self.assertIn("Traceback", message)
+        self.assertIn("_dispatch", message)
+        self.assertIn("ValueError: Some error", message)
+
+# ------------------------------------------------------------------------------
+
+
+class MarshaledResponseTests(unittest.TestCase):
+    """
+    Tests the responses spliced in pre-encoded envelopes
+    """
+    def test_dumps_response(self):
+        """
+        dumps_response() returns the same content as dumps()
+        """
+        for version in (1.0, 2.0):
+            for result in (None, 42, "text", [1, {"a": "b"}], {"c": [1]}):
+                for rpcid in (0, 1, "abc"):
+                    spliced = jsonrpclib.jsonrpc.dumps_response(
+                        result, rpcid, version)
+                    standard = jsonrpclib.dumps(
+                        result, methodresponse=True, rpcid=rpcid,
+                        version=version)
+                    self.assertEqual(json.loads(spliced),
+                                     json.loads(standard))
+
+        # Faults use the standard path
+        fault = Fault(-32000, "Error")
+        self.assertEqual(
+            json.loads(jsonrpclib.jsonrpc.dumps_response(fault, 1)),
+            json.loads(jsonrpclib.dumps(fault, methodresponse=True, rpcid=1)))
+
+        # A response must have an ID
+        self.assertRaises(ValueError, jsonrpclib.jsonrpc.dumps_response,
+                          42, None)
+
+    def test_marshaled_dispatch(self):
+        """
+        Marshaled responses match the unmarshaled ones
+        """
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(add)
+        requests = [
+            {"jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 1},
+            {"jsonrpc": "2.0", "method": "add", "params": [], "id": 2},
+            {"jsonrpc": "2.0", "method": "add", "params": [3]},
+            {"method": "add", "params": {"x": 1, "y": 2}, "id": "a"},
+            {"jsonrpc": "2.0", "method": "unknown", "id": 3},
+            "invalid",
+        ]
+
+        for request in requests:
+            data = json.dumps(request)
+            marshaled = dispatcher._marshaled_dispatch(data)
+            # Compare with the request as loaded by the dispatcher (unicode
+            # strings in Python 2)
+            unmarshaled = dispatcher._unmarshaled_dispatch(json.loads(data))
+            if unmarshaled is None:
+                self.assertEqual(marshaled, '')
+            else:
+                self.assertEqual(json.loads(marshaled), unmarshaled)
+
+        # Batch
+        data = json.dumps(requests)
+        marshaled = dispatcher._marshaled_dispatch(data)
+        unmarshaled = dispatcher._unmarshaled_dispatch(json.loads(data))
+        self.assertEqual(json.loads(marshaled), unmarshaled)
+        self.assertEqual(len(unmarshaled), len(requests) - 1)
+
+    def test_dispatch_hooks(self):
+        """
+        Marshaled requests use the overridden dispatch methods
+        """
+        class HookedDispatcher(SimpleJSONRPCDispatcher):
+            def _marshaled_single_dispatch(self, request,
+                                           dispatch_method=None):
+                response = SimpleJSONRPCDispatcher._marshaled_single_dispatch(
+                    self, request, dispatch_method)
+                response['result'] *= 10
+                return response
+
+        dispatcher = HookedDispatcher()
+        dispatcher.register_function(lambda: 4, "get")
+        marshaled = dispatcher._marshaled_dispatch(json.dumps(
+            {"jsonrpc": "2.0", "method": "get", "id": 1}))
+        self.assertEqual(json.loads(marshaled)["result"], 40)
+
+# ------------------------------------------------------------------------------
+
+
+class ResultCacheTests(unittest.TestCase):
+    """
+    Tests the cache of method results
+    """
+    def test_cache(self):
+        """
+        Cached results don't call the method again
+        """
+        calls = []
+
+        def lookup(key):
+            calls.append(key)
+            return {"key": key}
+
+        cache = LRUCache()
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(lookup, cache=cache)
+        self.assertIs(dispatcher.get_result_cache("lookup"), cache)
+
+        request = {"jsonrpc": "2.0", "method": "lookup", "params": ["a"],
+                   "id": 1}
+        first = json.loads(dispatcher._marshaled_dispatch(
+            json.dumps(request)))
+        request["id"] = 2
+        second = json.loads(dispatcher._marshaled_dispatch(
+            json.dumps(request)))
+        self.assertEqual(first["result"], {"key": "a"})
+        self.assertEqual(second["result"], {"key": "a"})
+        self.assertEqual(second["id"], 2)
+
+        # Unmarshaled dispatch uses the same cache
+        request["id"] = 3
+        third = dispatcher._unmarshaled_dispatch(request)
+        self.assertEqual(third["result"], {"key": "a"})
+        self.assertEqual(third["id"], 3)
+        self.assertEqual(calls, ["a"])
+
+        # Other parameters
+        request["params"] = {"key": "b"}
+        dispatcher._unmarshaled_dispatch(request)
+        self.assertEqual(calls, ["a", "b"])
+        self.assertEqual(cache.stats["hits"], 2)
+        self.assertEqual(cache.stats["misses"], 2)
+
+        # Remove the cache
+        dispatcher.set_result_cache("lookup", None)
+        dispatcher._unmarshaled_dispatch(request)
+        self.assertEqual(calls, ["a", "b", "b"])
+
+    def test_errors_not_cached(self):
+        """
+        Faults are not stored
+        """
+        calls = []
+
+        def failing():
+            calls.append(None)
+            raise ValueError("Error")
+
+        dispatcher = SimpleJSONRPCDispatcher(
+            config=Config(trace_log_rate=0))
+        dispatcher.register_function(failing, cache=LRUCache())
+
+        request = {"jsonrpc": "2.0", "method": "failing", "id": 1}
+        for _ in range(2):
+            response = dispatcher._unmarshaled_dispatch(dict(request))
+            self.assertEqual(response["error"]["code"], -32603)
+        self.assertEqual(len(calls), 2)
+
+# ------------------------------------------------------------------------------
+
+
+class SingleFlightTests(unittest.TestCase):
+    """
+    Tests the sharing of the results of identical concurrent calls
+    """
+    def _run(self, single_flight, params_list):
+        """
+        Calls a slow method concurrently with the given parameters
+
+        :return: The list of results and the list of calls
+        """
+        calls = []
+        event = threading.Event()
+
+        def slow(value):
+            calls.append(value)
+            event.wait(5)
+            return value * 2
+
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(slow, single_flight=single_flight)
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda p=params: results.append(
+                dispatcher._dispatch("slow", p)))
+            for params in params_list]
+        for thread in threads:
+            thread.start()
+
+        time.sleep(.2)
+        event.set()
+        for thread in threads:
+            thread.join()
+
+        return sorted(results), sorted(calls)
+
+    def test_single_flight(self):
+        """
+        Identical calls are computed once
+        """
+        results, calls = self._run(True, [[1]] * 5 + [{"value": 2}] * 3)
+        self.assertEqual(results, [2] * 5 + [4] * 3)
+        self.assertEqual(calls, [1, 2])
+
+    def test_disabled(self):
+        """
+        Calls are computed independently by default
+        """
+        results, calls = self._run(False, [[1]] * 3)
+        self.assertEqual(results, [2] * 3)
+        self.assertEqual(calls, [1] * 3)
+
+    def test_fault_shared(self):
+        """
+        Faults are shared too
+        """
+        dispatcher = SimpleJSONRPCDispatcher(
+            config=Config(trace_log_rate=0))
+        dispatcher.register_function(raising, single_flight=True)
+        fault = dispatcher._dispatch("raising", [])
+        self.assertIsInstance(fault, Fault)
+        self.assertEqual(fault.faultCode, -32603)
+
+        dispatcher.set_single_flight("raising", False)
+        self.assertIsInstance(dispatcher._dispatch("raising", []), Fault)
+
+# ------------------------------------------------------------------------------
+
+
+class BulkheadTests(unittest.TestCase):
+    """
+    Tests the concurrency limits of methods
+    """
+    def test_group(self):
+        """
+        Methods sharing a bulkhead are limited together
+        """
+        event = threading.Event()
+        bulkhead = Bulkhead(1, max_waiting=0)
+
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(event.wait, "slow", bulkhead=bulkhead)
+        dispatcher.register_function(add, bulkhead=bulkhead)
+        dispatcher.register_function(add, "free_add")
+
+        thread = threading.Thread(target=dispatcher._dispatch,
+                                  args=("slow", [5]))
+        thread.start()
+        time.sleep(.2)
+
+        try:
+            for method in ("slow", "add"):
+                fault = dispatcher._dispatch(method, [1])
+                self.assertIsInstance(fault, Fault)
+                self.assertEqual(fault.faultCode, -32001)
+
+            # Methods without bulkhead are not limited
+            self.assertEqual(dispatcher._dispatch("free_add", [1]), 1)
+        finally:
+            event.set()
+            thread.join()
+
+        # The slot has been released
+        self.assertEqual(dispatcher._dispatch("add", [1, 2]), 3)
+        self.assertEqual(bulkhead.active, 0)
+
+        # Remove the limit
+        dispatcher.set_bulkhead("add", None)
+        bulkhead.acquire()
+        self.assertEqual(dispatcher._dispatch("add", [1, 2]), 3)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+class OrderedNotificationsTests(unittest.TestCase):
+    """
+    Tests the ordering of notifications by key
+    """
+    def test_param_key(self):
+        """
+        Notifications with the same key are executed in order
+        """
+        pool = ThreadPool(4)
+        pool.start()
+        executed = []
+        lock = threading.Lock()
+
+        def notify(user, idx):
+            time.sleep(.001 * (idx % 3))
+            with lock:
+                executed.append((user, idx))
+
+        executor = KeyedExecutor(pool)
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(notify)
+        dispatcher.set_notification_pool(executor, param_key("user"))
+        try:
+            for idx in range(20):
+                for user in ("a", "b"):
+                    request = json.dumps(
+                        {"jsonrpc": "2.0", "method": "notify",
+                         "params": {"user": user, "idx": idx}})
+                    self.assertFalse(dispatcher._marshaled_dispatch(request))
+
+            # Wait for the keys to be handled
+            for _ in range(50):
+                if not len(executor):
+                    break
+                time.sleep(.1)
+        finally:
+            pool.stop()
+
+        for user in ("a", "b"):
+            self.assertEqual([idx for key, idx in executed if key == user],
+                             list(range(20)))
+
+    def test_param_key_values(self):
+        """
+        Tests the values returned by param_key
+        """
+        self.assertEqual(param_key("a")("method", {"a": 1}), 1)
+        self.assertEqual(param_key(1)("method", [1, 2]), 2)
+        self.assertIsNone(param_key("a")("method", {}))
+        self.assertIsNone(param_key(2)("method", [1]))
+        self.assertIsNone(param_key("a")("method", {"a": [1]}))
+        self.assertIsNone(param_key("a")("method", None))
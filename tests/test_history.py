@@ -7,9 +7,14 @@ Tests the History class
 """
 
 # JSON-RPC library
-from jsonrpclib.history import History
+from jsonrpclib.history import History, RingHistory, DiskHistory, read_log
 
 # Standard library
+import os
+import shutil
+import tempfile
+import threading
+
 try:
     import unittest2 as unittest
 except ImportError:
@@ -81,3 +86,158 @@ class HistoryTests(unittest.TestCase):
         self.assertIs(history.responses, original_responses)
         self.assertIsNone(history.request)
         self.assertIsNone(history.response)
+
+
+class RingHistoryTests(unittest.TestCase):
+    """
+    Tests the methods of the RingHistory class
+    """
+    def test_capacity(self):
+        """
+        Only the latest exchanges are kept
+        """
+        self.assertRaises(ValueError, RingHistory, 0)
+
+        history = RingHistory(3)
+        self.assertEqual(history.capacity, 3)
+        self.assertIsNone(history.request)
+        self.assertIsNone(history.response)
+
+        for idx in range(5):
+            history.add_request("request-{0}".format(idx))
+            history.add_response("response-{0}".format(idx))
+
+        self.assertListEqual(history.requests,
+                             ["request-2", "request-3", "request-4"])
+        self.assertListEqual(history.responses,
+                             ["response-2", "response-3", "response-4"])
+        self.assertEqual(history.request, "request-4")
+        self.assertEqual(history.response, "response-4")
+        self.assertEqual(history.seen, 5)
+        self.assertEqual(history.recorded, 5)
+
+        history.clear()
+        self.assertListEqual(history.requests, [])
+        self.assertIsNone(history.request)
+
+    def test_sizes_only(self):
+        """
+        Tests the storage of sizes and timings only
+        """
+        history = RingHistory(keep_bodies=False)
+        history.add_request("abc")
+        self.assertIsNone(history.entries[0].duration)
+        history.add_response("abcdef")
+
+        entry = history.entries[0]
+        self.assertIsNone(entry.request)
+        self.assertIsNone(entry.response)
+        self.assertEqual(entry.request_size, 3)
+        self.assertEqual(entry.response_size, 6)
+        self.assertGreaterEqual(entry.duration, 0)
+
+    def test_sampling(self):
+        """
+        Tests the sampling of exchanges
+        """
+        history = RingHistory(sample_rate=0)
+        for _ in range(10):
+            history.add_request("request")
+            history.add_response("response")
+
+        self.assertEqual(len(history.entries), 0)
+        self.assertEqual(history.seen, 10)
+        self.assertEqual(history.recorded, 0)
+
+        history = RingHistory(sample_rate=.5)
+        for _ in range(1000):
+            history.add_request("request")
+            history.add_response("response")
+
+        self.assertTrue(300 < history.recorded < 700)
+        for entry in history.entries:
+            self.assertEqual(entry.response, "response")
+
+    def test_threads(self):
+        """
+        Responses complete the request of their thread
+        """
+        history = RingHistory()
+        history.add_request("main")
+
+        thread = threading.Thread(
+            target=lambda: (history.add_request("thread"),
+                            history.add_response("thread")))
+        thread.start()
+        thread.join()
+
+        history.add_response("main")
+        self.assertListEqual(history.requests, ["main", "thread"])
+        self.assertListEqual(history.responses, ["main", "thread"])
+
+
+class DiskHistoryTests(unittest.TestCase):
+    """
+    Tests the DiskHistory log files
+    """
+    def setUp(self):
+        """
+        Prepares a temporary directory
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "traffic.log")
+
+    def tearDown(self):
+        """
+        Cleans up the temporary directory
+        """
+        shutil.rmtree(self.directory)
+
+    def _write(self, compress, count=3):
+        """
+        Writes some exchanges
+        """
+        with DiskHistory(self.path, compress) as history:
+            for idx in range(count):
+                history.add_request(u"request-{0}-\u00e9".format(idx))
+                history.add_response("response-{0}".format(idx))
+
+    def test_read_write(self):
+        """
+        Tests the reading of written exchanges
+        """
+        for compress in (False, True):
+            self._write(compress)
+
+            # Appending keeps the previous records
+            self._write(compress)
+
+            records = list(read_log(self.path))
+            self.assertEqual(len(records), 6)
+            for idx, record in enumerate(records):
+                self.assertEqual(record.request,
+                                 u"request-{0}-\u00e9".format(idx % 3))
+                self.assertEqual(record.response,
+                                 "response-{0}".format(idx % 3))
+                self.assertGreaterEqual(record.duration, 0)
+                self.assertGreater(record.time, 0)
+
+            os.remove(self.path)
+
+    def test_invalid(self):
+        """
+        Tests the checks of the log file format
+        """
+        self._write(False)
+        self.assertRaises(ValueError, DiskHistory, self.path, True)
+
+        with open(self.path, "ab") as log_file:
+            # Truncated record
+            log_file.write(b"\x40\x00\x00\x00abc")
+        self.assertEqual(len(list(read_log(self.path))), 3)
+
+        with open(self.path, "wb") as log_file:
+            log_file.write(b"not a log file")
+        # The header is checked before iterating
+        self.assertRaises(ValueError, read_log, self.path)
+        self.assertRaises(ValueError, DiskHistory, self.path)
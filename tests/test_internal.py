@@ -12,6 +12,8 @@ from tests.utilities import UtilityServer
 
 # JSON-RPC library
 import jsonrpclib
+import jsonrpclib.balancer
+import jsonrpclib.threadpool
 
 # Standard library
 import json
@@ -118,3 +120,43 @@ class InternalTests(unittest.TestCase):
                 def func():
                     return result[i]
                 self.assertRaises(raises[i], func)
+
+    def test_multicall_chunks(self):
+        multicall = jsonrpclib.MultiCall(self.get_client(), chunk_size=3)
+        for i in range(10):
+            multicall.add(i, 1)
+        multicall._notify.add(1, 1)
+        result = multicall()
+        self.assertEqual(len(result), 10)
+        self.assertEqual([result[i] for i in range(10)], list(range(1, 11)))
+
+        # Byte budget: a bigger call is sent alone
+        multicall = jsonrpclib.MultiCall(self.get_client(), max_bytes=200)
+        multicall.sum(*range(100))
+        multicall.add(1, 2)
+        multicall.add(3, 4)
+        result = multicall()
+        self.assertEqual([result[i] for i in range(3)], [4950, 3, 7])
+
+    def test_multicall_parallel(self):
+        pool = jsonrpclib.threadpool.ThreadPool(4, 0)
+        pool.start()
+        try:
+            client = jsonrpclib.balancer.BalancedServerProxy(
+                ['http://localhost:{0}'.format(self.port)])
+            multicall = jsonrpclib.MultiCall(client, chunk_size=7, pool=pool)
+            for i in range(100):
+                multicall.add(i, i)
+            result = multicall()
+            self.assertEqual([result[i] for i in range(100)],
+                             list(range(0, 200, 2)))
+
+            # Errors are raised in call order
+            multicall.add(x=1, y=2, z=3)
+            multicall.ping()
+            result = multicall()
+            self.assertRaises(jsonrpclib.ProtocolError, lambda: result[0])
+            self.assertTrue(result[1])
+            client('close')()
+        finally:
+            pool.stop()
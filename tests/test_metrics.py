@@ -0,0 +1,228 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the metrics registry
+
+:license: Apache License 2.0
+"""
+
+# JSON-RPC library
+from jsonrpclib import ServerProxy, ProtocolError
+from jsonrpclib.cache import LRUCache, ResponseCache
+from jsonrpclib.SimpleJSONRPCServer import PooledJSONRPCServer, \
+    SimpleJSONRPCDispatcher
+from jsonrpclib.threadpool import ThreadPool
+import jsonrpclib.metrics as metrics
+
+# Standard library
+import json
+import threading
+
+try:
+    # Python 3
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    # Python 2
+    from urllib2 import urlopen, HTTPError
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class RegistryTests(unittest.TestCase):
+    """
+    Tests the metrics and their rendering
+    """
+    def test_counter_gauge(self):
+        """
+        Tests counters and gauges
+        """
+        registry = metrics.Registry()
+        counter = registry.counter("calls_total", "Calls", ("method",))
+        self.assertIs(registry.counter("calls_total", "Calls", ("method",)),
+                      counter)
+        self.assertRaises(ValueError, registry.gauge, "calls_total", "")
+
+        counter.inc(("add",))
+        counter.inc(("add",), 2)
+        counter.inc(('a "b"\n',))
+        self.assertEqual(counter.get(("add",)), 3)
+        self.assertRaises(ValueError, counter.inc)
+
+        gauge = registry.gauge("in_flight", "In flight")
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(gauge.get(), 1)
+        gauge.set(.5)
+
+        self.assertEqual(registry.render_prometheus(), """\
+# HELP calls_total Calls
+# TYPE calls_total counter
+calls_total{method="a \\"b\\"\\n"} 1
+calls_total{method="add"} 3
+# HELP in_flight In flight
+# TYPE in_flight gauge
+in_flight 0.5
+""")
+
+    def test_histogram(self):
+        """
+        Tests histograms
+        """
+        registry = metrics.Registry()
+        histogram = registry.histogram("duration", "Duration", ("method",),
+                                       (.1, 1))
+        for value in (.05, .1, .5, 2):
+            histogram.observe(value, ("add",))
+
+        self.assertEqual(histogram.get(("add",)), (4, 2.65))
+        self.assertEqual(histogram.get(("other",)), (0, 0))
+        self.assertEqual(registry.render_prometheus(), """\
+# HELP duration Duration
+# TYPE duration histogram
+duration_bucket{le="0.1",method="add"} 2
+duration_bucket{le="1",method="add"} 3
+duration_bucket{le="+Inf",method="add"} 4
+duration_count{method="add"} 4
+duration_sum{method="add"} 2.65
+""")
+
+    def test_thread_pool(self):
+        """
+        Tests the gauges of a thread pool
+        """
+        registry = metrics.Registry()
+        pool = ThreadPool(2)
+        event = threading.Event()
+        metrics.register_thread_pool(registry, pool, "test")
+        for _ in range(3):
+            pool.enqueue(event.wait, 5)
+
+        text = registry.render_prometheus()
+        self.assertIn('jsonrpc_pool_queue_depth{pool="test"} 3', text)
+        self.assertIn('jsonrpc_pool_threads{pool="test"} 0', text)
+
+        pool.start()
+        try:
+            self.assertIn('jsonrpc_pool_threads{pool="test"} 2',
+                          registry.render_prometheus())
+        finally:
+            event.set()
+            pool.stop()
+
+
+class ServerClientMetricsTests(unittest.TestCase):
+    """
+    Tests the metrics of a server and of a client
+    """
+    def test_server_client(self):
+        """
+        Tests the metrics of calls and the Prometheus endpoint
+        """
+        server = PooledJSONRPCServer(("localhost", 0), logRequests=False)
+        server.register_function(lambda a, b: a + b, "add")
+        server_registry = metrics.Registry()
+        server.set_metrics(server_registry)
+        metrics.register_thread_pool(server_registry, server.request_pool,
+                                     "requests")
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            url = "http://localhost:{0}".format(
+                server.socket.getsockname()[1])
+            client_registry = metrics.Registry()
+            client = ServerProxy(url, metrics=client_registry)
+            for idx in range(3):
+                self.assertEqual(client.add(idx, 1), idx + 1)
+            self.assertRaises(ProtocolError, client.add, 1)
+            self.assertRaises(ProtocolError, client.unknown)
+
+            server_metrics = server.get_metrics()
+            self.assertEqual(server_metrics.requests.get(("add",)), 4)
+            self.assertEqual(server_metrics.errors.get(("add", "-32602")), 1)
+            self.assertEqual(server_metrics.requests.get(
+                (metrics.UNKNOWN_METHOD,)), 1)
+            self.assertEqual(server_metrics.duration.get(("add",))[0], 4)
+            self.assertEqual(server_metrics.in_flight.get(), 0)
+            self.assertGreater(server_metrics.received.get(), 0)
+            self.assertGreater(server_metrics.sent.get(), 0)
+
+            text = client_registry.render_prometheus()
+            self.assertIn('jsonrpc_client_requests_total{method="add"} 4',
+                          text)
+            self.assertIn('jsonrpc_client_errors_total{code="-32602",'
+                          'method="add"} 1', text)
+
+            # Prometheus endpoint
+            response = urlopen(url + "/metrics")
+            self.assertTrue(response.headers["Content-Type"]
+                            .startswith("text/plain"))
+            text = response.read().decode("utf-8")
+            self.assertIn('jsonrpc_server_requests_total{method="add"} 4',
+                          text)
+            self.assertIn('jsonrpc_pool_threads{pool="requests"}', text)
+
+            try:
+                urlopen(url + "/other")
+            except HTTPError as ex:
+                self.assertEqual(ex.code, 404)
+            else:
+                self.fail("Invalid path accepted")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_cache_hits(self):
+        """
+        Cache hits are counted apart from the latencies of the method
+        """
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(lambda key: key, "lookup",
+                                     cache=LRUCache())
+        registry = metrics.Registry()
+        dispatcher.set_metrics(registry)
+
+        request = json.dumps({"jsonrpc": "2.0", "method": "lookup",
+                              "params": ["a"], "id": 1})
+        for _ in range(3):
+            dispatcher._marshaled_dispatch(request)
+
+        server_metrics = dispatcher.get_metrics()
+        self.assertEqual(server_metrics.requests.get(("lookup",)), 3)
+        self.assertEqual(server_metrics.cache_hits.get(("lookup",)), 2)
+        self.assertEqual(server_metrics.duration.get(("lookup",))[0], 1)
+
+    def test_client_cache_hits(self):
+        """
+        Calls answered from the response cache of a proxy are counted
+        """
+        server = PooledJSONRPCServer(("localhost", 0), logRequests=False)
+        server.register_function(lambda key: key, "lookup")
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            registry = metrics.Registry()
+            client = ServerProxy("http://localhost:{0}".format(
+                server.socket.getsockname()[1]), metrics=registry,
+                cache=ResponseCache({"lookup": 60}))
+            for _ in range(3):
+                self.assertEqual(client.lookup("a"), "a")
+
+            text = registry.render_prometheus()
+            self.assertIn('jsonrpc_client_requests_total{method="lookup"} 3',
+                          text)
+            self.assertIn(
+                'jsonrpc_client_cache_hits_total{method="lookup"} 2', text)
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the profiling hooks of the request pipeline
+
+:license: Apache License 2.0
+"""
+
+# JSON-RPC library
+from jsonrpclib import ServerProxy
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCDispatcher, \
+    SimpleJSONRPCServer
+import jsonrpclib.profiling as profiling
+
+# Standard library
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class ProfilerTests(unittest.TestCase):
+    """
+    Tests the profiler on a dispatcher
+    """
+    def setUp(self):
+        """
+        Prepares a dispatcher
+        """
+        self.dispatcher = SimpleJSONRPCDispatcher()
+        self.dispatcher.register_function(lambda a, b: a + b, "add")
+
+    def test_stages(self):
+        """
+        Tests the hooks and the aggregated stages
+        """
+        profiler = profiling.Profiler()
+        events = []
+        profiler.add_hook(
+            lambda trace, stage, timestamp: events.append(("pre", stage)),
+            lambda trace, stage, start, end: events.append(("post", stage)))
+        self.dispatcher.set_profiler(profiler)
+        self.assertIs(self.dispatcher.get_profiler(), profiler)
+
+        response = self.dispatcher._marshaled_dispatch(
+            '{"jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 1}')
+        self.assertIn('"result": 3', response)
+        self.assertEqual(events, [
+            ("pre", "dispatch"), ("pre", "loads"), ("post", "loads"),
+            ("pre", "validate"), ("post", "validate"),
+            ("pre", "call"), ("post", "call"),
+            ("pre", "dump"), ("post", "dump"), ("post", "dispatch")])
+        self.assertIsNone(profiling.current_trace())
+
+        # Batch
+        self.dispatcher._marshaled_dispatch(
+            '[{"jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 1},'
+            '{"jsonrpc": "2.0", "method": "add", "params": [3, 4], "id": 2}]')
+
+        stats = profiler.stats()
+        self.assertEqual(stats["dispatch"][0], 2)
+        self.assertEqual(stats["loads"][0], 2)
+        self.assertEqual(stats["call"][0], 3)
+        self.assertEqual(stats["dump"][0], 3)
+        for count, total, mean in stats.values():
+            self.assertGreaterEqual(total, 0)
+            self.assertAlmostEqual(mean, total / count)
+
+        profiler.reset()
+        self.assertEqual(profiler.stats(), {})
+
+        # Disabled profiler
+        self.dispatcher.set_profiler(None)
+        del events[:]
+        self.dispatcher._marshaled_dispatch(
+            '{"jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 1}')
+        self.assertEqual(events, [])
+
+    def test_sampling(self):
+        """
+        Tests the sampling of the traced and profiled requests
+        """
+        profiler = profiling.Profiler(sample_rate=0)
+        self.dispatcher.set_profiler(profiler)
+        self.dispatcher._marshaled_dispatch(
+            '{"jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 1}')
+        self.assertEqual(profiler.stats(), {})
+        self.assertIsNone(profiler.profile_stats())
+
+        profiler = profiling.Profiler(cprofile_rate=1)
+        self.dispatcher.set_profiler(profiler)
+        self.dispatcher._marshaled_dispatch(
+            '{"jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 1}')
+        self.assertEqual(profiler.stats()["dispatch"][0], 1)
+        self.assertIsNotNone(profiler.profile_stats())
+
+
+class ServerProfilingTests(unittest.TestCase):
+    """
+    Tests the profiling of the requests handled by a server
+    """
+    def test_server(self):
+        """
+        Tests the stages traced by the request handler
+        """
+        server = SimpleJSONRPCServer(("localhost", 0), logRequests=False)
+        server.register_function(lambda a, b: a + b, "add")
+        profiler = profiling.Profiler()
+        traces = []
+        profiler.add_hook(post=lambda trace, stage, start, end:
+                          stage == "request" and traces.append(trace))
+        server.set_profiler(profiler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            client = ServerProxy("http://localhost:{0}".format(
+                server.socket.getsockname()[1]))
+            self.assertEqual(client.add(1, 2), 3)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(traces), 1)
+        stages = [stage for stage, _, _ in traces[0].stages]
+        self.assertEqual(stages, ["read", "loads", "validate", "call", "dump",
+                                  "dispatch", "write", "request"])
+        durations = traces[0].durations()
+        self.assertGreaterEqual(durations["request"], durations["dispatch"])
+        self.assertEqual(profiler.stats()["request"][0], 1)
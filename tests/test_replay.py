@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the traffic replay tool
+
+:license: Apache License 2.0
+"""
+
+# JSON-RPC library
+from jsonrpclib import ServerProxy, ProtocolError
+from jsonrpclib.history import DiskHistory, LogRecord, read_log
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCDispatcher, \
+    SimpleJSONRPCServer
+import jsonrpclib.replay as replay
+import jsonrpclib.utils as utils
+
+# Standard library
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+def _request(method, *params):
+    """
+    Prepares a request string
+    """
+    return json.dumps({"jsonrpc": "2.0", "id": 1, "method": method,
+                       "params": params})
+
+
+class ReportTests(unittest.TestCase):
+    """
+    Tests the report utilities
+    """
+    def test_percentile(self):
+        """
+        Tests the nearest-rank percentiles
+        """
+        values = list(range(1, 101))
+        self.assertIsNone(utils.percentile([], 50))
+        self.assertEqual(utils.percentile(values, 50), 50)
+        self.assertEqual(utils.percentile(values, 99), 99)
+        self.assertEqual(utils.percentile(values, 100), 100)
+        self.assertEqual(utils.percentile(values, 0), 1)
+        self.assertEqual(utils.percentile([5], 99.9), 5)
+
+    def test_report(self):
+        """
+        Tests the content of a report
+        """
+        report = replay.latency_report([.3, .1, .2], 1, 2)
+        self.assertEqual(report['requests'], 4)
+        self.assertEqual(report['errors'], 1)
+        self.assertEqual(report['throughput'], 2)
+        self.assertEqual(report['latency']['min'], .1)
+        self.assertEqual(report['latency']['max'], .3)
+        self.assertEqual(report['latency']['p50'], .2)
+        self.assertIn("Requests:   4 (1 errors)",
+                      replay.format_report(report))
+
+
+class ReplayTests(unittest.TestCase):
+    """
+    Tests the replay of requests
+    """
+    def test_dispatcher(self):
+        """
+        Tests the replay pace against a dispatcher
+        """
+        calls = []
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(lambda: calls.append(1), "call")
+
+        records = [LogRecord(100 + idx * .1, 0, _request("call"), "")
+                   for idx in range(5)]
+
+        # Recorded pace: .4 second
+        start = time.time()
+        report = replay.replay(records, replay.dispatcher_sender(dispatcher))
+        self.assertGreaterEqual(time.time() - start, .35)
+        self.assertEqual(report['requests'], 5)
+        self.assertEqual(len(calls), 5)
+
+        # Twice as fast
+        start = time.time()
+        replay.replay(records, replay.dispatcher_sender(dispatcher), 2)
+        self.assertLess(time.time() - start, .35)
+
+        # As fast as possible
+        start = time.time()
+        replay.replay(records, replay.dispatcher_sender(dispatcher), 0)
+        self.assertLess(time.time() - start, .2)
+        self.assertEqual(len(calls), 15)
+
+    def test_record_replay(self):
+        """
+        Records the traffic of a proxy and replays it against a server
+        """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "traffic.log")
+        server = SimpleJSONRPCServer(("localhost", 0), logRequests=False)
+        server.register_function(lambda a, b: a + b, "add")
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            url = "http://localhost:{0}".format(
+                server.socket.getsockname()[1])
+
+            with DiskHistory(path, compress=True) as history:
+                proxy = ServerProxy(url, history=history)
+                for idx in range(5):
+                    self.assertEqual(proxy.add(idx, 1), idx + 1)
+                self.assertRaises(ProtocolError, proxy.add, 1)
+
+            self.assertEqual(len(list(read_log(path))), 6)
+
+            # The invalid call is counted as an error
+            report = replay.replay(read_log(path), replay.proxy_sender(url),
+                                   speed=0)
+            self.assertEqual(report['requests'], 6)
+            self.assertEqual(report['errors'], 1)
+            self.assertIsNotNone(report['latency']['p99'])
+
+            # Command line
+            self.assertEqual(replay.main([path, url, "--speed", "0"]), 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(directory)
@@ -0,0 +1,309 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the retry policy and the circuit breakers
+
+:license: Apache License 2.0
+"""
+
+# Tests utilities
+from tests.utilities import free_port, start_server
+
+# JSON-RPC library
+from jsonrpclib import ServerProxy, ProtocolError
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCRequestHandler
+import jsonrpclib.retry as retry
+
+# Standard library
+import errno
+import socket
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class UnavailableHandler(SimpleJSONRPCRequestHandler):
+    """
+    Request handler answering 503 to the first requests
+    """
+    unavailable = 0
+
+    def do_POST(self):
+        if UnavailableHandler.unavailable > 0:
+            UnavailableHandler.unavailable -= 1
+            self.rfile.read(int(self.headers["content-length"]))
+            self.send_error(503)
+            return
+
+        SimpleJSONRPCRequestHandler.do_POST(self)
+
+
+def start_unavailable_server(port=0):
+    """
+    Starts a server answering 503 to the first requests
+    """
+    return start_server({"get": lambda: "value", "set": lambda value: None},
+                        port, requestHandler=UnavailableHandler)
+
+
+class CountingPolicy(retry.RetryPolicy):
+    """
+    Retry policy counting the retries, without waiting
+    """
+    retries = 0
+
+    def delay(self, attempt):
+        self.retries += 1
+        return 0
+
+
+class RetryPolicyTests(unittest.TestCase):
+    """
+    Tests the retry policy
+    """
+    def test_delay(self):
+        """
+        Tests the jittered exponential backoff
+        """
+        policy = retry.RetryPolicy(backoff=.1, max_backoff=.3)
+        for attempt, bound in ((0, .1), (1, .2), (2, .3), (10, .3)):
+            delays = [policy.delay(attempt) for _ in range(50)]
+            self.assertTrue(all(0 <= delay <= bound for delay in delays))
+
+    def test_should_retry(self):
+        """
+        Tests the errors which are retried
+        """
+        policy = retry.RetryPolicy(idempotent_methods=["get"])
+        self.assertTrue(policy.is_idempotent("get"))
+        self.assertFalse(policy.is_idempotent("set"))
+
+        refused = socket.error(errno.ECONNREFUSED, "Connection refused")
+        reset = socket.error(errno.ECONNRESET, "Connection reset")
+        for idempotent in (True, False):
+            self.assertTrue(policy.should_retry(refused, None, idempotent))
+            self.assertEqual(policy.should_retry(reset, None, idempotent),
+                             idempotent)
+            self.assertEqual(policy.should_retry(None, 503, idempotent),
+                             idempotent)
+            self.assertFalse(policy.should_retry(None, 500, idempotent))
+            self.assertFalse(policy.should_retry(
+                retry.CircuitOpenError(), None, idempotent))
+            self.assertFalse(policy.should_retry(ValueError(), None,
+                                                 idempotent))
+            self.assertFalse(policy.should_retry(
+                IOError(errno.ENOENT, "No such file"), None, idempotent))
+            self.assertEqual(policy.should_retry(
+                socket.timeout("timed out"), None, idempotent), idempotent)
+
+    def test_connection_errors(self):
+        """
+        Tests the detection of connection errors
+        """
+        for ex in (socket.error(errno.ECONNRESET, "Connection reset"),
+                   socket.error(errno.EPIPE, "Broken pipe"),
+                   socket.timeout("timed out"),
+                   socket.gaierror(-2, "Name or service not known")):
+            self.assertTrue(retry.is_connection_error(ex), ex)
+
+        for ex in (IOError(errno.ENOENT, "No such file"),
+                   OSError(errno.EACCES, "Permission denied"),
+                   IOError("No errno"), ValueError()):
+            self.assertFalse(retry.is_connection_error(ex), ex)
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    """
+    Tests the circuit breaker states
+    """
+    def test_states(self):
+        """
+        Tests the transitions between the states
+        """
+        breaker = retry.CircuitBreaker(failure_threshold=2, reset_timeout=.1)
+        self.assertEqual(breaker.state, retry.CLOSED)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, retry.OPEN)
+        self.assertFalse(breaker.allow())
+
+        # Half-open: a single trial request
+        time.sleep(.15)
+        self.assertEqual(breaker.state, retry.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        # The trial failed
+        breaker.record_failure()
+        self.assertEqual(breaker.state, retry.OPEN)
+        self.assertFalse(breaker.allow())
+
+        # The trial succeeded
+        time.sleep(.15)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, retry.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_release(self):
+        """
+        Tests the trials ending without result
+        """
+        breaker = retry.CircuitBreaker(failure_threshold=1, reset_timeout=.1)
+        breaker.record_failure()
+        time.sleep(.15)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        # Slot given back
+        breaker.release()
+        self.assertEqual(breaker.state, retry.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+        # Slot never given back: expires after the reset timeout
+        self.assertFalse(breaker.allow())
+        time.sleep(.15)
+        self.assertTrue(breaker.allow())
+
+    def test_registry(self):
+        """
+        Tests the circuit breakers per endpoint
+        """
+        breakers = retry.CircuitBreakers(failure_threshold=3)
+        self.assertIs(breakers.get("a:80"), breakers.get("a:80"))
+        self.assertIsNot(breakers.get("a:80"), breakers.get("b:80"))
+        self.assertEqual(breakers.get("a:80").failure_threshold, 3)
+
+
+class TransportTests(unittest.TestCase):
+    """
+    Tests the retries and circuit breakers of the transport
+    """
+    def tearDown(self):
+        """
+        Resets the request handler
+        """
+        UnavailableHandler.unavailable = 0
+
+    def test_connection_refused(self):
+        """
+        Tests the retries of refused connections
+        """
+        policy = CountingPolicy(max_retries=3)
+        proxy = ServerProxy("http://localhost:{0}".format(free_port()),
+                            retry_policy=policy)
+        self.assertRaises(IOError, proxy.set, 1)
+        self.assertEqual(policy.retries, 3)
+
+    def test_idempotent(self):
+        """
+        Tests the retries of the idempotent methods
+        """
+        server = start_unavailable_server()
+        try:
+            policy = CountingPolicy(max_retries=2, idempotent_methods=["get"])
+            proxy = ServerProxy("http://localhost:{0}".format(
+                server.socket.getsockname()[1]), retry_policy=policy)
+
+            UnavailableHandler.unavailable = 2
+            self.assertEqual(proxy.get(), "value")
+            self.assertEqual(policy.retries, 2)
+
+            # Not enough retries
+            UnavailableHandler.unavailable = 3
+            self.assertRaises(ProtocolError, proxy.get)
+            self.assertEqual(policy.retries, 4)
+
+            # Non-idempotent method
+            UnavailableHandler.unavailable = 1
+            self.assertRaises(ProtocolError, proxy.set, 1)
+            self.assertEqual(policy.retries, 4)
+            self.assertIsNone(proxy.set(1))
+            proxy("close")()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_circuit_breaker(self):
+        """
+        Tests failing fast when the circuit is open
+        """
+        port = free_port()
+        breakers = retry.CircuitBreakers(failure_threshold=2,
+                                         reset_timeout=.2)
+        proxy = ServerProxy("http://localhost:{0}".format(port),
+                            circuit_breakers=breakers)
+        for _ in range(2):
+            try:
+                proxy.get()
+            except retry.CircuitOpenError:
+                self.fail("Circuit opened too early")
+            except IOError:
+                pass
+
+        self.assertRaises(retry.CircuitOpenError, proxy.get)
+        breaker = breakers.get("localhost:{0}".format(port))
+        self.assertEqual(breaker.state, retry.OPEN)
+
+        server = start_unavailable_server(port)
+        try:
+            # Still open
+            self.assertRaises(retry.CircuitOpenError, proxy.get)
+
+            # Half-open then closed
+            time.sleep(.3)
+            self.assertEqual(proxy.get(), "value")
+            self.assertEqual(breaker.state, retry.CLOSED)
+
+            # Server errors count as failures
+            UnavailableHandler.unavailable = 2
+            for _ in range(2):
+                self.assertRaises(ProtocolError, proxy.get)
+            self.assertRaises(retry.CircuitOpenError, proxy.get)
+            proxy("close")()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_aborted_trial(self):
+        """
+        Tests the abortion of a trial request of a half-open circuit
+        """
+        port = free_port()
+        breakers = retry.CircuitBreakers(failure_threshold=1,
+                                         reset_timeout=.2)
+        proxy = ServerProxy("http://localhost:{0}".format(port),
+                            circuit_breakers=breakers)
+        self.assertRaises(IOError, proxy.get)
+        breaker = breakers.get("localhost:{0}".format(port))
+        self.assertEqual(breaker.state, retry.OPEN)
+
+        server = start_server({"get": lambda: "value",
+                               "slow": lambda: time.sleep(.5)}, port)
+        try:
+            time.sleep(.3)
+            transport = proxy("transport")
+            timer = threading.Timer(.1, transport.abort)
+            timer.start()
+            self.assertRaises(IOError, proxy.slow)
+            timer.join()
+            transport.aborted = False
+            self.assertEqual(breaker.state, retry.HALF_OPEN)
+
+            # The slot of the aborted trial has been given back
+            self.assertEqual(proxy.get(), "value")
+            self.assertEqual(breaker.state, retry.CLOSED)
+            proxy("close")()
+        finally:
+            server.shutdown()
+            server.server_close()
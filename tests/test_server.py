@@ -7,13 +7,16 @@ Tests the pooled server
 """
 
 # JSON-RPC library
-from jsonrpclib import ServerProxy
-from jsonrpclib.SimpleJSONRPCServer import PooledJSONRPCServer
-from jsonrpclib.threadpool import ThreadPool
+from jsonrpclib import ServerProxy, ProtocolError
+from jsonrpclib.SimpleJSONRPCServer import PooledJSONRPCServer, \
+    get_remaining_time
+from jsonrpclib.threadpool import PriorityThreadPool, ThreadPool
 
 # Standard library
 import random
+import socket
 import threading
+import time
 import unittest
 
 # ------------------------------------------------------------------------------
@@ -64,3 +67,308 @@ class PooledServerTests(unittest.TestCase):
         pool = ThreadPool(2)
         pool.start()
         self.test_default_pool(pool)
+
+
+class PooledServerTestCase(unittest.TestCase):
+    """
+    Utility methods to test a pooled server with a single thread
+    """
+    def setUp(self):
+        """
+        Sets up members
+        """
+        self.server = None
+        self.thread = None
+        self.event = threading.Event()
+
+    def tearDown(self):
+        """
+        Stops the server
+        """
+        self.event.set()
+        if self.server is not None:
+            self.server.server_close()
+            self.thread.join()
+
+    def _start(self, **kwargs):
+        """
+        Starts a server with a single thread
+
+        :return: The URL of the server
+        """
+        pool = ThreadPool(1)
+        pool.start()
+        self.server = PooledJSONRPCServer(("localhost", 0), logRequests=False,
+                                          thread_pool=pool, **kwargs)
+        self.server.register_function(self.event.wait, "wait")
+        self.server.register_function(add)
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return "http://localhost:{0}".format(
+            self.server.socket.getsockname()[1])
+
+    def _call_in_thread(self, url, results):
+        """
+        Calls the "wait" method in a new thread
+        """
+        def call():
+            try:
+                results.append(ServerProxy(url).wait(5))
+            except ProtocolError as ex:
+                results.append(ex)
+
+        thread = threading.Thread(target=call)
+        thread.daemon = True
+        thread.start()
+        time.sleep(.2)
+        return thread
+
+
+class AdmissionControlTests(PooledServerTestCase):
+    """
+    Tests the rejection of requests by an overloaded pooled server
+    """
+    def test_max_pending(self):
+        """
+        Requests above the pending limit are rejected with an HTTP 503
+        """
+        url = self._start(max_pending=1)
+        results = []
+
+        # The first call takes the thread, the second waits in the queue
+        threads = [self._call_in_thread(url, results) for _ in range(2)]
+
+        # The third one is rejected
+        try:
+            ServerProxy(url).add(1, 2)
+        except ProtocolError as ex:
+            self.assertEqual(ex.args[1], 503)
+        else:
+            self.fail("Request not rejected")
+
+        # Release the waiting calls
+        self.event.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True, True])
+
+        # Calls are accepted again
+        self.assertEqual(ServerProxy(url).add(1, 2), 3)
+
+    def test_queue_timeout(self):
+        """
+        Requests waiting too long in the queue are rejected
+        """
+        url = self._start(queue_timeout=.1)
+        results = []
+
+        # The first call takes the thread, the second waits in the queue
+        threads = [self._call_in_thread(url, results) for _ in range(2)]
+        time.sleep(.2)
+        self.event.set()
+        for thread in threads:
+            thread.join()
+
+        # Clients threads may store their results in any order
+        self.assertEqual(len(results), 2)
+        self.assertIn(True, results)
+        errors = [result for result in results
+                  if isinstance(result, ProtocolError)]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].args[1], 503)
+
+    def test_slow_rejected_client(self):
+        """
+        Rejected connections of slow clients are closed after a while
+        """
+        self._start(max_pending=0)
+
+        sock = socket.create_connection(self.server.socket.getsockname())
+        try:
+            # Send a byte at a time, never finishing the request, until the
+            # server closes the connection
+            sock.settimeout(.1)
+            response = b''
+            start = time.time()
+            while time.time() - start < 5:
+                try:
+                    sock.send(b'x')
+                    response += sock.recv(4096)
+                except socket.timeout:
+                    continue
+                except socket.error:
+                    # Connection reset
+                    break
+                time.sleep(.1)
+
+            self.assertLess(time.time() - start, 3)
+            self.assertIn(b' 503 ', response)
+        finally:
+            sock.close()
+
+
+class DeadlineTests(PooledServerTestCase):
+    """
+    Tests the propagation of the time budget of requests
+    """
+    def test_remaining_time(self):
+        """
+        Methods have access to the remaining time budget
+        """
+        url = self._start()
+        self.server.register_function(get_remaining_time)
+
+        # No budget
+        self.assertIsNone(ServerProxy(url).get_remaining_time())
+
+        # Budget given by the proxy
+        client = ServerProxy(url, call_timeout=5)
+        remaining = client.get_remaining_time()
+        self.assertGreater(remaining, 4)
+        self.assertLessEqual(remaining, 5)
+
+        # Budget given for a call
+        with ServerProxy(url)._call_timeout(2) as client:
+            remaining = client.get_remaining_time()
+            self.assertGreater(remaining, 1)
+            self.assertLessEqual(remaining, 2)
+
+    def test_expired(self):
+        """
+        Queued requests are dropped once their deadline has passed
+        """
+        url = self._start()
+        calls = []
+        self.server.register_function(lambda: calls.append(None), "call")
+
+        # Keep the single thread busy
+        results = []
+        thread = self._call_in_thread(url, results)
+
+        # This call is queued until after its deadline
+        def release():
+            time.sleep(.3)
+            self.event.set()
+
+        threading.Thread(target=release).start()
+        try:
+            ServerProxy(url, call_timeout=.1).call()
+        except ProtocolError as ex:
+            self.assertEqual(ex.args[1], 503)
+        else:
+            self.fail("Request not dropped")
+
+        thread.join()
+        self.assertEqual(calls, [])
+
+        # With a longer budget
+        ServerProxy(url, call_timeout=10).call()
+        self.assertEqual(calls, [None])
+
+
+class PriorityTests(PooledServerTestCase):
+    """
+    Tests the priority of requests in a pooled server
+    """
+    def _priority(self, data):
+        """
+        Computes the priority of a request sending the given data
+        """
+        server, client = socket.socketpair()
+        try:
+            if data:
+                client.sendall(data)
+                time.sleep(.1)
+            return self.server.get_request_priority(server, None)
+        finally:
+            server.close()
+            client.close()
+
+    def test_request_priority(self):
+        """
+        Tests the priority given by headers and methods
+        """
+        self._start()
+        self.server.set_method_priority("add", -5)
+        self.server.set_method_priority("wait", 5)
+
+        self.assertIsNone(self._priority(None))
+        self.assertIsNone(self._priority(b'{"method": "other"}'))
+        self.assertEqual(
+            self._priority(b'POST / HTTP/1.1\r\nX-JSONRPC-Priority: 3\r\n'
+                           b'\r\n{"method": "add"}'), 3)
+        self.assertEqual(self._priority(b'{"method": "wait"}'), 5)
+        self.assertEqual(
+            self._priority(b'[{"method": "wait"}, {"method": "add"}]'), -5)
+
+        self.server.set_method_priority("add", None)
+        self.assertIsNone(self._priority(b'{"method": "add"}'))
+
+    def test_priority_pool(self):
+        """
+        Tests a server based on a priority thread pool
+        """
+        pool = PriorityThreadPool(2)
+        pool.start()
+        self.server = PooledJSONRPCServer(("localhost", 0), logRequests=False,
+                                          thread_pool=pool)
+        self.server.register_function(add)
+        self.server.set_method_priority("add", -1)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        client = ServerProxy("http://localhost:{0}".format(
+            self.server.socket.getsockname()[1]))
+        self.assertEqual(client.add(1, 2), 3)
+
+    def test_priority_header(self):
+        """
+        Tests the priority header of requests sent over real sockets, while
+        the server is loaded
+        """
+        calls = []
+        pool = PriorityThreadPool(1)
+        pool.start()
+        self.server = PooledJSONRPCServer(("localhost", 0), logRequests=False,
+                                          thread_pool=pool)
+        self.server.register_function(calls.append, "call")
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        port = self.server.socket.getsockname()[1]
+
+        # Keep the only thread busy
+        pool.enqueue(self.event.wait, 5)
+
+        # Send the requests before the server accepts them
+        clients = []
+        try:
+            for name, priority in (("low", 5), ("high", -5)):
+                body = '{{"jsonrpc": "2.0", "method": "call", ' \
+                    '"params": ["{0}"], "id": 1}}'.format(name)
+                client = socket.create_connection(("localhost", port))
+                clients.append(client)
+                client.sendall(
+                    "POST / HTTP/1.1\r\nHost: localhost\r\n"
+                    "Content-Type: application/json\r\n"
+                    "Content-Length: {0}\r\nX-JSONRPC-Priority: {1}\r\n"
+                    "Connection: close\r\n\r\n{2}"
+                    .format(len(body), priority, body).encode())
+
+            self.thread.start()
+
+            # Let the server queue both requests
+            time.sleep(.5)
+            self.event.set()
+
+            for client in clients:
+                client.settimeout(5)
+                while client.recv(4096):
+                    pass
+        finally:
+            for client in clients:
+                client.close()
+
+        self.assertEqual(calls, ["high", "low"])
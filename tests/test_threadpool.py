@@ -15,6 +15,24 @@ import jsonrpclib.threadpool as threadpool
 import threading
 import time
 
+try:
+    # Python 3, or Python 2 with the "futures" back-port
+    import concurrent.futures as futures
+except ImportError:
+    futures = None
+
+try:
+    # Python 3
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
 # Tests
 try:
     import unittest2 as unittest
@@ -276,6 +294,30 @@ class ThreadPoolTest(unittest.TestCase):
             pool = threadpool.ThreadPool(10, queue_size=queue_size)
             self.assertLessEqual(pool._queue.maxsize, 0)
 
+    def testTryEnqueue(self):
+        """
+        Tests the non-blocking enqueue methods
+        """
+        for pool in (threadpool.ThreadPool(1, queue_size=1, timeout=5),
+                     threadpool.PriorityThreadPool(1, queue_size=1,
+                                                   timeout=5)):
+            result = []
+            pool.try_enqueue(_trace_call, result, 1)
+
+            # Full queue: fails without waiting for the queue timeout
+            start = time.time()
+            self.assertRaises(queue.Full, pool.try_enqueue,
+                              _trace_call, result, 2)
+            if hasattr(pool, 'try_enqueue_priority'):
+                self.assertRaises(queue.Full, pool.try_enqueue_priority,
+                                  0, _trace_call, result, 3)
+            self.assertLess(time.time() - start, 1)
+
+            pool.start()
+            self.assertTrue(pool.join(1))
+            self.assertEqual(result, [1])
+            pool.stop()
+
     def testDoubleStartStop(self):
         """
         Check double call to start() and stop()
@@ -448,6 +490,85 @@ class ThreadPoolTest(unittest.TestCase):
         # Really join
         self.pool.join()
 
+    def testEnqueueMany(self):
+        """
+        Tests the queuing of multiple tasks at once
+        """
+        self.pool = threadpool.ThreadPool(3)
+        for chunksize in (1, 2, 10):
+            result = []
+            all_futures = self.pool.enqueue_many(
+                _trace_call, [(result, idx) for idx in range(5)], chunksize)
+            self.assertEqual(len(all_futures), 5)
+
+            self.pool.start()
+            self.assertTrue(self.pool.join(2))
+            self.assertEqual(sorted(result), list(range(5)))
+            for future in all_futures:
+                self.assertTrue(future.done())
+            self.pool.stop()
+
+        self.assertRaises(ValueError, self.pool.enqueue_many, None, [])
+        self.assertRaises(ValueError, self.pool.enqueue_many, _trace_call,
+                          [], 0)
+
+    def testEnqueueManyException(self):
+        """
+        Tests an exception in a chunk of tasks
+        """
+        self.pool = threadpool.ThreadPool(1)
+        self.pool.start()
+        all_futures = self.pool.enqueue_many(
+            lambda value: 1 // value, [(1,), (0,), (1,)], 3)
+        self.assertEqual(all_futures[0].result(1), 1)
+        self.assertRaises(ZeroDivisionError, all_futures[1].result, 1)
+        self.assertEqual(all_futures[2].result(1), 1)
+
+    def testEnqueueManyFull(self):
+        """
+        Tests the futures given when the queue gets full
+        """
+        for chunksize in (1, 2):
+            self.pool = threadpool.ThreadPool(1, queue_size=2, timeout=.1)
+            result = []
+            try:
+                self.pool.enqueue_many(
+                    _trace_call, [(result, idx) for idx in range(5)],
+                    chunksize)
+            except queue.Full as ex:
+                all_futures = ex.futures
+            else:
+                self.fail("The queue should be full")
+
+            self.assertEqual(len(all_futures), 2 * chunksize)
+            self.pool.start()
+            for future in all_futures:
+                self.assertIsNone(future.result(1))
+            self.assertEqual(result, list(range(2 * chunksize)))
+            self.pool.stop()
+
+    def testMap(self):
+        """
+        Tests map() with chunks
+        """
+        self.pool = threadpool.ThreadPool(3)
+        self.pool.start()
+        for chunksize in (1, 3, 20):
+            self.assertEqual(
+                list(self.pool.map(pow, range(10), [2] * 10,
+                                   chunksize=chunksize)),
+                [value ** 2 for value in range(10)])
+
+        results = self.pool.map(lambda value: 1 // value, [1, 0], chunksize=2)
+        self.assertRaises(ZeroDivisionError, list, results)
+
+        results = self.pool.map(_slow_call, [1], timeout=.1)
+        self.assertRaises(OSError, list, results)
+
+        self.assertRaises(TypeError, self.pool.map, pow, [], [], foo=1)
+        self.assertRaises(ValueError, self.pool.map, pow, [], [],
+                          chunksize=0)
+
     def testMaxThread(self):
         """
         Checks if the maximum number of threads is respected
@@ -467,5 +588,395 @@ class ThreadPoolTest(unittest.TestCase):
 
 # ------------------------------------------------------------------------------
 
+
+@unittest.skipIf(futures is None, "concurrent.futures not available")
+class ExecutorTest(unittest.TestCase):
+    """
+    Tests the concurrent.futures API of the thread pool
+    """
+    def setUp(self):
+        """
+        Sets up the test
+        """
+        self.pool = threadpool.ThreadPool(2)
+
+    def tearDown(self):
+        """
+        Cleans up the test
+        """
+        self.pool.stop()
+
+    def testSubmit(self):
+        """
+        Tests submit() and the standard futures utilities
+        """
+        self.assertIsInstance(self.pool, futures.Executor)
+        self.pool.start()
+
+        all_futures = [self.pool.submit(_slow_call, .1, idx)
+                       for idx in range(4)]
+        for future in all_futures:
+            self.assertIsInstance(future, futures.Future)
+
+        results = [future.result()
+                   for future in futures.as_completed(all_futures, 2)]
+        self.assertEqual(sorted(results), list(range(4)))
+
+        done, not_done = futures.wait(all_futures, 1)
+        self.assertEqual(len(done), 4)
+        self.assertEqual(len(not_done), 0)
+
+    def testMap(self):
+        """
+        Tests map()
+        """
+        self.pool.start()
+        self.assertEqual(list(self.pool.map(_slow_call, [.1] * 3, range(3))),
+                         [0, 1, 2])
+
+    def testTimeout(self):
+        """
+        Tests the type of timeout exceptions
+        """
+        self.pool.start()
+        future = self.pool.submit(_slow_call, .5)
+        self.assertRaises(futures.TimeoutError, future.result, .1)
+        self.assertRaises(OSError, future.result, .1)
+
+    def testCallbacks(self):
+        """
+        Tests multiple done callbacks
+        """
+        called = []
+        future = self.pool.submit(_slow_call, 0, 42)
+        future.add_done_callback(lambda fut: called.append(1))
+        future.add_done_callback(lambda fut: called.append(fut.result()))
+
+        self.pool.start()
+        self.assertEqual(future.result(1), 42)
+        self.assertEqual(called, [1, 42])
+
+    def testCancel(self):
+        """
+        Tests the cancellation of queued tasks
+        """
+        result = []
+        future = self.pool.submit(_trace_call, result, 1)
+        self.assertTrue(future.cancel())
+        self.assertTrue(future.cancelled())
+        self.assertRaises(futures.CancelledError, future.result)
+
+        self.pool.start()
+        self.assertTrue(self.pool.join(1))
+        self.assertEqual(result, [])
+
+    def testShutdown(self):
+        """
+        Tests the context manager and shutdown()
+        """
+        with threadpool.ThreadPool(1) as pool:
+            all_futures = [pool.submit(_slow_call, .1, idx)
+                           for idx in range(3)]
+
+        # Queued tasks have been executed
+        self.assertEqual([future.result(0) for future in all_futures],
+                         [0, 1, 2])
+
+        # Tasks not started are cancelled
+        pool.start()
+        running = pool.submit(_slow_call, .2, 1)
+        queued = pool.submit(_slow_call, .2, 2)
+        time.sleep(.1)
+        pool.shutdown(cancel_futures=True)
+        self.assertEqual(running.result(0), 1)
+        self.assertTrue(queued.cancelled())
+
+        # New tasks are refused until the pool is restarted
+        self.assertRaises(RuntimeError, pool.submit, _slow_call, 0, 3)
+        self.assertRaises(RuntimeError, pool.enqueue, _slow_call, 0, 3)
+        pool.start()
+        self.assertEqual(pool.submit(_slow_call, 0, 4).result(1), 4)
+        pool.shutdown()
+
+    def testShutdownNotStarted(self):
+        """
+        Tests the shutdown of a pool which hasn't been started
+        """
+        pool = threadpool.ThreadPool(1)
+        future = pool.submit(_slow_call, 0, 1)
+
+        # Returns immediately, cancelling the queued tasks
+        start = time.time()
+        pool.shutdown(wait=True)
+        self.assertLess(time.time() - start, 1)
+        self.assertTrue(future.cancelled())
+        self.assertRaises(RuntimeError, pool.submit, _slow_call, 0, 2)
+
+    def testClearChunk(self):
+        """
+        Tests the cancellation of the tasks of chunks removed from the queue
+        """
+        all_futures = self.pool.enqueue_many(_slow_call,
+                                             [(0,), (0,), (0,)], 2)
+        self.pool.clear()
+        for future in all_futures:
+            self.assertTrue(future.cancelled())
+
+    @unittest.skipIf(asyncio is None, "asyncio not available")
+    def testAsyncio(self):
+        """
+        Tests the use of futures with asyncio
+        """
+        self.pool.start()
+        loop = asyncio.new_event_loop()
+        try:
+            wrapped = [
+                asyncio.wrap_future(self.pool.submit(_slow_call, .1, idx),
+                                    loop=loop)
+                for idx in range(3)]
+            self.assertEqual(loop.run_until_complete(asyncio.gather(*wrapped)),
+                             [0, 1, 2])
+        finally:
+            loop.close()
+
+# ------------------------------------------------------------------------------
+
+
+class PriorityThreadPoolTest(unittest.TestCase):
+    """
+    Tests the priority thread pool
+    """
+    def setUp(self):
+        """
+        Sets up the test
+        """
+        self.pool = None
+
+    def tearDown(self):
+        """
+        Cleans up the test
+        """
+        if self.pool is not None:
+            self.pool.stop()
+
+    def testOrder(self):
+        """
+        Tests the execution order: by priority, then FIFO
+        """
+        self.pool = threadpool.PriorityThreadPool(1, starvation_timeout=None)
+        result = []
+        self.pool.enqueue(_trace_call, result, "default-1")
+        self.pool.enqueue_priority(5, _trace_call, result, "low")
+        self.pool.enqueue_priority(-1, _trace_call, result, "high-1")
+        self.pool.enqueue(_trace_call, result, "default-2")
+        self.pool.enqueue_priority(-1, _trace_call, result, "high-2")
+
+        self.pool.start()
+        self.assertTrue(self.pool.join(2))
+        self.assertEqual(result, ["high-1", "high-2", "default-1",
+                                  "default-2", "low"])
+
+    def testDefaultPriority(self):
+        """
+        Tests the default priority given to enqueue()
+        """
+        self.pool = threadpool.PriorityThreadPool(1, default_priority=10,
+                                                  starvation_timeout=None)
+        result = []
+        self.pool.enqueue(_trace_call, result, "default")
+        self.pool.enqueue_priority(5, _trace_call, result, "high")
+
+        self.pool.start()
+        self.assertTrue(self.pool.join(2))
+        self.assertEqual(result, ["high", "default"])
+
+    def testStarvation(self):
+        """
+        Tests the execution of tasks waiting for too long
+        """
+        self.pool = threadpool.PriorityThreadPool(1, starvation_timeout=.1)
+        result = []
+        self.pool.enqueue_priority(5, _trace_call, result, "old")
+        time.sleep(.2)
+        self.pool.enqueue_priority(0, _trace_call, result, "new-1")
+        self.pool.enqueue_priority(0, _trace_call, result, "new-2")
+
+        self.pool.start()
+        self.assertTrue(self.pool.join(2))
+        self.assertEqual(result, ["old", "new-1", "new-2"])
+
+    def testStop(self):
+        """
+        Tests stopping a pool with pending tasks
+        """
+        self.pool = threadpool.PriorityThreadPool(1)
+        self.pool.start()
+        future = self.pool.enqueue(_slow_call, .2, 42)
+        for _ in range(5):
+            self.pool.enqueue_priority(1, _slow_call, .2)
+
+        time.sleep(.1)
+        start = time.time()
+        self.pool.stop()
+        self.assertLess(time.time() - start, .5)
+        self.assertEqual(future.result(1), 42)
+
+# ------------------------------------------------------------------------------
+
+
+class KeyedExecutorTest(unittest.TestCase):
+    """
+    Tests the keyed ordered executor
+    """
+    def setUp(self):
+        """
+        Sets up the test
+        """
+        self.pool = threadpool.ThreadPool(4)
+        self.pool.start()
+
+    def tearDown(self):
+        """
+        Cleans up the test
+        """
+        self.pool.stop()
+
+    def testOrder(self):
+        """
+        Tests the execution order of the tasks of each key
+        """
+        executor = threadpool.KeyedExecutor(self.pool, max_batch=3)
+        results = dict((key, []) for key in range(3))
+        all_futures = []
+        for idx in range(30):
+            for key in range(3):
+                all_futures.append(executor.enqueue_keyed(
+                    key, _trace_call, results[key], idx))
+
+        for future in all_futures:
+            future.result(5)
+
+        for key in range(3):
+            self.assertEqual(results[key], list(range(30)))
+        self.assertEqual(len(executor), 0)
+
+    def testParallel(self):
+        """
+        Tests the parallel execution of different keys
+        """
+        executor = threadpool.KeyedExecutor(self.pool)
+        start = time.time()
+        all_futures = [executor.enqueue_keyed(key, _slow_call, .3, key)
+                       for key in range(3)]
+        self.assertEqual([future.result(2) for future in all_futures],
+                         [0, 1, 2])
+        self.assertLess(time.time() - start, .6)
+
+        # Same key: sequential
+        start = time.time()
+        all_futures = [executor.enqueue_keyed("key", _slow_call, .2)
+                       for _ in range(2)]
+        for future in all_futures:
+            future.result(2)
+        self.assertGreaterEqual(time.time() - start, .35)
+
+    def testException(self):
+        """
+        Tests the execution of the next tasks after an error
+        """
+        executor = threadpool.KeyedExecutor(self.pool)
+        result = []
+        failing = executor.enqueue_keyed("key", lambda: 1 // 0)
+        future = executor.enqueue_keyed("key", _trace_call, result, 1)
+        self.assertEqual(future.result(2), None)
+        self.assertRaises(ZeroDivisionError, failing.result, 0)
+        self.assertEqual(result, [1])
+
+        self.assertRaises(ValueError, executor.enqueue_keyed, "key", None)
+
+    def testShutdown(self):
+        """
+        Tests the tasks of a key queued while the pool is shut down
+        """
+        pool = threadpool.ThreadPool(1)
+        pool.start()
+        executor = threadpool.KeyedExecutor(pool, max_batch=1)
+        running = executor.enqueue_keyed("key", _slow_call, .2, 1)
+        pending = executor.enqueue_keyed("key", _slow_call, 0, 2)
+        time.sleep(.1)
+        pool.shutdown(wait=False)
+
+        # The running task ends, the next one can't be queued again
+        self.assertEqual(running.result(2), 1)
+        self.assertRaises(RuntimeError, pending.result, 2)
+        self.assertEqual(len(executor), 0)
+
+        # The key isn't kept by a dead queue
+        self.assertRaises(RuntimeError, executor.enqueue_keyed, "key",
+                          _slow_call, 0)
+        self.assertEqual(len(executor), 0)
+        pool.stop()
+
+# ------------------------------------------------------------------------------
+
+
+class BulkheadTest(unittest.TestCase):
+    """
+    Tests the bulkhead utility class
+    """
+    def testInitParameters(self):
+        """
+        Tests the validity checks on bulkhead creation
+        """
+        for invalid_nb in (0, -1, "abc", None):
+            self.assertRaises(ValueError, threadpool.Bulkhead, invalid_nb)
+
+    def testLimits(self):
+        """
+        Tests the concurrency and waiting limits
+        """
+        bulkhead = threadpool.Bulkhead(1, max_waiting=1)
+        self.assertTrue(bulkhead.acquire())
+        self.assertEqual(bulkhead.active, 1)
+
+        # Second task waits
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(bulkhead.acquire()))
+        thread.start()
+        time.sleep(.2)
+        self.assertEqual(bulkhead.waiting, 1)
+
+        # Third task is rejected
+        self.assertFalse(bulkhead.acquire())
+        self.assertEqual(bulkhead.rejected, 1)
+
+        # Release the slot: the waiting task gets it
+        bulkhead.release()
+        thread.join(2)
+        self.assertEqual(results, [True])
+        self.assertEqual(bulkhead.active, 1)
+        self.assertEqual(bulkhead.waiting, 0)
+
+        bulkhead.release()
+        self.assertEqual(bulkhead.active, 0)
+
+    def testTimeout(self):
+        """
+        Tests the waiting timeout
+        """
+        bulkhead = threadpool.Bulkhead(1, max_waiting=None, timeout=.2)
+        self.assertTrue(bulkhead.acquire())
+
+        start = time.time()
+        self.assertFalse(bulkhead.acquire())
+        self.assertGreaterEqual(time.time() - start, .15)
+        self.assertEqual(bulkhead.rejected, 1)
+
+        bulkhead.release()
+        self.assertTrue(bulkhead.acquire())
+
+# ------------------------------------------------------------------------------
+
 if __name__ == "__main__":
     unittest.main()
@@ -10,6 +10,7 @@ Tests utility classes
 from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer
 
 # Standard library
+import socket
 import threading
 
 # ------------------------------------------------------------------------------
@@ -46,6 +47,41 @@ def get_data():
 def ping():
     return True
 
+# ------------------------------------------------------------------------------
+# Server utility methods
+
+
+def start_server(functions, port=0, server_class=SimpleJSONRPCServer,
+                 **kwargs):
+    """
+    Starts a server on localhost, serving in a daemon thread
+
+    :param functions: A dictionary: method name -> function
+    :param port: A listening port (0 for a random one)
+    :param server_class: The class of the server
+    :param kwargs: Other arguments of the server constructor
+    :return: The server
+    """
+    server = server_class(("localhost", port), logRequests=False, **kwargs)
+    for name, function in functions.items():
+        server.register_function(function, name)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def free_port():
+    """
+    Returns a port where no server listens
+    """
+    sock = socket.socket()
+    sock.bind(("localhost", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
 # ------------------------------------------------------------------------------
 # Server utility class
 